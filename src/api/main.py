@@ -1,20 +1,161 @@
-from typing import Optional
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from typing import Any, Callable, Optional
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+
+import datastore
+from api.world_cache import (
+    DEFAULT_PAGE_LIMIT,
+    MAX_PAGE_LIMIT,
+    InvalidCursorError,
+    WorldCache,
+    WorldSnapshot,
+    page_relations,
+)
+from instrumentation import metrics_path
 
 app = FastAPI()
+world_cache = WorldCache()
+
+
+async def cached_json(
+    request: Request,
+    build: Callable[[WorldSnapshot], Any],
+) -> Response:
+    """
+    Answer from the world snapshot with an ETag of the world version.
+
+    A matching `If-None-Match` gets a bodyless 304, otherwise the body is
+    served from the per-version response cache or built from the snapshot
+    on a worker thread, so slow builds (orbits, search) do not block the loop.
+    """
+    snapshot = await world_cache.snapshot()
+    etag = world_cache.etag(snapshot.version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    key = f"{request.url.path}?{sorted(request.query_params.multi_items())}"
+    try:
+        body = await world_cache.cached_response(snapshot.version, key, lambda: build(snapshot))
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/")
 async def root():
-    return {"message": "Hello World"}
+    snapshot = await world_cache.snapshot()
+    return {"message": "Hello World", "world_version": world_cache.etag(snapshot.version)}
+
+
+# -------------- CHARACTER -----------------
+@app.get("/characters")
+async def list_characters(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+):
+    return await cached_json(request, lambda s: s.page(s.world.characters, s.character_ids, cursor, limit))
+
+@app.get("/characters/{character_id}")
+async def read_character(request: Request, character_id: str):
+    def build(snapshot: WorldSnapshot):
+        character = snapshot.world.get_character(character_id)
+        if character is None:
+            raise HTTPException(status_code=404, detail=f"Character {character_id} not found")
+        return character
+    return await cached_json(request, build)
+
+@app.get("/characters/{character_id}/orbit")
+async def read_character_orbit(
+    request: Request,
+    character_id: str,
+    depth: int = Query(1, ge=1, le=3),
+    min_importance: Optional[int] = Query(None, ge=1, le=10),
+):
+    def build(snapshot: WorldSnapshot):
+        orbit = datastore.get_character_orbits(
+            [character_id],
+            depth=depth,
+            min_importance=min_importance,
+            source=snapshot.world,
+        ).get(character_id)
+        if orbit is None:
+            raise HTTPException(status_code=404, detail=f"Character {character_id} not found")
+        return orbit
+    return await cached_json(request, build)
+
+
+# -------------- LOCATION -----------------
+@app.get("/locations")
+async def list_locations(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+):
+    return await cached_json(request, lambda s: s.page(s.world.locations, s.location_ids, cursor, limit))
+
+@app.get("/locations/{location_id}")
+async def read_location(request: Request, location_id: str):
+    def build(snapshot: WorldSnapshot):
+        location = snapshot.world.get_location(location_id)
+        if location is None:
+            raise HTTPException(status_code=404, detail=f"Location {location_id} not found")
+        return location
+    return await cached_json(request, build)
+
+
+# -------------- RELATION -----------------
+@app.get("/relations")
+async def list_relations(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    x_node_id: Optional[str] = None,
+    y_node_id: Optional[str] = None,
+):
+    return await cached_json(
+        request,
+        lambda s: page_relations(s, cursor, limit, x_node_id=x_node_id, y_node_id=y_node_id),
+    )
+
+
+
+# -------------- SEARCH -----------------
+@app.get("/search")
+async def search(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    types: Optional[list[str]] = Query(None, description="any of character, location, relation"),
+    limit: int = Query(10, ge=1, le=100),
+):
+    def build(snapshot: WorldSnapshot):
+        return [
+            {"entity_type": hit.entity_type, "key": hit.key, "score": hit.score, "entity": hit.entity}
+            for hit in datastore.search(q, entity_types=types, limit=limit, source=snapshot.world)
+        ]
+    return await cached_json(request, build)
 
-@app.get("/items/{item_id}")
-def read_item(item_id: int, q: Optional[str] = None):
-    return {"item_id": item_id, "q": q}
+# -------------- METRICS -----------------
+# opt-in, as it exposes LLM usage; rounds are played by another process
+# (`poetry run start`), which writes its metrics to a file after every round
+if os.environ.get("API_METRICS") == "1":
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        """Prometheus text exposition of the round process's phase timings and LLM usage, as of its last round"""
+        try:
+            text = metrics_path().read_text()
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"No round metrics written to {metrics_path()} yet")
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 
 def start_server():
     """Launched with `poetry run start_server` at root level"""
-    uvicorn.run("src.api.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    uvicorn.run("src.api.main:app", host="0.0.0.0", port=8000, reload=True)
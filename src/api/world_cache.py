@@ -0,0 +1,166 @@
+import asyncio
+import base64
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable
+
+from pydantic.json import pydantic_encoder
+
+import datastore
+from logging_config import logger
+from schema import Character, Location, Relation
+from storage import MemoryBackend, StorageBackend
+from world_store import relation_key
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+# how often a request may trigger a re-read of the backend to pick up writes
+# made by other processes (in-process saves invalidate immediately)
+DEFAULT_RESYNC_SECONDS = float(os.environ.get("API_WORLD_RESYNC_SECONDS", 2.0))
+MAX_CACHED_RESPONSES = 4096
+
+
+class InvalidCursorError(ValueError):
+    """A pagination cursor that was not produced by `encode_cursor`"""
+
+
+def encode_cursor(key: str) -> str:
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+    except ValueError as e:
+        raise InvalidCursorError(f"Invalid cursor {cursor!r}") from e
+
+
+class WorldSnapshot:
+    """Immutable, id-sorted view of the world at one version, safe to read from any number of requests"""
+
+    def __init__(self, world: MemoryBackend, version: int):
+        self.world = world
+        self.version = version
+        self.character_ids = sorted(world.characters)
+        self.location_ids = sorted(world.locations)
+        self.relation_keys = sorted(world.relations)
+
+    def page(
+        self,
+        entities: dict[str, Character] | dict[str, Location] | dict[str, Relation],
+        sorted_keys: list[str],
+        cursor: str | None,
+        limit: int,
+    ) -> dict[str, Any]:
+        """`limit` entities after the `cursor` key, with the cursor to resume from (None on the last page)"""
+        start = bisect.bisect_right(sorted_keys, decode_cursor(cursor)) if cursor else 0
+        keys = sorted_keys[start:start + limit]
+        next_cursor = encode_cursor(keys[-1]) if start + limit < len(sorted_keys) else None
+        return {"items": [entities[key] for key in keys], "next_cursor": next_cursor}
+
+
+class WorldCache:
+    """
+    Versioned in-memory snapshot of the datastore plus serialized responses.
+
+    The version is bumped whenever a save goes through `datastore` in this
+    process, or when a periodic re-read finds the backend changed underneath
+    (e.g. a `start` run in another process); the re-read is skipped while the
+    backend's change stamp stays put. Bumping drops the snapshot and every
+    cached response; the next request rebuilds the snapshot once, off the
+    event loop, and everything else is answered from memory.
+    """
+
+    def __init__(self, resync_seconds: float = DEFAULT_RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        # distinguishes ETags of different server processes
+        self.instance = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._rebuild_lock = asyncio.Lock()
+        self._version = 1
+        self._snapshot: WorldSnapshot | None = None
+        self._synced_at = 0.0
+        # backend and change stamp the snapshot was read at
+        self._synced_stamp: tuple[StorageBackend, Any] | None = None
+        self._responses: dict[str, bytes] = {}
+        datastore.add_save_listener(self._on_saved)
+
+    def close(self) -> None:
+        datastore.remove_save_listener(self._on_saved)
+
+    def _on_saved(self, entity_type: str, entities: list) -> None:
+        if entities:
+            self.invalidate()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+            self._responses = {}
+
+    def etag(self, version: int) -> str:
+        return f'"{self.instance}-{version}"'
+
+    async def snapshot(self) -> WorldSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._synced_at < self.resync_seconds:
+            return snapshot
+        async with self._rebuild_lock:
+            with self._lock:
+                snapshot, version = self._snapshot, self._version
+            if snapshot is not None and time.monotonic() - self._synced_at < self.resync_seconds:
+                return snapshot
+            source: StorageBackend = datastore.backend
+            stamp = await asyncio.to_thread(source.change_stamp)
+            if (
+                snapshot is not None and stamp is not None and self._synced_stamp is not None
+                and self._synced_stamp[0] is source and self._synced_stamp[1] == stamp
+            ):
+                self._synced_at = time.monotonic()
+                return snapshot
+            world = await asyncio.to_thread(MemoryBackend.from_backend, source)
+            with self._lock:
+                if self._version != version:
+                    # a save landed while reading, the read may or may not include it:
+                    # answer this request from it but leave the next one to rebuild
+                    return WorldSnapshot(world, version)
+                if snapshot is not None and not world.same_world(snapshot.world):
+                    logger.debug(f"World changed outside this process, bumping version past {version}")
+                    self._version += 1
+                    self._responses = {}
+                self._snapshot = WorldSnapshot(world, self._version)
+                self._synced_at = time.monotonic()
+                self._synced_stamp = (source, stamp) if stamp is not None else None
+                return self._snapshot
+
+    async def cached_response(self, version: int, key: str, build: Callable[[], Any]) -> bytes:
+        """Serialized `build()`, memoized per version and request key; built and serialized off the event loop"""
+        with self._lock:
+            body = self._responses.get(key) if version == self._version else None
+        if body is not None:
+            return body
+        body = await asyncio.to_thread(lambda: json.dumps(build(), default=pydantic_encoder, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            if version == self._version:
+                if len(self._responses) >= MAX_CACHED_RESPONSES:
+                    self._responses.pop(next(iter(self._responses)))
+                self._responses[key] = body
+        return body
+
+
+def page_relations(
+    snapshot: WorldSnapshot,
+    cursor: str | None,
+    limit: int,
+    x_node_id: str | None = None,
+    y_node_id: str | None = None,
+) -> dict[str, Any]:
+    world = snapshot.world
+    if x_node_id is None and y_node_id is None:
+        return snapshot.page(world.relations, snapshot.relation_keys, cursor, limit)
+    # filtered by a node: page over its (small) outgoing or incoming adjacency list instead of every relation
+    relations = {relation_key(r): r for r in world.get_relations(x_node_id_eq=x_node_id, y_node_id_eq=y_node_id)}
+    return snapshot.page(relations, sorted(relations), cursor, limit)
@@ -0,0 +1,91 @@
+"""
+Deterministic stand-in for `interlab.actor.OneShotLLMActor`.
+
+Responses depend only on what the actor observed and was asked, never on
+timing or thread order, and each query sleeps for `latency` seconds to
+stand in for the network round trip.
+"""
+import contextlib
+import hashlib
+import random
+import threading
+import time
+from typing import Any, Iterator
+
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
+from util import str_to_safe_id
+
+from benchmarks.synthetic_world import SYLLABLES
+
+
+class FakeLLMActor:
+    calls = 0
+    _calls_lock = threading.Lock()
+
+    def __init__(self, name: str, model: Any = None, system_prompt: str | None = None, latency: float = 0.0, **kwargs):
+        self.name = name
+        self.system_prompt = system_prompt
+        self.latency = latency
+        self.observations: list[str] = []
+
+    def observe(self, observation: Any) -> None:
+        self.observations.append(str(observation))
+
+    def _rng(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256("\n".join([self.name, *self.observations, prompt]).encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def query(self, prompt: str, expected_type: type | None = None) -> Any:
+        with FakeLLMActor._calls_lock:
+            FakeLLMActor.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        rng = self._rng(str(prompt))
+        if expected_type is None:
+            return self._vignette(rng)
+        return self._analysis(rng, expected_type)
+
+    def _vignette(self, rng: random.Random) -> str:
+        # the director observes "We turn our attention to the story of <name>"
+        focus = next((o.rsplit(" of ", 1)[-1] for o in self.observations if o.startswith("We turn our attention")), "someone")
+        return f"{focus} spends the afternoon fixing a water recycler and meets {rng.choice(SYLLABLES).capitalize()} on the way home."
+
+    def _analysis(self, rng: random.Random, expected_type: type) -> Any:
+        name = " ".join("".join(rng.choice(SYLLABLES) for _ in range(3)).capitalize() for _ in range(2))
+        location_name = f"The {''.join(rng.choice(SYLLABLES) for _ in range(2)).capitalize()} Kiosk"
+        character = Character(id=str_to_safe_id(name), name=name, description="A newcomer to the boulevard.")
+        location = Location(id=str_to_safe_id(location_name), name=location_name, description="A small kiosk.")
+        return expected_type(
+            features_existing_characters=[],
+            new_characters=[character],
+            new_locations=[location],
+            features_existing_locations=[],
+            new_relations=[Relation(
+                x_node_id=character.id,
+                x_node_type=CHARACTER_NODE,
+                y_node_id=location.id,
+                y_node_type=LOCATION_NODE,
+                description=f"{name} works at {location_name}",
+                importance=rng.randint(1, 10),
+            )],
+            features_existing_relations=[],
+        )
+
+
+@contextlib.contextmanager
+def fake_llm_actors(latency: float = 0.0) -> Iterator[type[FakeLLMActor]]:
+    """Route the director and archivist through `FakeLLMActor` for the duration of the block"""
+    import turn
+    import upkeep
+
+    def create_fake_actor(name: str, model: Any, system_prompt: str, **kwargs) -> FakeLLMActor:
+        return FakeLLMActor(name=name, model=model, system_prompt=system_prompt, latency=latency, **kwargs)
+
+    originals = (turn.create_llm_actor, upkeep.create_llm_actor, turn.get_model, upkeep.get_model)
+    turn.create_llm_actor = upkeep.create_llm_actor = create_fake_actor
+    # no OpenAI client (or key) needed for a fake run
+    turn.get_model = upkeep.get_model = lambda model_name: model_name
+    try:
+        yield FakeLLMActor
+    finally:
+        (turn.create_llm_actor, upkeep.create_llm_actor, turn.get_model, upkeep.get_model) = originals
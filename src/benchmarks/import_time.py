@@ -0,0 +1,83 @@
+"""
+Import-time benchmark for the entry-point modules.
+
+Each module is imported `repeats` times in a fresh interpreter, recording the
+wall-clock import time plus what the import dragged in: heavy third-party
+packages, logging handlers and open file descriptors. Results are written as
+JSON so they can be compared between commits.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.parent.resolve()
+DEFAULT_MODULES = ["datastore", "upkeep", "turn", "run", "api.main"]
+HEAVY_PACKAGES = ["langchain", "interlab", "openai", "fastapi", "uvicorn"]
+DEFAULT_REPEATS = 5
+
+_PROBE = """
+import json, logging, os, sys, time
+before_fds = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+after_fds = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+print(json.dumps({
+    "seconds": seconds,
+    "heavy_packages": [p for p in sys.argv[2:] if p in sys.modules],
+    "root_log_handlers": [type(h).__name__ for h in logging.getLogger().handlers],
+    "opened_fds": None if before_fds is None else after_fds - before_fds,
+}))
+"""
+
+
+def measure_import(module: str, repeats: int = DEFAULT_REPEATS) -> dict:
+    env = {**os.environ, "PYTHONPATH": str(SRC_DIR)}
+    env.setdefault("OPENAI_API_KEY", "import-time-benchmark")
+    samples = []
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [sys.executable, "-c", _PROBE, module, *HEAVY_PACKAGES],
+            cwd=SRC_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    seconds = [s["seconds"] for s in samples]
+    return {
+        "module": module,
+        "repeats": repeats,
+        "median_seconds": statistics.median(seconds),
+        "min_seconds": min(seconds),
+        "heavy_packages": samples[-1]["heavy_packages"],
+        "root_log_handlers": samples[-1]["root_log_handlers"],
+        "opened_fds": samples[-1]["opened_fds"],
+    }
+
+
+def run_benchmark(
+    modules: list[str] = DEFAULT_MODULES,
+    repeats: int = DEFAULT_REPEATS,
+) -> list[dict]:
+    return [measure_import(module, repeats) for module in modules]
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--output", type=Path, help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = json.dumps(run_benchmark(args.modules, args.repeats), indent=4)
+    if args.output is None:
+        print(results)
+    else:
+        args.output.write_text(results)
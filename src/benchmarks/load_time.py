@@ -0,0 +1,133 @@
+"""
+Load-time benchmark for trusted loads on synthetic worlds.
+
+For each world size a synthetic world is written to every checksummed
+backend, then a freshly opened backend reads the whole world back, once
+with every record validated and once through the trusted path
+(`trusted_load`). Building the models from already-read records is timed
+separately, as file I/O dominates a cold read of a JSON directory. Results
+are written as JSON so they can be compared between commits.
+"""
+import json
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic_world import generate_world
+from benchmarks.world_harness import BACKENDS, _git_commit, time_call
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS
+from schema import Character, Location, Relation
+from storage import StorageBackend
+from trusted_load import encode_record, load_model, record_checksum, trusted_load
+
+DEFAULT_SIZES = [10_000, 100_000]
+# the SQLite backend stores no checksums, so it always validates
+DEFAULT_BACKENDS = ["json", "json-sharded", "packed"]
+DEFAULT_REPEATS = 3
+MODELS = {CHARACTERS: Character, LOCATIONS: Location, RELATIONS: Relation}
+
+
+def read_world(backend: StorageBackend) -> int:
+    return len(backend.get_characters()) + len(backend.get_locations()) + len(backend.get_relations())
+
+
+def bench_models(records: dict[str, list[dict]], repeats: int = DEFAULT_REPEATS) -> dict:
+    """Models built from in-memory records and their checksums, without any I/O"""
+    stored = {
+        table: [(record, record_checksum(record), encode_record(record)) for record in table_records]
+        for (table, table_records) in records.items()
+    }
+
+    def build() -> None:
+        for (table, table_records) in stored.items():
+            for (record, stored_checksum, encoded) in table_records:
+                load_model(MODELS[table], record, stored_checksum, encoded)
+
+    timings = {}
+    for (mode, enabled) in (("validated", False), ("trusted", True)):
+        with trusted_load(enabled):
+            timings[mode] = time_call(build, repeats)
+    timings["speedup"] = timings["validated"]["median_seconds"] / timings["trusted"]["median_seconds"]
+    return timings
+
+
+def bench_backend(world_dir: Path, backend_name: str, repeats: int = DEFAULT_REPEATS) -> dict:
+    """Full reads of the world in `world_dir`, each by a freshly opened backend"""
+    timings = {}
+    for (mode, enabled) in (("validated", False), ("trusted", True)):
+        samples = []
+        with trusted_load(enabled):
+            for _ in range(repeats):
+                backend = BACKENDS[backend_name](world_dir)
+                start = time.perf_counter()
+                read_world(backend)
+                samples.append(time.perf_counter() - start)
+                if hasattr(backend, "close"):
+                    backend.close()
+        timings[mode] = {"median_seconds": statistics.median(samples), "min_seconds": min(samples)}
+    timings["speedup"] = timings["validated"]["median_seconds"] / timings["trusted"]["median_seconds"]
+    return timings
+
+
+def bench_load(
+    size: int,
+    backend_names: list[str] = DEFAULT_BACKENDS,
+    repeats: int = DEFAULT_REPEATS,
+    seed: int = 0,
+) -> dict:
+    world = generate_world(size, seed=seed)
+    records = {
+        CHARACTERS: [c.__dict__ for c in world.characters],
+        LOCATIONS: [l.__dict__ for l in world.locations],
+        RELATIONS: [r.__dict__ for r in world.relations],
+    }
+    backends = {}
+    for backend_name in backend_names:
+        with tempfile.TemporaryDirectory(prefix="load_time_") as tmp:
+            world_dir = Path(tmp)
+            backend = BACKENDS[backend_name](world_dir)
+            world.save_to(backend)
+            if hasattr(backend, "close"):
+                backend.close()
+            backends[backend_name] = bench_backend(world_dir, backend_name, repeats)
+    return {
+        "size": size,
+        "characters": len(world.characters),
+        "locations": len(world.locations),
+        "relations": len(world.relations),
+        "models": bench_models(records, repeats),
+        "backends": backends,
+    }
+
+
+def run_benchmark(
+    sizes: list[int] = DEFAULT_SIZES,
+    backend_names: list[str] = DEFAULT_BACKENDS,
+    repeats: int = DEFAULT_REPEATS,
+    seed: int = 0,
+) -> dict:
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "results": [bench_load(size, backend_names, repeats, seed) for size in sizes],
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of characters, e.g. 10000 100000")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=DEFAULT_BACKENDS)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = json.dumps(run_benchmark(args.sizes, args.backends, args.repeats, args.seed), indent=4)
+    if args.output is None:
+        print(results)
+    else:
+        args.output.write_text(results)
@@ -0,0 +1,99 @@
+"""
+Synthetic world generator for benchmarks.
+
+Worlds are reproducible from a seed. Relation endpoints are drawn from a
+Zipf-like distribution over a shuffled ranking of nodes, so a few hubs
+(the popular café, the gossip) carry most relations while the long tail
+has one or two, roughly what the LLM-grown worlds look like.
+"""
+import itertools
+import random
+from dataclasses import dataclass
+
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
+from storage import StorageBackend
+from util import str_to_safe_id
+
+SYLLABLES = [
+    "ka", "ri", "ze", "mo", "lu", "ta", "ni", "vo", "sa", "el",
+    "an", "dra", "kel", "mir", "os", "pa", "qui", "ren", "shi", "tor",
+    "ul", "ve", "wyn", "xa", "yo", "zu", "bel", "cor", "dai", "fen",
+]
+LOCATION_KINDS = ["Cafe", "Market", "Clinic", "Garden", "Workshop", "Commune", "Studio", "Lab", "Arcade", "Dock"]
+RELATION_VERBS = ["works at", "is friends with", "owes money to", "grew up with", "visits", "supplies", "mentors", "avoids"]
+
+DEGREE_SKEW = 1.1
+LOCATIONS_PER_CHARACTER = 0.25
+RELATIONS_PER_CHARACTER = 3
+
+
+@dataclass
+class SyntheticWorld:
+    characters: list[Character]
+    locations: list[Location]
+    relations: list[Relation]
+
+    def save_to(self, backend: StorageBackend) -> None:
+        backend.save_characters(self.characters)
+        backend.save_locations(self.locations)
+        backend.save_relations(self.relations)
+
+
+def _word(rng: random.Random, min_syllables: int = 2, max_syllables: int = 3) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(min_syllables, max_syllables))).capitalize()
+
+def _unique_names(rng: random.Random, count: int, make_name) -> list[str]:
+    names: dict[str, str] = {}
+    while len(names) < count:
+        name = make_name()
+        names.setdefault(str_to_safe_id(name), name)
+    return list(names.values())
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(_word(rng, 1, 3).lower() for _ in range(words)).capitalize() + "."
+
+
+def _zipf_cum_weights(count: int) -> list[float]:
+    return list(itertools.accumulate(1 / (rank ** DEGREE_SKEW) for rank in range(1, count + 1)))
+
+
+def generate_world(
+    num_characters: int,
+    num_locations: int | None = None,
+    num_relations: int | None = None,
+    seed: int = 0,
+) -> SyntheticWorld:
+    """`num_locations` and `num_relations` default to fixed ratios of `num_characters`"""
+    rng = random.Random(seed)
+    num_locations = num_locations if num_locations is not None else max(1, int(num_characters * LOCATIONS_PER_CHARACTER))
+    num_relations = num_relations if num_relations is not None else num_characters * RELATIONS_PER_CHARACTER
+
+    characters = [
+        Character(id=str_to_safe_id(name), name=name, description=_sentence(rng, 12))
+        for name in _unique_names(rng, num_characters, lambda: f"{_word(rng)} {_word(rng)}")
+    ]
+    locations = [
+        Location(id=str_to_safe_id(name), name=name, description=_sentence(rng, 16))
+        for name in _unique_names(rng, num_locations, lambda: f"The {_word(rng)} {rng.choice(LOCATION_KINDS)}")
+    ]
+
+    # popularity ranking independent of id order
+    nodes = [(CHARACTER_NODE, c.id) for c in characters] + [(LOCATION_NODE, l.id) for l in locations]
+    rng.shuffle(nodes)
+    cum_weights = _zipf_cum_weights(len(nodes))
+    max_relations = len(nodes) * (len(nodes) - 1)
+    relations: dict[tuple[str, str], Relation] = {}
+    while len(relations) < min(num_relations, max_relations):
+        (x_node_type, x_node_id) = rng.choice(nodes) if rng.random() < 0.5 else rng.choices(nodes, cum_weights=cum_weights)[0]
+        (y_node_type, y_node_id) = rng.choices(nodes, cum_weights=cum_weights)[0]
+        if x_node_id == y_node_id or (x_node_id, y_node_id) in relations:
+            continue
+        relations[(x_node_id, y_node_id)] = Relation(
+            x_node_id=x_node_id,
+            x_node_type=x_node_type,
+            y_node_id=y_node_id,
+            y_node_type=y_node_type,
+            description=f"{x_node_id} {rng.choice(RELATION_VERBS)} {y_node_id}",
+            importance=rng.randint(1, 10),
+        )
+    return SyntheticWorld(characters=characters, locations=locations, relations=list(relations.values()))
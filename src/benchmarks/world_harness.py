@@ -0,0 +1,240 @@
+"""
+Harness overhead benchmark on synthetic worlds.
+
+For each world size a synthetic world is generated into a temporary
+directory and the datastore reads, orbit resolution, world logging and
+upkeep id normalization are timed against it; the memory held by a fully
+loaded world is compared between models and `CompactWorld`. Last comes an
+end-to-end `play_rounds` run with a fake LLM actor. Results are written as JSON so
+they can be compared between commits.
+"""
+import contextlib
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Iterator
+
+import datastore
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS
+from schema import Character, Location, Relation
+from storage import JsonDirectoryBackend, MemoryBackend, PackedBackend, SqliteBackend, StorageBackend
+
+from benchmarks.fake_llm import fake_llm_actors
+from benchmarks.synthetic_world import generate_world
+
+DEFAULT_SIZES = [1_000, 10_000]
+DEFAULT_BACKEND = "json"
+DEFAULT_REPEATS = 3
+DEFAULT_SAMPLE_SIZE = 100
+DEFAULT_ROUNDS = 3
+DEFAULT_LATENCY = 0.0
+BACKENDS: dict[str, Callable[[Path], StorageBackend]] = {
+    "json": lambda world_dir: JsonDirectoryBackend(world_dir / "data"),
+    "json-sharded": lambda world_dir: JsonDirectoryBackend(world_dir / "data", sharded=True),
+    "sqlite": lambda world_dir: SqliteBackend(world_dir / "world.sqlite3"),
+    "packed": lambda world_dir: PackedBackend(world_dir / "world.pack"),
+}
+
+
+def time_call(fn: Callable[[], object], repeats: int = DEFAULT_REPEATS) -> dict[str, float]:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"median_seconds": statistics.median(samples), "min_seconds": min(samples)}
+
+
+def traced_bytes(fn: Callable[[], object]) -> int:
+    """Memory still held by the result of `fn()`, as seen by tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        (held, _) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return held
+
+
+@contextlib.contextmanager
+def discarded_logs(level: int = logging.INFO) -> Iterator[None]:
+    """Format log records as a real run would, but write them nowhere"""
+    root = logging.getLogger()
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    (original_level, original_handlers) = (root.level, root.handlers[:])
+    root.handlers = [handler]
+    root.setLevel(level)
+    try:
+        yield
+    finally:
+        root.handlers = original_handlers
+        root.setLevel(original_level)
+        handler.stream.close()
+
+
+def _proposed_entities(model: type, existing: list, count: int, rng: random.Random) -> list:
+    """Half near-duplicates of existing entities (so resolution has matches to find), half new"""
+    proposed = []
+    for n in range(count):
+        if n % 2 == 0 and existing:
+            entity = rng.choice(existing)
+            proposed.append(model(id=f"llm_{n}", name=f"{entity.name}s", description=entity.description))
+        else:
+            proposed.append(model(id=f"llm_{n}", name=f"Brandnew Person {n}", description="Someone nobody has met yet."))
+    return proposed
+
+
+def bench_world(
+    size: int,
+    backend_name: str = DEFAULT_BACKEND,
+    repeats: int = DEFAULT_REPEATS,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    rounds: int = DEFAULT_ROUNDS,
+    latency: float = DEFAULT_LATENCY,
+    seed: int = 0,
+) -> dict:
+    import upkeep
+    from logging_extras import log_the_world_so_far
+    from turn import play_rounds
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    world = generate_world(size, seed=seed)
+    generate_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory(prefix="world_harness_") as tmp:
+        world_dir = Path(tmp)
+        backend = BACKENDS[backend_name](world_dir)
+        start = time.perf_counter()
+        world.save_to(backend)
+        write_seconds = time.perf_counter() - start
+        if hasattr(backend, "close"):
+            backend.close()
+
+        timings: dict[str, dict[str, float]] = {}
+        character_ids = [c.id for c in rng.sample(world.characters, min(sample_size, len(world.characters)))]
+        with datastore.using_backend(BACKENDS[backend_name](world_dir)) as backend, discarded_logs():
+            # first full read of a freshly opened backend, then warm ones
+            timings["get_characters_cold"] = time_call(datastore.get_characters, repeats=1)
+            timings["get_characters"] = time_call(datastore.get_characters, repeats)
+            timings["get_locations"] = time_call(datastore.get_locations, repeats)
+            timings["get_relations"] = time_call(datastore.get_relations, repeats)
+            timings["get_character_x100"] = time_call(lambda: [datastore.get_character(id) for id in character_ids], repeats)
+            characters = datastore.get_characters(id_in=character_ids)
+            timings["get_character_orbit_x100"] = time_call(lambda: [datastore.get_character_orbit(c) for c in characters], repeats)
+            timings["get_character_orbits_batch_100"] = time_call(lambda: datastore.get_character_orbits(character_ids), repeats)
+            timings["log_the_world_so_far"] = time_call(log_the_world_so_far, repeats)
+            timings["load_compact_world"] = time_call(datastore.load_compact_world, repeats)
+            memory = {
+                # freshly built, as the json backend's cached models would not show up
+                "models_bytes": traced_bytes(lambda: MemoryBackend(
+                    [Character(**r) for r in backend.iter_raw(CHARACTERS)],
+                    [Location(**r) for r in backend.iter_raw(LOCATIONS)],
+                    [Relation(**r) for r in backend.iter_raw(RELATIONS)],
+                )),
+                "compact_world_bytes": traced_bytes(datastore.load_compact_world),
+            }
+
+            # copies, as normalization rewrites ids in place
+            proposed_characters = _proposed_entities(Character, world.characters, 20, rng)
+            proposed_locations = _proposed_entities(Location, world.locations, 20, rng)
+            timings["normalize_character_ids_first"] = time_call(
+                lambda: upkeep.normalize_character_ids([c.copy() for c in proposed_characters]), repeats=1)
+            timings["normalize_character_ids"] = time_call(
+                lambda: upkeep.normalize_character_ids([c.copy() for c in proposed_characters]), repeats)
+            timings["normalize_location_ids_first"] = time_call(
+                lambda: upkeep.normalize_location_ids([l.copy() for l in proposed_locations]), repeats=1)
+            timings["normalize_location_ids"] = time_call(
+                lambda: upkeep.normalize_location_ids([l.copy() for l in proposed_locations]), repeats)
+
+            with fake_llm_actors(latency=latency) as fake_actor:
+                calls_before = fake_actor.calls
+                start = time.perf_counter()
+                play_rounds(num_rounds=rounds, seed=seed, journal_path=world_dir / "journal.jsonl")
+                play_rounds_seconds = time.perf_counter() - start
+                llm_calls = fake_actor.calls - calls_before
+            if hasattr(backend, "close"):
+                backend.close()
+
+    return {
+        "size": size,
+        "backend": backend_name,
+        "characters": len(world.characters),
+        "locations": len(world.locations),
+        "relations": len(world.relations),
+        "generate_seconds": generate_seconds,
+        "write_seconds": write_seconds,
+        "timings": timings,
+        "memory": memory,
+        "play_rounds": {
+            "rounds": rounds,
+            "llm_latency_seconds": latency,
+            "llm_calls": llm_calls,
+            "seconds": play_rounds_seconds,
+            # concurrent calls overlap, so this is a lower bound on harness overhead;
+            # run with latency 0 for the overhead alone
+            "seconds_minus_llm_latency": max(0.0, play_rounds_seconds - llm_calls * latency),
+        },
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    sizes: list[int] = DEFAULT_SIZES,
+    backend_name: str = DEFAULT_BACKEND,
+    repeats: int = DEFAULT_REPEATS,
+    rounds: int = DEFAULT_ROUNDS,
+    latency: float = DEFAULT_LATENCY,
+    seed: int = 0,
+) -> dict:
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "results": [
+            bench_world(size, backend_name=backend_name, repeats=repeats, rounds=rounds, latency=latency, seed=seed)
+            for size in sizes
+        ],
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="numbers of characters, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=DEFAULT_BACKEND)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds each fake LLM query sleeps")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = json.dumps(
+        run_benchmark(args.sizes, args.backend, args.repeats, args.rounds, args.latency, args.seed),
+        indent=4,
+    )
+    if args.output is None:
+        print(results)
+    else:
+        args.output.write_text(results)
@@ -0,0 +1,94 @@
+import threading
+from dataclasses import dataclass, field
+
+import datastore
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
+
+
+def _entity_key(entity_type: str, entity) -> str | tuple[str, str]:
+    if entity_type == datastore.RELATION_ENTITY:
+        return (entity.x_node_id, entity.y_node_id)
+    return entity.id
+
+
+@dataclass
+class WorldDelta:
+    created_characters: list[Character] = field(default_factory=list)
+    modified_characters: list[Character] = field(default_factory=list)
+    created_locations: list[Location] = field(default_factory=list)
+    modified_locations: list[Location] = field(default_factory=list)
+    created_relations: list[Relation] = field(default_factory=list)
+    modified_relations: list[Relation] = field(default_factory=list)
+
+    def is_empty(self) -> bool:
+        return not any(self.__dict__.values())
+
+
+class WorldChangeTracker:
+    """
+    Records which entities were saved since the last `drain()`.
+
+    Whether a save created or modified an entity is decided against the keys
+    seen at the last `checkpoint()` plus everything saved since, so only ids
+    are kept for the untouched part of the world. Saves before the first
+    checkpoint count as modifications.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._known: dict[str, set] = {
+            CHARACTER_NODE: set(),
+            LOCATION_NODE: set(),
+            datastore.RELATION_ENTITY: set(),
+        }
+        self._has_checkpoint = False
+        self._created: dict[str, dict] = {entity_type: {} for entity_type in self._known}
+        self._modified: dict[str, dict] = {entity_type: {} for entity_type in self._known}
+
+    @property
+    def has_checkpoint(self) -> bool:
+        return self._has_checkpoint
+
+    def on_saved(self, entity_type: str, entities: list) -> None:
+        """`datastore` save listener"""
+        with self._lock:
+            known = self._known[entity_type]
+            for entity in entities:
+                key = _entity_key(entity_type, entity)
+                if key in self._created[entity_type]:
+                    self._created[entity_type][key] = entity
+                elif key in known or not self._has_checkpoint:
+                    self._modified[entity_type][key] = entity
+                else:
+                    self._created[entity_type][key] = entity
+                known.add(key)
+
+    def checkpoint(
+        self,
+        characters: list[Character],
+        locations: list[Location],
+        relations: list[Relation],
+    ) -> None:
+        """Reset the baseline to a full view of the world and forget pending changes"""
+        with self._lock:
+            self._known[CHARACTER_NODE] = {c.id for c in characters}
+            self._known[LOCATION_NODE] = {l.id for l in locations}
+            self._known[datastore.RELATION_ENTITY] = {(r.x_node_id, r.y_node_id) for r in relations}
+            self._has_checkpoint = True
+            for pending in (*self._created.values(), *self._modified.values()):
+                pending.clear()
+
+    def drain(self) -> WorldDelta:
+        """Changes since the last drain/checkpoint, clearing them"""
+        with self._lock:
+            delta = WorldDelta(
+                created_characters=list(self._created[CHARACTER_NODE].values()),
+                modified_characters=list(self._modified[CHARACTER_NODE].values()),
+                created_locations=list(self._created[LOCATION_NODE].values()),
+                modified_locations=list(self._modified[LOCATION_NODE].values()),
+                created_relations=list(self._created[datastore.RELATION_ENTITY].values()),
+                modified_relations=list(self._modified[datastore.RELATION_ENTITY].values()),
+            )
+            for pending in (*self._created.values(), *self._modified.values()):
+                pending.clear()
+        return delta
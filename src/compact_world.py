@@ -0,0 +1,218 @@
+import sys
+from array import array
+from typing import Iterable, Iterator
+
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
+from storage import StorageBackend
+from world_store import NodeKey
+
+# node type enum stored in the int8 `node_types` column
+NODE_TYPE_CODES = {CHARACTER_NODE: 0, LOCATION_NODE: 1}
+NODE_TYPE_NAMES = {code: name for (name, code) in NODE_TYPE_CODES.items()}
+# importances are LLM-supplied and unbounded; stored clamped to int8, short of its lowest value
+IMPORTANCE_MIN = -127
+IMPORTANCE_MAX = 127
+# `Relation.importance` is optional; int8 column value standing for None, outside the stored range
+IMPORTANCE_UNKNOWN = -128
+
+
+class StringColumn:
+    """Strings packed back to back in one UTF-8 buffer; each is only decoded when asked for"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array("Q", [0])
+
+    def append(self, text: str | None) -> int:
+        self._data += (text or "").encode("utf-8")
+        self._offsets.append(len(self._data))
+        return len(self._offsets) - 2
+
+    def __getitem__(self, i: int) -> str:
+        return self._data[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def nbytes(self) -> int:
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+def _csr(keys: array, num_nodes: int) -> tuple[array, array]:
+    """Counting sort of relation rows by node handle: rows of node h are `index[offsets[h]:offsets[h + 1]]`"""
+    offsets = array("l", [0] * (num_nodes + 1))
+    for handle in keys:
+        offsets[handle + 1] += 1
+    for handle in range(num_nodes):
+        offsets[handle + 1] += offsets[handle]
+    index = array("l", [0] * len(keys))
+    cursor = array("l", offsets[:-1])
+    for (row, handle) in enumerate(keys):
+        index[cursor[handle]] = row
+        cursor[handle] += 1
+    return (offsets, index)
+
+
+class CompactWorld:
+    """
+    Read-only, columnar copy of a world for bulk and analytic work.
+
+    Characters and locations share one space of integer node handles; ids are
+    interned and kept once, node types are an int8 enum column, and names and
+    descriptions live in packed `StringColumn`s. Relations are parallel arrays
+    of (x handle, y handle, int8 importance) with CSR adjacency both ways.
+    Nodes referenced by a relation but missing from the world get a handle
+    with no entity behind it. Pydantic models are only built by the accessors
+    that hand out a single entity (`character`, `location`, `relation`, ...).
+    """
+
+    def __init__(self):
+        self.node_ids: list[str] = []
+        self.node_types = array("b")
+        # row in `names`/`descriptions`, -1 for nodes only known from relations
+        self._node_rows = array("l")
+        self._handles: dict[str, dict[str, int]] = {CHARACTER_NODE: {}, LOCATION_NODE: {}}
+        self.names = StringColumn()
+        self.descriptions = StringColumn()
+
+        self.relation_x = array("l")
+        self.relation_y = array("l")
+        self.relation_importance = array("b")
+        self.relation_descriptions = StringColumn()
+        self._outgoing: tuple[array, array] | None = None
+        self._incoming: tuple[array, array] | None = None
+
+    # -------------- BUILD -----------------
+    @classmethod
+    def from_backend(cls, backend: StorageBackend) -> "CompactWorld":
+        world = cls()
+        for record in backend.iter_raw(CHARACTERS):
+            world._add_node(CHARACTER_NODE, record)
+        for record in backend.iter_raw(LOCATIONS):
+            world._add_node(LOCATION_NODE, record)
+        for record in backend.iter_raw(RELATIONS):
+            world._add_relation(record)
+        world._build_adjacency()
+        return world
+
+    def _handle(self, node_type: str, id: str) -> int:
+        handles = self._handles[node_type]
+        handle = handles.get(id)
+        if handle is None:
+            handle = len(self.node_ids)
+            handles[id] = handle
+            self.node_ids.append(sys.intern(id))
+            self.node_types.append(NODE_TYPE_CODES[node_type])
+            self._node_rows.append(-1)
+        return handle
+
+    def _add_node(self, node_type: str, record: dict) -> None:
+        handle = self._handle(node_type, record["id"])
+        self._node_rows[handle] = self.names.append(record["name"])
+        self.descriptions.append(record["description"])
+
+    def _add_relation(self, record: dict) -> None:
+        self.relation_x.append(self._handle(record["x_node_type"], record["x_node_id"]))
+        self.relation_y.append(self._handle(record["y_node_type"], record["y_node_id"]))
+        importance = record.get("importance")
+        self.relation_importance.append(
+            IMPORTANCE_UNKNOWN if importance is None else min(max(importance, IMPORTANCE_MIN), IMPORTANCE_MAX)
+        )
+        self.relation_descriptions.append(record["description"])
+
+    def _build_adjacency(self) -> None:
+        self._outgoing = _csr(self.relation_x, len(self.node_ids))
+        self._incoming = _csr(self.relation_y, len(self.node_ids))
+
+    # -------------- NODES -----------------
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_relations(self) -> int:
+        return len(self.relation_x)
+
+    def handle(self, node_type: str, id: str) -> int | None:
+        return self._handles[node_type].get(id)
+
+    def handles(self, node_type: str) -> Iterable[int]:
+        """Handles of every stored entity of `node_type`"""
+        return (h for h in self._handles[node_type].values() if self._node_rows[h] >= 0)
+
+    def node_key(self, handle: int) -> NodeKey:
+        return (NODE_TYPE_NAMES[self.node_types[handle]], self.node_ids[handle])
+
+    def name(self, handle: int) -> str | None:
+        row = self._node_rows[handle]
+        return self.names[row] if row >= 0 else None
+
+    def description(self, handle: int) -> str | None:
+        row = self._node_rows[handle]
+        return self.descriptions[row] if row >= 0 else None
+
+    def _entity(self, model: type, node_type: str, id: str):
+        handle = self.handle(node_type, id)
+        if handle is None or self._node_rows[handle] < 0:
+            return None
+        row = self._node_rows[handle]
+        return model(id=self.node_ids[handle], name=self.names[row], description=self.descriptions[row])
+
+    def character(self, id: str) -> Character | None:
+        return self._entity(Character, CHARACTER_NODE, id)
+
+    def location(self, id: str) -> Location | None:
+        return self._entity(Location, LOCATION_NODE, id)
+
+    # -------------- RELATIONS -----------------
+    def outgoing_rows(self, handle: int) -> array:
+        (offsets, index) = self._outgoing
+        return index[offsets[handle]:offsets[handle + 1]]
+
+    def incoming_rows(self, handle: int) -> array:
+        (offsets, index) = self._incoming
+        return index[offsets[handle]:offsets[handle + 1]]
+
+    def out_degree(self, handle: int) -> int:
+        offsets = self._outgoing[0]
+        return offsets[handle + 1] - offsets[handle]
+
+    def in_degree(self, handle: int) -> int:
+        offsets = self._incoming[0]
+        return offsets[handle + 1] - offsets[handle]
+
+    def relation(self, row: int) -> Relation:
+        (x_node_type, x_node_id) = self.node_key(self.relation_x[row])
+        (y_node_type, y_node_id) = self.node_key(self.relation_y[row])
+        importance = self.relation_importance[row]
+        return Relation(
+            x_node_id=x_node_id,
+            x_node_type=x_node_type,
+            y_node_id=y_node_id,
+            y_node_type=y_node_type,
+            description=self.relation_descriptions[row],
+            importance=None if importance == IMPORTANCE_UNKNOWN else importance,
+        )
+
+    def relations_of(self, node_type: str, id: str) -> Iterator[Relation]:
+        """Outgoing then incoming relations of one node, as models"""
+        handle = self.handle(node_type, id)
+        if handle is None:
+            return
+        for row in self.outgoing_rows(handle):
+            yield self.relation(row)
+        for row in self.incoming_rows(handle):
+            yield self.relation(row)
+
+    # -------------- SIZE -----------------
+    def nbytes(self) -> int:
+        """Approximate memory held, counting each interned id string once"""
+        columns = [self.node_types, self._node_rows, self.relation_x, self.relation_y, self.relation_importance]
+        columns += [*self._outgoing, *self._incoming] if self._outgoing is not None else []
+        return (
+            sum(c.itemsize * len(c) for c in columns)
+            + self.names.nbytes() + self.descriptions.nbytes() + self.relation_descriptions.nbytes()
+            + sys.getsizeof(self.node_ids) + sum(sys.getsizeof(id) for id in self.node_ids)
+            + sum(sys.getsizeof(handles) for handles in self._handles.values())
+        )
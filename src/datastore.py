@@ -1,208 +1,363 @@
-import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Iterator, Sequence
 
-from logging_config import logger
+from logging_config import entity_dumps_enabled, logger
 from schema import (
     Character,
     CharacterOrbit,
     Location,
     Relation,
-    CHARACTER_NODE_TYPE,
-    LOCATION_NODE_TYPE,
+    CHARACTER_NODE,
+    LOCATION_NODE,
 )
+from storage import JsonDirectoryBackend, PackedBackend, SqliteBackend, StorageBackend, VersionConflictError
+from world_store import NodeKey, relation_key
 
 THIS_FILE_DIR = Path(__file__).parent.resolve()
 DATA_DIR = THIS_FILE_DIR / "data"
 CHARACTER_DIR = DATA_DIR / "characters"
 LOCATION_DIR = DATA_DIR / "locations"
 RELATION_DIR = DATA_DIR / "relations"
+DEFAULT_SQLITE_PATH = DATA_DIR / "world.sqlite3"
+DEFAULT_PACK_PATH = DATA_DIR / "world.pack"
+
+# -------------- STORAGE BACKEND -----------------
+def backend_from_env() -> StorageBackend:
+    """
+    `DATASTORE_BACKEND=sqlite` (optionally with `DATASTORE_SQLITE_PATH`) selects SQLite,
+    `packed` (optionally with `DATASTORE_PACK_PATH`) a packed world file, JSON files otherwise
+    """
+    backend_name = os.environ.get("DATASTORE_BACKEND", "json")
+    if backend_name == "sqlite":
+        return SqliteBackend(os.environ.get("DATASTORE_SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    if backend_name == "packed":
+        return PackedBackend(os.environ.get("DATASTORE_PACK_PATH", DEFAULT_PACK_PATH))
+    if backend_name != "json":
+        logger.warning(f"Unknown DATASTORE_BACKEND={backend_name}, falling back to json.")
+    return JsonDirectoryBackend(DATA_DIR)
+
+# built on first use rather than at import, as opening a backend replays its
+# write-ahead files, walks directories or maps files
+_backend: StorageBackend | None = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> StorageBackend:
+    """The current backend, `backend_from_env()` unless `set_backend` chose another"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = backend_from_env()
+    return _backend
+
+def set_backend(new_backend: StorageBackend | None) -> None:
+    """Switch to `new_backend`; None goes back to the (lazily built) `backend_from_env()` one"""
+    global _backend
+    with _backend_lock:
+        _backend = new_backend
+
+@contextmanager
+def using_backend(new_backend: StorageBackend) -> Iterator[StorageBackend]:
+    """`new_backend` for the duration of the block, then back to the previous one (without building it)"""
+    global _backend
+    with _backend_lock:
+        (previous, _backend) = (_backend, new_backend)
+    try:
+        yield new_backend
+    finally:
+        with _backend_lock:
+            _backend = previous
+
+def __getattr__(name: str):
+    # `datastore.backend` reads the current backend, building it on first access
+    if name == "backend":
+        return get_backend()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_compact_world() -> "CompactWorld":
+    """The whole world as a columnar `CompactWorld`, for bulk and analytic passes that do not need models"""
+    from compact_world import CompactWorld
+    return CompactWorld.from_backend(get_backend())
+
+
+# -------------- SAVE LISTENERS -----------------
+RELATION_ENTITY = "relation"
+
+# called as listener(entity_type, saved_entities) after every successful save,
+# entity_type being CHARACTER_NODE, LOCATION_NODE or RELATION_ENTITY
+SaveListener = Callable[[str, list], None]
+_save_listeners: list[SaveListener] = []
+
+def add_save_listener(listener: SaveListener) -> None:
+    _save_listeners.append(listener)
+
+def remove_save_listener(listener: SaveListener) -> None:
+    _save_listeners.remove(listener)
+
+def _notify_saved(entity_type: str, entities: list) -> None:
+    for listener in list(_save_listeners):
+        listener(entity_type, entities)
+
+# same signature, called right before every save, e.g. to keep what it is
+# about to overwrite
+_pre_save_listeners: list[SaveListener] = []
+
+def add_pre_save_listener(listener: SaveListener) -> None:
+    _pre_save_listeners.append(listener)
+
+def remove_pre_save_listener(listener: SaveListener) -> None:
+    _pre_save_listeners.remove(listener)
+
+def _notify_saving(entity_type: str, entities: list) -> None:
+    for listener in list(_pre_save_listeners):
+        listener(entity_type, entities)
+
 
 # -------------- CHARACTER -----------------
 def get_characters(
     id_in: list[str] | None = None,
     name_in: list[str] | None = None,
 ) -> list[Character]:
-    characters: list[Character] = []
-    character_filepaths = CHARACTER_DIR.glob("*.json")
-    for filepath in character_filepaths:
-        logger.debug(f"Loading character from: {filepath}")
-        with open(filepath) as f:
-            data = json.load(f)
-        characters.append(Character(**data))
-
-    if id_in is not None:
-        characters = [
-            c for c in characters
-            if c.id in id_in
-        ]
-    if name_in is not None:
-        characters = [
-            c for c in characters
-            if c.name in name_in
-        ]
-
-    return characters
+    return get_backend().get_characters(id_in=id_in, name_in=name_in)
 
 
 def get_character(
     id: str
 ) -> Character | None:
-    filepath = CHARACTER_DIR / f"{id}.json"
-    logger.debug(f"Loading character from: {filepath}")
-    if not filepath.exists():
-        logger.warning(f"{filepath} not found.")
-        return None
-    with open(filepath) as f:
-        data = json.load(f)
-    return Character(**data)
+    return get_backend().get_character(id)
 
 
 def save_character(
     character: Character,
 ) -> Character:
-    filepath = CHARACTER_DIR / f"{character.id}.json"
-    logger.debug(f"Saving character to: {filepath}")
-    with open(filepath, "w") as file:
-        json.dump(
-            character.__dict__,
-            file,
-            ensure_ascii=False,
-            indent=4,
-        )
+    return save_characters([character])[0]
+
+def save_characters(
+    characters: list[Character],
+    expected_versions: dict[str, int] | None = None,
+) -> list[Character]:
+    _notify_saving(CHARACTER_NODE, characters)
+    saved = get_backend().save_characters(characters, expected_versions=expected_versions)
+    _notify_saved(CHARACTER_NODE, saved)
+    return saved
 
-def save_characters(characters: list[Character]) -> list[Character]:
-    for character in characters:
-        save_character(character)
-    
 
 # -------------- LOCATION -----------------
 def get_locations(
     id_in: list[str] | None = None,
     name_in: list[str] | None = None,
 ) -> list[Location]:
-    # locations = all_locations
-    locations: list[Location] = []
-    location_filepaths = LOCATION_DIR.glob("*.json")
-    for filepath in location_filepaths:
-        logger.debug(f"Loading location from: {filepath}")
-        with open(filepath) as f:
-            data = json.load(f)
-        locations.append(Location(**data))
-    
-    if id_in is not None:
-        locations = [
-            l for l in locations
-            if l.id in id_in
-        ]
-    if name_in is not None:
-        locations = [
-            l for l in locations
-            if l.name in name_in
-        ]
-    return locations
+    return get_backend().get_locations(id_in=id_in, name_in=name_in)
 
 def get_location(
     id: str
 ) -> Location | None:
-    filepath = LOCATION_DIR / f"{id}.json"
-    logger.debug(f"Loading location from: {filepath}")
-    if not filepath.exists():
-        logger.warning(f"{filepath} not found.")
-        return None
-    with open(filepath) as f:
-        data = json.load(f)
-    return Location(**data)
+    return get_backend().get_location(id)
 
 def save_location(
     location: Location,
 ) -> Location:
-    filepath = LOCATION_DIR / f"{location.id}.json"
-    logger.debug(f"Saving location to: {filepath}")
-    with open(filepath, "w") as file:
-        json.dump(
-            location.__dict__,
-            file,
-            ensure_ascii=False,
-            indent=4,
-        )
+    return save_locations([location])[0]
 
-def save_locations(locations: list[Location]) -> list[Location]:
-    for location in locations:
-        save_location(location)
+def save_locations(
+    locations: list[Location],
+    expected_versions: dict[str, int] | None = None,
+) -> list[Location]:
+    _notify_saving(LOCATION_NODE, locations)
+    saved = get_backend().save_locations(locations, expected_versions=expected_versions)
+    _notify_saved(LOCATION_NODE, saved)
+    return saved
 
 
 # -------------- RELATION -----------------
 def get_relations(
     x_node_id_eq: str | None = None,
+    y_node_id_eq: str | None = None,
     # name_in: list[str] | None = None,
 ) -> list[Relation]:
-    relations: list[Relation] = []
-    relation_filepaths = RELATION_DIR.glob("*.json")
-    for filepath in relation_filepaths:
-        logger.debug(f"Loading relation from: {filepath}")
-        with open(filepath) as f:
-            data = json.load(f)
-        relations.append(Relation(**data))
-
-    logger.debug("all relations")
-    logger.debug(relations)
-    if x_node_id_eq is not None:
-        logger.debug(f"filter for x_node_id_eq={x_node_id_eq}")
-        logger.debug(str([
-            (r.x_node_id, r.x_node_id == x_node_id_eq)
-            for r in relations
-        ]))
-        relations = [
-            r for r in relations
-            if r.x_node_id == x_node_id_eq
-        ]
-        logger.debug(f"filtered {relations}")
+    relations = get_backend().get_relations(
+        x_node_id_eq=x_node_id_eq,
+        y_node_id_eq=y_node_id_eq,
+    )
+    if entity_dumps_enabled():
+        logger.debug("relations for x_node_id_eq=%s, y_node_id_eq=%s", x_node_id_eq, y_node_id_eq)
+        logger.debug("%s", relations)
     return relations
 
 def save_relation(
     relation: Relation,
 ) -> Relation:
-    filepath = RELATION_DIR / f"{relation.x_node_id}--{relation.y_node_id}.json"
-    logger.debug(f"Saving relation to: {filepath}")
-    with open(filepath, "w") as file:
-        json.dump(
-            relation.__dict__,
-            file,
-            ensure_ascii=False,
-            indent=4,
-        )
+    return save_relations([relation])[0]
+
+def get_adjacent_relations(nodes: list[NodeKey]) -> list[Relation]:
+    """Every relation with either end on one of `nodes` ((node_type, node_id) pairs)"""
+    adjacent = {
+        (r.x_node_id, r.y_node_id): r
+        for r in get_backend().get_outgoing_relations(nodes) + get_backend().get_incoming_relations(nodes)
+    }
+    return list(adjacent.values())
+
+def save_relations(
+    relations: list[Relation],
+    expected_versions: dict[str, int] | None = None,
+) -> list[Relation]:
+    _notify_saving(RELATION_ENTITY, relations)
+    saved = get_backend().save_relations(relations, expected_versions=expected_versions)
+    _notify_saved(RELATION_ENTITY, saved)
+    return saved
+
+
+# -------------- VERSIONS -----------------
+def get_versions(table: str, keys: list[str]) -> dict[str, int]:
+    """
+    Stored version of every existing entity among `keys` of `table` (storage
+    CHARACTERS, LOCATIONS or RELATIONS; relations keyed by `relation_key`).
+
+    Pass them back as `expected_versions` to a `save_*` call to have it fail
+    with VersionConflictError, instead of overwriting, if another writer
+    (thread or process) saved one of them in between; a key missing from the
+    result counts as version 0, i.e. "must not exist yet".
+    """
+    return get_backend().get_versions(table, keys)
 
-def save_relations(relations: list[Relation]) -> list[Relation]:
-    for relation in relations:
-        save_relation(relation)
+
+# -------------- SEARCH -----------------
+def search(
+    query: str,
+    entity_types: list[str] | None = None,
+    limit: int = 10,
+    source: StorageBackend | None = None,
+) -> list["SearchHit"]:
+    """
+    Full-text search over character and location names and descriptions and
+    relation descriptions, best BM25 matches first. `entity_types` narrows it
+    to some of CHARACTER_NODE, LOCATION_NODE and RELATION_ENTITY; the matched
+    entities are read from `source` (the module's backend by default).
+    """
+    from search_index import get_search_index
+    source = source or get_backend()
+    hits = get_search_index().search(query, entity_types=entity_types, limit=limit)
+    characters = {c.id: c for c in source.get_characters(id_in=[h.key for h in hits if h.entity_type == CHARACTER_NODE])}
+    locations = {l.id: l for l in source.get_locations(id_in=[h.key for h in hits if h.entity_type == LOCATION_NODE])}
+    for hit in hits:
+        if hit.entity_type == CHARACTER_NODE:
+            hit.entity = characters.get(hit.key)
+        elif hit.entity_type == LOCATION_NODE:
+            hit.entity = locations.get(hit.key)
+        else:
+            (x_node_id, y_node_id) = hit.key.split("--", 1)
+            hit.entity = next(iter(source.get_relations(x_node_id_eq=x_node_id, y_node_id_eq=y_node_id)), None)
+    return hits
 
 
 # -------------- CHARACTER ORBIT -----------------
 
+def _importance_threshold(
+    min_importance: int | Sequence[int | None] | None,
+    hop: int,
+) -> int | None:
+    if min_importance is None or isinstance(min_importance, int):
+        return min_importance
+    if hop < len(min_importance):
+        return min_importance[hop]
+    return None
+
+
+def get_character_orbits(
+    character_ids: list[str],
+    depth: int = 1,
+    min_importance: int | Sequence[int | None] | None = None,
+    source: StorageBackend | None = None,
+) -> dict[str, CharacterOrbit]:
+    """
+    Resolve the orbits of several characters with one backend query per hop.
+
+    `depth` is the number of relation hops followed out from each character.
+    `min_importance` drops relations below a threshold, either one value for
+    every hop or a per-hop sequence (e.g. `[None, 7]` keeps every direct
+    relation but only important second-hop ones). `source` reads from another
+    backend than the module's, e.g. an in-memory snapshot.
+
+    Relations and related nodes come in BFS discovery order, with each node's
+    relations sorted by key, so the same world always yields the same orbit
+    (and the same prompt text) whatever the process's hash seed.
+    """
+    source = source or get_backend()
+    characters = source.get_characters(id_in=character_ids)
+    # node -> None, a set that remembers discovery order
+    visited: dict[str, dict[NodeKey, None]] = {}
+    frontiers: dict[str, list[NodeKey]] = {}
+    orbit_relations: dict[str, list[Relation]] = {}
+    for character in characters:
+        visited[character.id] = {(CHARACTER_NODE, character.id): None}
+        frontiers[character.id] = [(CHARACTER_NODE, character.id)]
+        orbit_relations[character.id] = []
+
+    for hop in range(depth):
+        all_frontier_nodes = list(dict.fromkeys(node for frontier in frontiers.values() for node in frontier))
+        if not all_frontier_nodes:
+            break
+        outgoing: dict[NodeKey, list[Relation]] = defaultdict(list)
+        for relation in sorted(source.get_outgoing_relations(all_frontier_nodes), key=relation_key):
+            outgoing[(relation.x_node_type, relation.x_node_id)].append(relation)
+
+        threshold = _importance_threshold(min_importance, hop)
+        for character_id, frontier in frontiers.items():
+            next_frontier: list[NodeKey] = []
+            for node in frontier:
+                for relation in outgoing.get(node, ()):
+                    if threshold is not None and (relation.importance or 0) < threshold:
+                        continue
+                    orbit_relations[character_id].append(relation)
+                    y_node = (relation.y_node_type, relation.y_node_id)
+                    if y_node not in visited[character_id]:
+                        visited[character_id][y_node] = None
+                        next_frontier.append(y_node)
+            frontiers[character_id] = next_frontier
+
+    related_ids = {
+        node_type: list(dict.fromkeys(
+            node_id for nodes in visited.values() for (t, node_id) in nodes if t == node_type
+        ))
+        for node_type in (CHARACTER_NODE, LOCATION_NODE)
+    }
+    related_characters = {c.id: c for c in source.get_characters(id_in=related_ids[CHARACTER_NODE])}
+    related_locations = {l.id: l for l in source.get_locations(id_in=related_ids[LOCATION_NODE])}
+
+    orbits: dict[str, CharacterOrbit] = {}
+    for character in characters:
+        nodes = visited[character.id]
+        orbits[character.id] = CharacterOrbit(
+            character=character,
+            relations=orbit_relations[character.id],
+            related_characters=[
+                related_characters[node_id] for (t, node_id) in nodes
+                if t == CHARACTER_NODE and node_id != character.id and node_id in related_characters
+            ],
+            related_locations=[
+                related_locations[node_id] for (t, node_id) in nodes
+                if t == LOCATION_NODE and node_id in related_locations
+            ],
+        )
+    return orbits
+
+
 def get_character_orbit(
     character: Character,
-    # depth: int = 1,
+    depth: int = 1,
+    min_importance: int | Sequence[int | None] | None = None,
 ) -> CharacterOrbit:
-    relations = get_relations(
-        x_node_id_eq=character.id,
-    )
-    related_character_ids: list[str] = [
-        r.y_node_id for r in relations
-        if r.y_node_type == CHARACTER_NODE_TYPE
-    ]
-    related_characters = get_characters(
-        id_in=related_character_ids,
-    )
-    related_location_ids: list[str] = [
-        r.y_node_id for r in relations
-        if r.y_node_type == LOCATION_NODE_TYPE
-    ]
-    related_locations = get_locations(
-        id_in=related_location_ids,
-    )
-    return CharacterOrbit(
-        character=character,
-        relations=relations,
-        related_characters=related_characters,
-        related_locations=related_locations,
-    )
+    orbit = get_character_orbits(
+        [character.id],
+        depth=depth,
+        min_importance=min_importance,
+    ).get(character.id)
+    if orbit is None:
+        # character not persisted (yet), nothing can point out of it
+        orbit = CharacterOrbit(character=character, relations=[], related_characters=[], related_locations=[])
+    return orbit
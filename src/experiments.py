@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import shutil
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+
+import datastore
+from instrumentation import instrumentation
+from journal import DEFAULT_JOURNAL_DIR
+from logging_config import configure_logging, logger, stop_logging
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS
+from storage import JsonDirectoryBackend
+from turn import DEFAULT_NUM_ROUNDS, SETTING_PROMPT, play_rounds
+from world_store import MANIFEST_FILENAME, WorldStore
+
+DEFAULT_EXPERIMENTS_DIR = DEFAULT_JOURNAL_DIR / "experiments"
+DEFAULT_SETTING_NAME = "default"
+SUMMARY_FILENAME = "summary.json"
+JOURNAL_FILENAME = "journal.jsonl"
+METRICS_FILENAME = "metrics.prom"
+WORLD_TABLES = (CHARACTERS, LOCATIONS, RELATIONS)
+
+
+@dataclass
+class Experiment:
+    name: str
+    seed: int
+    setting_name: str = DEFAULT_SETTING_NAME
+    setting_prompt: str = SETTING_PROMPT
+    num_rounds: int = DEFAULT_NUM_ROUNDS
+
+    def describe(self) -> dict:
+        """Everything but the (long) setting prompt itself"""
+        description = asdict(self)
+        del description["setting_prompt"]
+        return description
+
+
+def experiment_grid(
+    seeds: list[int],
+    settings: dict[str, str] | None = None,
+    num_rounds: int = DEFAULT_NUM_ROUNDS,
+) -> list[Experiment]:
+    """One experiment per (setting prompt variant, seed) pair; `settings` maps variant names to prompts"""
+    settings = settings or {DEFAULT_SETTING_NAME: SETTING_PROMPT}
+    return [
+        Experiment(f"{setting_name}-seed{seed}", seed, setting_name, setting_prompt, num_rounds)
+        for (setting_name, setting_prompt) in settings.items()
+        for seed in seeds
+    ]
+
+
+# -------------- WORLD COPIES -----------------
+def link_world(base_dir: Path, world_dir: Path) -> int:
+    """
+    Copy-on-write copy of a JSON directory world: entity files are hard-linked instead of copied.
+
+    Saves replace entity files by renaming a new file over them and never
+    write into one, so a save in either world only ever changes that world.
+    Falls back to copying where linking fails (e.g. across filesystems).
+    The layout (flat or sharded) is kept. Returns the number of entity files.
+    """
+    n_files = 0
+    for table in WORLD_TABLES:
+        base_table_dir = base_dir / table
+        (world_dir / table).mkdir(parents=True, exist_ok=True)
+        for (directory, _, filenames) in os.walk(base_table_dir):
+            target_dir = world_dir / table / os.path.relpath(directory, base_table_dir)
+            target_dir.mkdir(parents=True, exist_ok=True)
+            for name in filenames:
+                source = os.path.join(directory, name)
+                if name == MANIFEST_FILENAME:
+                    # appended to in place, so each world needs its own
+                    shutil.copy2(source, target_dir / name)
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    os.link(source, target_dir / name)
+                except OSError:
+                    shutil.copy2(source, target_dir / name)
+                n_files += 1
+    return n_files
+
+def world_size(world_dir: Path) -> dict[str, int]:
+    world_store = WorldStore(world_dir)
+    return {table: len(getattr(world_store, table).ids()) for table in WORLD_TABLES}
+
+
+# -------------- RUNNING -----------------
+def run_experiment(experiment: Experiment, base_dir: Path, output_dir: Path) -> dict:
+    """
+    Play one experiment in the calling process (a pool worker): its own world
+    copy, log file, journal and metrics under `output_dir/<name>`. Returns its summary.
+    """
+    experiment_dir = output_dir / experiment.name
+    world_dir = experiment_dir / "data"
+    journal_path = experiment_dir / JOURNAL_FILENAME
+    # workers share the console; everything else goes to each experiment's log file
+    configure_logging(
+        log_dir=experiment_dir,
+        console_level=logging.WARNING,
+        production=os.environ.get("LOG_MODE") == "production",
+    )
+    try:
+        link_world(base_dir, world_dir)
+        initial_size = world_size(world_dir)
+        datastore.set_backend(JsonDirectoryBackend(world_dir))
+        play_rounds(
+            num_rounds=experiment.num_rounds,
+            seed=experiment.seed,
+            journal_path=journal_path,
+            setting_prompt=experiment.setting_prompt,
+            metrics_path=experiment_dir / METRICS_FILENAME,
+        )
+        return {
+            **experiment.describe(),
+            "world_dir": str(world_dir),
+            "journal": str(journal_path),
+            "world_size": {"initial": initial_size, "final": world_size(world_dir)},
+            "run": instrumentation.run_summary(),
+        }
+    finally:
+        stop_logging()
+
+
+def merge_summaries(results: list[dict]) -> dict:
+    """Totals over the experiments that completed"""
+    completed = [r for r in results if "error" not in r]
+    llm: dict[str, float] = {}
+    for result in completed:
+        for stats in result["run"]["llm"].values():
+            for (field, value) in stats.items():
+                llm[field] = max(llm.get(field, 0), value) if field.startswith("max_") else llm.get(field, 0) + value
+    return {
+        "experiments": len(results),
+        "completed": len(completed),
+        "failed": [r["name"] for r in results if "error" in r],
+        "run_seconds": sum(r["run"]["seconds"] for r in completed),
+        "llm": llm,
+        "new_entities": {
+            table: sum(r["world_size"]["final"][table] - r["world_size"]["initial"][table] for r in completed)
+            for table in WORLD_TABLES
+        },
+    }
+
+
+def run_experiments(
+    experiments: list[Experiment],
+    base_dir: Path = datastore.DATA_DIR,
+    output_dir: Path | None = None,
+    max_workers: int | None = None,
+) -> dict:
+    """
+    Play a batch of experiments on a pool of forked worker processes (one per core by default).
+
+    Every experiment gets a copy-on-write copy of the JSON world in
+    `base_dir`, which itself is left untouched. Results are gathered as the
+    experiments finish; a failing experiment is recorded with its error and
+    does not stop the others. The merged summary is written to
+    `output_dir/summary.json` and returned.
+    """
+    names = [e.name for e in experiments]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Experiment names must be unique: {names}")
+    output_dir = output_dir or DEFAULT_EXPERIMENTS_DIR / datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(1, len(experiments)))
+    logger.info(f"Running {len(experiments)} experiments on {max_workers} workers into {output_dir}")
+
+    started_at = time.time()
+    results: dict[str, dict] = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_experiment, e, Path(base_dir), output_dir): e for e in experiments}
+        for future in as_completed(futures):
+            experiment = futures[future]
+            try:
+                results[experiment.name] = future.result()
+                logger.info(f"Experiment {experiment.name} finished ({len(results)}/{len(experiments)})")
+            except Exception as e:
+                logger.error(f"Experiment {experiment.name} failed: {e!r}")
+                results[experiment.name] = {
+                    **experiment.describe(),
+                    "error": "".join(traceback.format_exception(e)),
+                }
+
+    ordered_results = [results[name] for name in names]
+    summary = {
+        "base_dir": str(base_dir),
+        "started_at": started_at,
+        "seconds": time.time() - started_at,
+        "workers": max_workers,
+        "totals": merge_summaries(ordered_results),
+        "experiments": ordered_results,
+    }
+    summary_path = output_dir / SUMMARY_FILENAME
+    summary_path.write_text(json.dumps(summary, indent=4))
+    logger.info(f"Merged experiment summary: {summary_path}")
+    return summary
+
+
+def main(argv: list[str] | None = None) -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play a batch of seeds and setting variants against copies of one world")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument(
+        "--settings", type=Path, nargs="+", default=[],
+        help="files holding SETTING_PROMPT variants, named after the file stem (default: the built-in setting)",
+    )
+    parser.add_argument("--rounds", type=int, default=DEFAULT_NUM_ROUNDS)
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--base-dir", type=Path, default=datastore.DATA_DIR, help="JSON world every experiment starts from")
+    parser.add_argument("--output", type=Path, help="directory for the experiments' worlds, logs, journals and summary")
+    args = parser.parse_args(argv)
+
+    settings = {path.stem: path.read_text() for path in args.settings} or None
+    run_experiments(
+        experiment_grid(args.seeds, settings, args.rounds),
+        base_dir=args.base_dir,
+        output_dir=args.output,
+        max_workers=args.workers,
+    )
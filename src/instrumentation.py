@@ -0,0 +1,202 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator
+
+# the round process writes its Prometheus metrics here after every round, for
+# the API's /metrics to serve (METRICS_PATH overrides)
+DEFAULT_METRICS_PATH = Path(__file__).parent.resolve() / "../logs/metrics.prom"
+
+def metrics_path() -> Path:
+    return Path(os.environ.get("METRICS_PATH", DEFAULT_METRICS_PATH))
+
+
+@dataclass
+class TimingStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+@dataclass
+class LLMCall:
+    actor: str
+    model: str
+    seconds: float
+    prompt_chars: int
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # answered from the LLM response cache, or otherwise without an API request
+    cached: bool = False
+
+
+@dataclass
+class LLMStats:
+    calls: int = 0
+    cached_calls: int = 0
+    seconds: float = 0.0
+    prompt_chars: int = 0
+    max_prompt_chars: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def add(self, call: LLMCall) -> None:
+        self.calls += 1
+        self.cached_calls += int(call.cached)
+        self.seconds += call.seconds
+        self.prompt_chars += call.prompt_chars
+        self.max_prompt_chars = max(self.max_prompt_chars, call.prompt_chars)
+        self.prompt_tokens += call.prompt_tokens
+        self.completion_tokens += call.completion_tokens
+
+
+class Instrumentation:
+    """
+    Wall-clock spans of the round phases plus per-LLM-call prompt sizes and token counts.
+
+    Process-wide totals only ever grow (they back the Prometheus endpoint);
+    the current run's figures are additionally broken down per round and
+    reset by `start_run`. Spans and calls may be recorded from any thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.span_totals: dict[str, TimingStats] = defaultdict(TimingStats)
+        self.llm_totals: dict[tuple[str, str], LLMStats] = defaultdict(LLMStats)
+        self.rounds_completed = 0
+        self._reset_run()
+
+    def _reset_run(self) -> None:
+        self.current_round: int | None = None
+        self._run_started_at = time.time()
+        self._run_spans: dict[int | None, dict[str, TimingStats]] = defaultdict(lambda: defaultdict(TimingStats))
+        self._run_llm: dict[int | None, dict[str, LLMStats]] = defaultdict(lambda: defaultdict(LLMStats))
+
+    def start_run(self) -> None:
+        with self._lock:
+            self._reset_run()
+
+    def start_round(self, round_n: int) -> None:
+        with self._lock:
+            self.current_round = round_n
+
+    def end_round(self) -> None:
+        with self._lock:
+            self.rounds_completed += 1
+            self.current_round = None
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.span_totals[name].add(seconds)
+                self._run_spans[self.current_round][name].add(seconds)
+
+    def record_llm_call(self, call: LLMCall) -> None:
+        with self._lock:
+            self.llm_totals[(call.actor, call.model)].add(call)
+            self._run_llm[self.current_round][call.actor].add(call)
+
+    def run_summary(self) -> dict:
+        """The current run as plain data: per-round and overall span timings and LLM usage"""
+        with self._lock:
+            rounds = sorted({r for r in (*self._run_spans, *self._run_llm) if r is not None})
+            overall_spans: dict[str, TimingStats] = defaultdict(TimingStats)
+            overall_llm: dict[str, LLMStats] = defaultdict(LLMStats)
+            for spans in self._run_spans.values():
+                for (name, stats) in spans.items():
+                    merged = overall_spans[name]
+                    merged.count += stats.count
+                    merged.total_seconds += stats.total_seconds
+                    merged.max_seconds = max(merged.max_seconds, stats.max_seconds)
+            for llm in self._run_llm.values():
+                for (actor, stats) in llm.items():
+                    merged = overall_llm[actor]
+                    for field in ("calls", "cached_calls", "seconds", "prompt_chars", "prompt_tokens", "completion_tokens"):
+                        setattr(merged, field, getattr(merged, field) + getattr(stats, field))
+                    merged.max_prompt_chars = max(merged.max_prompt_chars, stats.max_prompt_chars)
+            return {
+                "started_at": self._run_started_at,
+                "seconds": time.time() - self._run_started_at,
+                "spans": {name: asdict(stats) for (name, stats) in sorted(overall_spans.items())},
+                "llm": {actor: asdict(stats) for (actor, stats) in sorted(overall_llm.items())},
+                "rounds": [
+                    {
+                        "round": round_n,
+                        "spans": {name: asdict(stats) for (name, stats) in sorted(self._run_spans[round_n].items())},
+                        "llm": {actor: asdict(stats) for (actor, stats) in sorted(self._run_llm[round_n].items())},
+                    }
+                    for round_n in rounds
+                ],
+            }
+
+    def write_run_summary(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.run_summary(), indent=4))
+
+    def write_prometheus(self, path: Path) -> None:
+        """`prometheus_text` into `path`, replaced at once so a reader never sees half of it"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def prometheus_text(self) -> str:
+        """Process-wide totals in the Prometheus text exposition format"""
+        lines: list[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: list[tuple[dict[str, str], float]]) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (labels, value) in samples:
+                label_text = ",".join(f'{k}="{_escape_label(v)}"' for (k, v) in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            spans = sorted(self.span_totals.items())
+            llm = sorted(self.llm_totals.items())
+            metric("mercury_rounds_completed_total", "counter", "Rounds played to completion.", [({}, self.rounds_completed)])
+            metric("mercury_span_seconds_total", "counter", "Wall-clock seconds spent in each phase.",
+                   [({"span": name}, stats.total_seconds) for (name, stats) in spans])
+            metric("mercury_span_count_total", "counter", "Times each phase ran.",
+                   [({"span": name}, stats.count) for (name, stats) in spans])
+            metric("mercury_span_seconds_max", "gauge", "Longest single run of each phase.",
+                   [({"span": name}, stats.max_seconds) for (name, stats) in spans])
+            for (field, kind, help) in [
+                ("calls", "counter", "LLM queries made."),
+                ("cached_calls", "counter", "LLM queries answered without an API request."),
+                ("seconds", "counter", "Wall-clock seconds spent in LLM queries."),
+                ("prompt_chars", "counter", "Characters of prompt (system prompt, memory and query) sent."),
+                ("max_prompt_chars", "gauge", "Largest single prompt in characters."),
+                ("prompt_tokens", "counter", "Prompt tokens billed."),
+                ("completion_tokens", "counter", "Completion tokens billed."),
+            ]:
+                suffix = "" if kind == "gauge" else "_total"
+                metric(f"mercury_llm_{field}{suffix}", kind, help,
+                       [({"actor": actor, "model": model}, getattr(stats, field)) for ((actor, model), stats) in llm])
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+instrumentation = Instrumentation()
+
+def span(name: str) -> contextlib.AbstractContextManager[None]:
+    """Time a phase, e.g. `with span("archivist.query"): ...`"""
+    return instrumentation.span(name)
@@ -0,0 +1,80 @@
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+
+from pydantic.json import pydantic_encoder
+
+DEFAULT_JOURNAL_DIR = Path(__file__).parent.resolve() / "../logs"
+
+
+def default_journal_path() -> Path:
+    return DEFAULT_JOURNAL_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M')}.jsonl"
+
+
+class RoundJournal:
+    """
+    Append-only, line-delimited record of a run.
+
+    Every record is written (and flushed) as one compact JSON line the moment
+    it is appended, so nothing accumulates in memory and a crashed run keeps
+    everything recorded up to that point. Safe to append from several threads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def append(self, record: dict[str, Any]) -> None:
+        line = json.dumps(record, default=pydantic_encoder, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def append_development(self, round_n: int, development: Any) -> None:
+        """Record one `turn.CharacterDevelopmentResult` of round `round_n`"""
+        self.append({
+            "round": round_n,
+            "character_id": development.focus_character.character.id,
+            "focus_character": development.focus_character,
+            "vignette": development.vignette,
+            "analysis": development.analysis,
+        })
+
+    def size(self) -> int:
+        """Bytes recorded so far, e.g. to truncate the journal back to this point later"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            return self.path.stat().st_size if self.path.exists() else 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self) -> "RoundJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def iter_journal(
+    path: Path,
+    round_n: int | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Lazily yield the records of a journal, optionally only those of one round"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if round_n is None or record.get("round") == round_n:
+                yield record
@@ -0,0 +1,244 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from pydantic import parse_obj_as
+from pydantic.json import pydantic_encoder
+
+from instrumentation import LLMCall, instrumentation
+from logging_config import logger
+
+CACHE_MODE_OFF = "off"
+CACHE_MODE_ON = "on"  # read through, record misses
+CACHE_MODE_REPLAY = "replay"  # read only, a miss is an error
+CACHE_MODES = (CACHE_MODE_OFF, CACHE_MODE_ON, CACHE_MODE_REPLAY)
+
+DEFAULT_CACHE_DIR = Path(__file__).parent.resolve() / "../.llm_cache"
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_CACHE_AGE_SECONDS = 30 * 24 * 60 * 60
+
+
+class LLMCacheMissError(LookupError):
+    """Raised in replay mode when a query has no recorded response"""
+
+
+def model_name(model: Any) -> str:
+    # langchain chat models expose `model_name`, interlab also accepts plain strings
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or str(model)
+
+
+def type_name(expected_type: type | None) -> str | None:
+    if expected_type is None:
+        return None
+    return f"{expected_type.__module__}.{expected_type.__qualname__}"
+
+
+def cache_key(
+    model: str,
+    system_prompt: str | None,
+    observations: str,
+    prompt: str,
+    expected_type: str | None,
+    with_cot: bool = False,
+) -> str:
+    payload = json.dumps(
+        [model, system_prompt, observations, prompt, expected_type, with_cot],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent, content-addressed store of LLM responses.
+
+    Each response lives in `<cache_dir>/<key[:2]>/<key>.json`. Entries older
+    than `max_age_seconds` count as misses and are removed; once the cache
+    grows past `max_bytes` the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        mode: str = CACHE_MODE_ON,
+        max_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+        max_age_seconds: float = DEFAULT_MAX_CACHE_AGE_SECONDS,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (last used timestamp, size in bytes), loaded lazily on first use
+        self._entries: dict[str, tuple[float, int]] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != CACHE_MODE_OFF
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _index(self) -> dict[str, tuple[float, int]]:
+        if self._entries is None:
+            self._entries = {}
+            for path in self.cache_dir.glob("*/*.json"):
+                stat = path.stat()
+                self._entries[path.stem] = (stat.st_mtime, stat.st_size)
+        return self._entries
+
+    def _remove(self, key: str) -> None:
+        self._index().pop(key, None)
+        self._path(key).unlink(missing_ok=True)
+
+    def get(self, key: str, expected_type: type | None = None) -> tuple[bool, Any]:
+        """Returns `(hit, response)`; raises `LLMCacheMissError` on a miss in replay mode"""
+        with self._lock:
+            entry = self._index().get(key)
+            now = time.time()
+            if entry is not None and self.max_age_seconds is not None and now - entry[0] > self.max_age_seconds:
+                if self.mode != CACHE_MODE_REPLAY:
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                if self.mode == CACHE_MODE_REPLAY:
+                    raise LLMCacheMissError(f"No recorded LLM response for key {key} (replay mode)")
+                return (False, None)
+            path = self._path(key)
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                # removed by another process sharing the cache directory
+                self._entries.pop(key, None)
+                self.misses += 1
+                if self.mode == CACHE_MODE_REPLAY:
+                    raise LLMCacheMissError(f"No recorded LLM response for key {key} (replay mode)")
+                return (False, None)
+            if self.mode != CACHE_MODE_REPLAY:
+                # mtime doubles as the LRU timestamp
+                os.utime(path, (now, now))
+                self._entries[key] = (now, entry[1])
+            self.hits += 1
+        response = record["response"]
+        if expected_type is not None:
+            response = parse_obj_as(expected_type, response)
+        return (True, response)
+
+    def put(self, key: str, response: Any, metadata: dict | None = None) -> None:
+        if self.mode != CACHE_MODE_ON:
+            return
+        record = {"response": response, **(metadata or {})}
+        data = json.dumps(record, default=pydantic_encoder, ensure_ascii=False)
+        with self._lock:
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._index()[key] = (time.time(), path.stat().st_size)
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = self._index()
+        total = sum(size for (_, size) in entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, (_, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+        logger.debug("Evicted LLM cache entries down to %s bytes", total)
+
+
+def cache_from_env() -> LLMResponseCache:
+    """`LLM_CACHE_MODE` = off (default) | on | replay, `LLM_CACHE_DIR` overrides the location"""
+    return LLMResponseCache(
+        cache_dir=Path(os.environ.get("LLM_CACHE_DIR", DEFAULT_CACHE_DIR)),
+        mode=os.environ.get("LLM_CACHE_MODE", CACHE_MODE_OFF),
+    )
+
+llm_cache = cache_from_env()
+
+def set_llm_cache(cache: LLMResponseCache) -> None:
+    global llm_cache
+    llm_cache = cache
+
+
+class LLMCacheMixin:
+    """Routes an interlab LLM actor's queries through the module's `llm_cache`"""
+
+    def _query(self, prompt: str = None, *, expected_type=None, with_cot=False) -> Any:
+        cache = llm_cache
+        if not cache.enabled or prompt is None:
+            return super()._query(prompt, expected_type=expected_type, with_cot=with_cot)
+
+        key = cache_key(
+            model=model_name(self.model),
+            system_prompt=self.system_prompt,
+            observations=self.memory.format_memories(query=prompt),
+            prompt=str(prompt),
+            expected_type=type_name(expected_type),
+            with_cot=with_cot,
+        )
+        (hit, response) = cache.get(key, expected_type=expected_type)
+        if hit:
+            logger.debug("LLM cache hit for %s (%s)", self.name, key)
+            return response
+        response = super()._query(prompt, expected_type=expected_type, with_cot=with_cot)
+        cache.put(key, response, metadata={
+            "model": model_name(self.model),
+            "actor": self.name,
+            "expected_type": type_name(expected_type),
+        })
+        return response
+
+
+class LLMMetricsMixin:
+    """Records every query's duration, prompt size and billed tokens with `instrumentation`"""
+
+    def _query(self, prompt: str = None, *, expected_type=None, with_cot=False) -> Any:
+        # langchain is already loaded by interlab at this point
+        from langchain.callbacks import get_openai_callback
+
+        prompt_chars = len(self.system_prompt or "") + len(self.memory.format_memories(query=prompt)) + len(str(prompt or ""))
+        start = time.perf_counter()
+        with get_openai_callback() as usage:
+            response = super()._query(prompt, expected_type=expected_type, with_cot=with_cot)
+        instrumentation.record_llm_call(LLMCall(
+            actor=self.name,
+            model=model_name(self.model),
+            seconds=time.perf_counter() - start,
+            prompt_chars=prompt_chars,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached=usage.successful_requests == 0,
+        ))
+        return response
+
+
+@functools.cache
+def _cached_llm_actor_class() -> type:
+    # interlab is slow to import, so it is only pulled in once an actor is needed
+    import interlab
+    return type(
+        "CachedLLMActor",
+        (LLMMetricsMixin, LLMCacheMixin, interlab.actor.OneShotLLMActor),
+        {"__module__": __name__},
+    )
+
+def create_llm_actor(name: str, model: Any, system_prompt: str, **kwargs) -> Any:
+    """A `OneShotLLMActor` whose queries go through the module's `llm_cache` and are recorded by `instrumentation`"""
+    return _cached_llm_actor_class()(name=name, model=model, system_prompt=system_prompt, **kwargs)
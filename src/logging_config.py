@@ -1,6 +1,9 @@
+import atexit
 import logging
+import queue
 import re
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from typing import Optional
 
@@ -55,28 +58,87 @@ class ColorizedArgsFormatter(logging.Formatter):
         record.args = orig_args
         return formatted
 
-# separate log streams to console and file
-run_timestamp = datetime.now()
-minute_timestamp = run_timestamp.strftime("%Y%m%d_%H%M")
+DEFAULT_LOG_DIR = Path(__file__).parent.resolve() / "../logs"
 
+date_format = '%Y-%m-%d %H:%M:%S'
+file_format = '\n---\n`--%(asctime)s %(levelname)s--`\n%(message)s\n'
+console_format = "[%(asctime)s %(levelname)-8s] %(message)s"
+
+# getting the root logger has no side effects; handlers (and the log file)
+# are only attached by an explicit configure_logging() call
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+_configured_handlers: list[logging.Handler] = []
+_queue_listener: QueueListener | None = None
+_production = False
 
-log_dir = Path(__file__).parent.resolve() / "../logs"
-Path(log_dir).mkdir(parents=True, exist_ok=True)
-log_filepath = log_dir / f"{minute_timestamp}.md"
-file_handler = logging.FileHandler(log_filepath)
-file_handler.setLevel(logging.INFO)
+def entity_dumps_enabled() -> bool:
+    """
+    Guard for per-entity DEBUG output on hot paths (datastore loads/saves,
+    world dumps). Always off in production mode, so callers skip building
+    those messages entirely.
+    """
+    return not _production and logger.isEnabledFor(logging.DEBUG)
 
-date_format = '%Y-%m-%d %H:%M:%S'
-file_format = '\n---\n`--%(asctime)s %(levelname)s--`\n%(message)s\n'
-console_format = "[%(asctime)s %(levelname)-8s] %(message)s"
-file_formatter = logging.Formatter(file_format, datefmt=date_format)
-console_handler.setFormatter(ColorizedArgsFormatter(console_format, datefmt=date_format))
-file_handler.setFormatter(file_formatter)
+def stop_logging() -> None:
+    """Flush queued records and detach the handlers attached by configure_logging()"""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+    for handler in _configured_handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    _configured_handlers.clear()
+
+def configure_logging(
+    log_dir: Path | None = DEFAULT_LOG_DIR,
+    console_level: int = logging.DEBUG,
+    file_level: int = logging.INFO,
+    production: bool = False,
+) -> Path | None:
+    """
+    Attach the console and markdown file handlers to the root logger.
+
+    Called by entry points (e.g. `run.start`); importing modules never opens
+    files. Calling it again replaces the previously attached handlers.
+    `log_dir=None` logs to the console only. Returns the log file path.
+
+    Records are handed to a `QueueHandler`; formatting, colorizing and the
+    console/file writes happen on a `QueueListener` background thread.
+    `production=True` raises the console to INFO and disables per-entity
+    debug dumps (see `entity_dumps_enabled`).
+    """
+    global _queue_listener, _production
+    stop_logging()
+
+    _production = production
+    if production:
+        console_level = max(console_level, logging.INFO)
+    logger.setLevel(min(console_level, file_level))
+
+    # separate log streams to console and file
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(console_level)
+    console_handler.setFormatter(ColorizedArgsFormatter(console_format, datefmt=date_format))
+    output_handlers: list[logging.Handler] = [console_handler]
+
+    log_filepath = None
+    if log_dir is not None:
+        run_timestamp = datetime.now()
+        minute_timestamp = run_timestamp.strftime("%Y%m%d_%H%M")
+        Path(log_dir).mkdir(parents=True, exist_ok=True)
+        log_filepath = Path(log_dir) / f"{minute_timestamp}.md"
+        file_handler = logging.FileHandler(log_filepath)
+        file_handler.setLevel(file_level)
+        file_handler.setFormatter(logging.Formatter(file_format, datefmt=date_format))
+        output_handlers.append(file_handler)
+
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    _queue_listener = QueueListener(queue_handler.queue, *output_handlers, respect_handler_level=True)
+    _queue_listener.start()
+    _configured_handlers.extend([queue_handler, *output_handlers])
+    logger.addHandler(queue_handler)
+    return log_filepath
 
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+atexit.register(stop_logging)
@@ -1,4 +1,5 @@
 import datastore
+from change_tracker import WorldChangeTracker, WorldDelta
 from logging_config import logger
 from schema import Character, Location, Relation
 
@@ -17,7 +18,7 @@ def format_relation_list_for_logs(relations: list[Relation]) -> None:
         f"- ({r.x_node_type}:**{r.x_node_id}**)->({r.y_node_type}:**{r.y_node_id}**): {r.description}" for r in relations
     ])
 
-def log_the_world_so_far() -> None:
+def log_the_world_so_far() -> tuple[list[Character], list[Location], list[Relation]]:
     logger.info("### The world so far:")
     characters = datastore.get_characters()
     logger.info(f"#### CHARACTERS\n{format_character_list_for_logs(characters)}")
@@ -26,4 +27,46 @@ def log_the_world_so_far() -> None:
     logger.info(f"#### LOCATIONS\n{format_location_list_for_logs(locations)}")
     
     relations = datastore.get_relations()
-    logger.info(f"#### RELATIONS\n{format_relation_list_for_logs(relations)}")
\ No newline at end of file
+    logger.info(f"#### RELATIONS\n{format_relation_list_for_logs(relations)}")
+    return (characters, locations, relations)
+
+def log_world_delta(delta: WorldDelta) -> None:
+    if delta.is_empty():
+        logger.info("### The world did not change since the last round.")
+        return
+    logger.info("### World changes since the last round:")
+    sections = [
+        ("NEW CHARACTERS", format_character_list_for_logs(delta.created_characters)),
+        ("UPDATED CHARACTERS", format_character_list_for_logs(delta.modified_characters)),
+        ("NEW LOCATIONS", format_location_list_for_logs(delta.created_locations)),
+        ("UPDATED LOCATIONS", format_location_list_for_logs(delta.modified_locations)),
+        ("NEW RELATIONS", format_relation_list_for_logs(delta.created_relations)),
+        ("UPDATED RELATIONS", format_relation_list_for_logs(delta.modified_relations)),
+    ]
+    for (title, formatted) in sections:
+        if formatted:
+            logger.info(f"#### {title}\n{formatted}")
+
+DEFAULT_WORLD_CHECKPOINT_EVERY = 5
+
+_change_tracker: WorldChangeTracker | None = None
+
+def log_world_progress(
+    round_n: int,
+    checkpoint_every: int = DEFAULT_WORLD_CHECKPOINT_EVERY,
+) -> None:
+    """
+    Log a full world checkpoint on round 1 and every `checkpoint_every` rounds
+    after it, and only the entities saved since the previous round otherwise.
+    The first round a process logs always gets a checkpoint, so a resumed run
+    does not start with a delta against a world it never logged.
+    """
+    global _change_tracker
+    if _change_tracker is None:
+        _change_tracker = WorldChangeTracker()
+        datastore.add_save_listener(_change_tracker.on_saved)
+
+    if not _change_tracker.has_checkpoint or (round_n - 1) % max(1, checkpoint_every) == 0:
+        _change_tracker.checkpoint(*log_the_world_so_far())
+    else:
+        log_world_delta(_change_tracker.drain())
\ No newline at end of file
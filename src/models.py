@@ -0,0 +1,23 @@
+import threading
+from typing import Any
+
+GPT35 = "gpt-3.5-turbo-1106"
+GPT4_TURBO = "gpt-4-1106-preview"
+
+_models: dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+def get_model(model_name: str) -> Any:
+    """
+    Shared chat model client for `model_name`, created on first use.
+
+    langchain is only imported (and clients only built) once a model is
+    actually needed, so importing `turn`/`upkeep` stays cheap.
+    """
+    with _models_lock:
+        model = _models.get(model_name)
+        if model is None:
+            import langchain.chat_models
+            model = langchain.chat_models.ChatOpenAI(model_name=model_name)
+            _models[model_name] = model
+        return model
@@ -0,0 +1,150 @@
+import threading
+
+import datastore
+from schema import CharacterOrbit, Relation, CHARACTER_NODE, LOCATION_NODE
+from world_store import NodeKey, relation_key
+
+DEFAULT_ORBIT_TOKEN_BUDGET = 600
+# rough tokens-per-character of English prose for OpenAI tokenizers; a real
+# tokenizer would need tiktoken's downloaded vocabularies at runtime
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _importance(relation: Relation) -> int:
+    return relation.importance if relation.importance is not None else 0
+
+
+def render_orbit(orbit: CharacterOrbit, token_budget: int = DEFAULT_ORBIT_TOKEN_BUDGET) -> str:
+    """
+    Compact text of a character's orbit for prompts.
+
+    Relations go most important first, each followed by the first mention
+    of the person or place it leads to, until `token_budget` is spent; the
+    focus character's own description is always included.
+    """
+    character = orbit.character
+    entities = {(CHARACTER_NODE, c.id): c for c in orbit.related_characters}
+    entities.update(((LOCATION_NODE, l.id), l) for l in orbit.related_locations)
+    entities[(CHARACTER_NODE, character.id)] = character
+
+    def name(node_type: str, node_id: str) -> str:
+        entity = entities.get((node_type, node_id))
+        return entity.name if entity is not None else node_id
+
+    lines = [f"{character.name}: {character.description}"]
+    tokens = estimate_tokens(lines[0])
+    introduced: set[NodeKey] = {(CHARACTER_NODE, character.id)}
+    relations = sorted(orbit.relations, key=_importance, reverse=True)
+    for (n, relation) in enumerate(relations):
+        importance = f" ({relation.importance}/10)" if relation.importance is not None else ""
+        relation_lines = [
+            f"- {name(relation.x_node_type, relation.x_node_id)} -> {name(relation.y_node_type, relation.y_node_id)}"
+            f"{importance}: {relation.description}"
+        ]
+        y_node = (relation.y_node_type, relation.y_node_id)
+        if y_node not in introduced and y_node in entities:
+            kind = "person" if relation.y_node_type == CHARACTER_NODE else "place"
+            relation_lines.append(f"  {entities[y_node].name} ({kind}): {entities[y_node].description}")
+        relation_tokens = sum(estimate_tokens(line) for line in relation_lines)
+        if tokens + relation_tokens > token_budget:
+            lines.append(f"(+{len(relations) - n} less important relations left out)")
+            break
+        if n == 0:
+            lines.append("Relations, most important first:")
+        lines.extend(relation_lines)
+        tokens += relation_tokens
+        introduced.add(y_node)
+    return "\n".join(lines)
+
+
+OrbitKey = tuple[frozenset[str], frozenset[NodeKey], int]
+
+
+class OrbitRenderCache:
+    """
+    Rendered orbits memoized per character.
+
+    An entry is only served for an orbit with the same relations and nodes,
+    rendered with the same token budget, so an orbit asked for at another
+    depth or importance cutoff is rendered again. It also depends on every
+    node of the orbit it was rendered from; saving any of those nodes, or a
+    relation touching one of them, drops it.
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_ORBIT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        # character id -> (orbit key, rendered text, nodes it depends on)
+        self._entries: dict[str, tuple[OrbitKey, str, set[NodeKey]]] = {}
+        self._dependents: dict[NodeKey, set[str]] = {}
+
+    def render(self, orbit: CharacterOrbit, token_budget: int | None = None) -> str:
+        character_id = orbit.character.id
+        token_budget = token_budget or self.token_budget
+        nodes = {(CHARACTER_NODE, character_id)}
+        nodes.update((CHARACTER_NODE, c.id) for c in orbit.related_characters)
+        nodes.update((LOCATION_NODE, l.id) for l in orbit.related_locations)
+        key = (frozenset(relation_key(r) for r in orbit.relations), frozenset(nodes), token_budget)
+        with self._lock:
+            entry = self._entries.get(character_id)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+        text = render_orbit(orbit, token_budget)
+        with self._lock:
+            self._drop(character_id)
+            self._entries[character_id] = (key, text, nodes)
+            for node in nodes:
+                self._dependents.setdefault(node, set()).add(character_id)
+        return text
+
+    def _drop(self, character_id: str) -> None:
+        entry = self._entries.pop(character_id, None)
+        if entry is None:
+            return
+        for node in entry[2]:
+            dependents = self._dependents.get(node)
+            if dependents is not None:
+                dependents.discard(character_id)
+                if not dependents:
+                    del self._dependents[node]
+
+    def invalidate(self, nodes: list[NodeKey]) -> None:
+        with self._lock:
+            for node in nodes:
+                for character_id in list(self._dependents.get(node, ())):
+                    self._drop(character_id)
+
+    def on_saved(self, entity_type: str, entities: list) -> None:
+        """`datastore` save listener dropping the orbits the saved entities appear in"""
+        if entity_type == datastore.RELATION_ENTITY:
+            self.invalidate([
+                node
+                for r in entities
+                for node in ((r.x_node_type, r.x_node_id), (r.y_node_type, r.y_node_id))
+            ])
+        else:
+            self.invalidate([(entity_type, e.id) for e in entities])
+
+
+_orbit_render_cache: OrbitRenderCache | None = None
+_orbit_render_cache_backend = None
+_orbit_render_cache_lock = threading.Lock()
+
+def get_orbit_render_cache() -> OrbitRenderCache:
+    """Shared cache for the current datastore backend, kept current through saves"""
+    global _orbit_render_cache, _orbit_render_cache_backend
+    with _orbit_render_cache_lock:
+        if _orbit_render_cache is None or _orbit_render_cache_backend is not datastore.backend:
+            if _orbit_render_cache is not None:
+                datastore.remove_save_listener(_orbit_render_cache.on_saved)
+            _orbit_render_cache = OrbitRenderCache()
+            _orbit_render_cache_backend = datastore.backend
+            datastore.add_save_listener(_orbit_render_cache.on_saved)
+        return _orbit_render_cache
+
+def render_character_orbit(orbit: CharacterOrbit) -> str:
+    return get_orbit_render_cache().render(orbit)
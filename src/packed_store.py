@@ -0,0 +1,329 @@
+import json
+import mmap
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from pydantic import BaseModel
+
+from logging_config import logger
+from schema import Character, Location, Relation
+from trusted_load import checksum, encode_record, load_model
+from world_store import NodeKey, check_versions, relation_key
+
+PACK_FORMAT_VERSION = 1
+PACK_HEADER = json.dumps({"format": "slice-of-mercury-pack", "version": PACK_FORMAT_VERSION}).encode("utf-8") + b"\n"
+# superseded records are only rewritten away once they outweigh the live ones
+MIN_COMPACTION_GARBAGE_BYTES = 1024 * 1024
+# the index log is folded into the index once it outgrows it
+MIN_INDEX_LOG_BYTES = 1024 * 1024
+
+CHARACTERS = "characters"
+LOCATIONS = "locations"
+RELATIONS = "relations"
+_MODELS: dict[str, type[BaseModel]] = {CHARACTERS: Character, LOCATIONS: Location, RELATIONS: Relation}
+
+
+def index_path(pack_path: Path) -> Path:
+    return pack_path.with_name(pack_path.name + ".idx")
+
+def index_log_path(pack_path: Path, generation: int) -> Path:
+    return pack_path.with_name(f"{index_path(pack_path).name}.{generation}.log")
+
+def remove_pack(pack_path: Path) -> None:
+    """Delete a packed world with its index and index logs"""
+    pack_path.unlink(missing_ok=True)
+    index_path(pack_path).unlink(missing_ok=True)
+    for log_path in pack_path.parent.glob(f"{index_path(pack_path).name}.*.log"):
+        log_path.unlink(missing_ok=True)
+
+
+def _encode(entity: BaseModel) -> bytes:
+    return encode_record(entity.__dict__)
+
+
+class PackedWorld:
+    """
+    A whole world in one append-only file of compact JSON lines, plus an index.
+
+    The index (`<pack>.idx`) maps every entity key to the `(offset, length,
+    version, checksum)` of its current record and is loaded into memory on open; records are read
+    through an `mmap` of the data file, so a lookup by id is one slice and a
+    full read of a table walks the file front to back. Saves append new
+    records, and their index entries to an index log (`<pack>.idx.<generation>.log`)
+    that is replayed over the index on open, leaving the superseded records
+    behind as garbage until `compact()`. The log is folded into a rewritten
+    index on compaction or once it outgrows the index, under a new generation
+    so a stale log is never replayed. Single writer process; safe across threads.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        self._file = None
+        self._mmap: mmap.mmap | None = None
+        self._entries: dict[str, dict[str, tuple[int, int, int, int | None]]] = {table: {} for table in _MODELS}
+        self._outgoing: dict[NodeKey, set[str]] = defaultdict(set)
+        self._incoming: dict[NodeKey, set[str]] = defaultdict(set)
+        self._relation_nodes: dict[str, tuple[NodeKey, NodeKey]] = {}
+        self._size = 0
+        self._garbage = 0
+        self._log_generation = 0
+        self._log_file = None
+        self._log_size = 0
+        self._index_size = 0
+        self._open()
+
+    # -------------- FILE -----------------
+    def _open(self) -> None:
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            remove_pack(self.path)
+            with open(self.path, "wb") as f:
+                f.write(PACK_HEADER)
+            self._size = len(PACK_HEADER)
+            self._write_index()
+        else:
+            self._read_index()
+        self._file = open(self.path, "r+b")
+        actual_size = os.fstat(self._file.fileno()).st_size
+        if actual_size < self._size:
+            raise ValueError(f"{self.path} is shorter than its index claims ({actual_size} < {self._size} bytes)")
+        if actual_size > self._size:
+            # records appended by a save whose index never made it to disk
+            logger.warning(f"Truncating {actual_size - self._size} unindexed bytes from {self.path}")
+            self._file.truncate(self._size)
+        self._remap()
+
+    def _remap(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+    def _read_index(self) -> None:
+        with open(index_path(self.path)) as f:
+            index = json.load(f)
+        if index.get("version") != PACK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported pack index version {index.get('version')} in {index_path(self.path)}")
+        self._size = index["data_size"]
+        self._garbage = index.get("garbage_size", 0)
+        for table in _MODELS:
+            # indexes written before entities were versioned hold (offset, length),
+            # and before records were checksummed (offset, length, version)
+            self._entries[table] = {
+                key: (*entry[:2], entry[2] if len(entry) > 2 else 1, entry[3] if len(entry) > 3 else None)
+                for key, entry in index[table].items()
+            }
+        for key, (x_node, y_node) in index["relation_nodes"].items():
+            self._index_relation(key, tuple(x_node), tuple(y_node))
+        self._index_size = os.path.getsize(index_path(self.path))
+        self._log_generation = index.get("log_generation", 0)
+        self._replay_index_log()
+
+    def _replay_index_log(self) -> None:
+        log_path = index_log_path(self.path, self._log_generation)
+        if not log_path.exists():
+            return
+        with open(log_path, "rb") as f:
+            data = f.read()
+        # every line holds absolute values, so replaying one twice is harmless;
+        # a torn last line is a save that never completed
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logger.warning(f"Dropping {len(data) - complete} bytes of an incomplete save from {log_path}")
+            with open(log_path, "r+b") as f:
+                f.truncate(complete)
+        for line in data[:complete].splitlines():
+            delta = json.loads(line)
+            self._size = delta["data_size"]
+            self._garbage = delta["garbage_size"]
+            self._entries[delta["table"]].update((key, tuple(entry)) for key, entry in delta["entries"].items())
+            for key, (x_node, y_node) in delta.get("relation_nodes", {}).items():
+                self._index_relation(key, tuple(x_node), tuple(y_node))
+        self._log_size = complete
+
+    def _append_index(self, table: str, keys: Iterable[str]) -> None:
+        """Log the index entries of `keys` just saved to `table`, folding the log into the index once it outgrows it"""
+        entries = self._entries[table]
+        delta = {
+            "data_size": self._size,
+            "garbage_size": self._garbage,
+            "table": table,
+            "entries": {key: entries[key] for key in keys},
+        }
+        if table == RELATIONS:
+            delta["relation_nodes"] = {key: self._relation_nodes[key] for key in keys}
+        line = json.dumps(delta, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        if self._log_file is None:
+            self._log_file = open(index_log_path(self.path, self._log_generation), "ab")
+        # one write, so a crash leaves at most a torn last line
+        self._log_file.write(line)
+        self._log_file.flush()
+        self._log_size += len(line)
+        if self._log_size > max(MIN_INDEX_LOG_BYTES, self._index_size):
+            self._write_index()
+
+    def _write_index(self) -> None:
+        """Rewrite the whole index, starting a new (empty) index log"""
+        old_log_path = index_log_path(self.path, self._log_generation)
+        index = {
+            "version": PACK_FORMAT_VERSION,
+            "log_generation": self._log_generation + 1,
+            "data_size": self._size,
+            "garbage_size": self._garbage,
+            **self._entries,
+            "relation_nodes": self._relation_nodes,
+        }
+        path = index_path(self.path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        self._index_size = os.path.getsize(path)
+        self._log_generation += 1
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        self._log_size = 0
+        old_log_path.unlink(missing_ok=True)
+
+    def _index_relation(self, key: str, x_node: NodeKey, y_node: NodeKey) -> None:
+        old_nodes = self._relation_nodes.get(key)
+        if old_nodes is not None:
+            self._outgoing[old_nodes[0]].discard(key)
+            self._incoming[old_nodes[1]].discard(key)
+        self._relation_nodes[key] = (x_node, y_node)
+        self._outgoing[x_node].add(key)
+        self._incoming[y_node].add(key)
+
+    def change_stamp(self) -> tuple[int, int]:
+        """(index generation, data size), which moves with every save and compaction"""
+        with self._lock:
+            return (self._log_generation, self._size)
+
+    # -------------- READ -----------------
+    def _read(self, table: str, entry: tuple[int, int, int, int | None]) -> BaseModel:
+        (offset, length, _, stored_checksum) = entry
+        record = self._mmap[offset:offset + length]
+        return load_model(_MODELS[table], json.loads(record), stored_checksum, record)
+
+    def get(self, table: str, key: str) -> BaseModel | None:
+        with self._lock:
+            entry = self._entries[table].get(key)
+            return self._read(table, entry) if entry is not None else None
+
+    def get_many(self, table: str, keys: Iterable[str]) -> list[BaseModel]:
+        with self._lock:
+            entries = self._entries[table]
+            return [self._read(table, entries[key]) for key in dict.fromkeys(keys) if key in entries]
+
+    def all(self, table: str) -> list[BaseModel]:
+        with self._lock:
+            # in file order, so the mmap is read sequentially
+            return [self._read(table, entry) for entry in sorted(self._entries[table].values())]
+
+    def iter_raw(self, table: str, keys: Iterable[str] | None = None) -> Iterator[dict]:
+        """
+        Records of `table` (or only those of `keys`) as plain dicts in file
+        order, without building models (holds the lock while iterating)
+        """
+        with self._lock:
+            entries = self._entries[table]
+            selected = entries.values() if keys is None else [entries[key] for key in dict.fromkeys(keys) if key in entries]
+            for (offset, length, _, _) in sorted(selected):
+                yield json.loads(self._mmap[offset:offset + length])
+
+    def record_stamps(self, table: str) -> dict[str, tuple[int, int | None]]:
+        """(version, checksum) of every record of `table`"""
+        with self._lock:
+            return {key: (version, record_checksum) for (key, (_, _, version, record_checksum)) in self._entries[table].items()}
+
+    def outgoing(self, nodes: Iterable[NodeKey]) -> list[Relation]:
+        with self._lock:
+            return self.get_many(RELATIONS, (key for node in dict.fromkeys(nodes) for key in self._outgoing.get(node, ())))
+
+    def incoming(self, nodes: Iterable[NodeKey]) -> list[Relation]:
+        with self._lock:
+            return self.get_many(RELATIONS, (key for node in dict.fromkeys(nodes) for key in self._incoming.get(node, ())))
+
+    def versions(self, table: str, keys: Iterable[str]) -> dict[str, int]:
+        with self._lock:
+            entries = self._entries[table]
+            return {key: entries[key][2] for key in dict.fromkeys(keys) if key in entries}
+
+    # -------------- WRITE -----------------
+    def save_many(self, table: str, entities: list[BaseModel], expected_versions: dict[str, int] | None = None) -> list[BaseModel]:
+        """
+        Append a batch; it only counts once its index entries are logged, so a
+        crash loses all of it or none. A key saved twice in one batch is stored
+        (and its version bumped) once, the last of them winning.
+        """
+        if not entities:
+            return entities
+        with self._lock:
+            entries = self._entries[table]
+            batch = {relation_key(entity) if table == RELATIONS else entity.id: entity for entity in entities}
+            check_versions(table, {key: entries[key][2] if key in entries else 0 for key in batch}, expected_versions)
+            chunks: list[bytes] = []
+            offset = self._size
+            for (key, entity) in batch.items():
+                record = _encode(entity)
+                old_entry = entries.get(key)
+                version = 1
+                if old_entry is not None:
+                    self._garbage += old_entry[1] + 1
+                    version = old_entry[2] + 1
+                entries[key] = (offset, len(record), version, checksum(record))
+                if table == RELATIONS:
+                    self._index_relation(key, (entity.x_node_type, entity.x_node_id), (entity.y_node_type, entity.y_node_id))
+                chunks.append(record + b"\n")
+                offset += len(record) + 1
+            self._file.seek(self._size)
+            self._file.write(b"".join(chunks))
+            self._file.flush()
+            self._size = offset
+            self._append_index(table, batch)
+            self._remap()
+            if self._garbage > max(MIN_COMPACTION_GARBAGE_BYTES, self._size - self._garbage):
+                self.compact()
+        return entities
+
+    def compact(self) -> None:
+        """Rewrite the file with only the current record of every entity"""
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            new_entries: dict[str, dict[str, tuple[int, int, int, int | None]]] = {}
+            with open(tmp_path, "wb") as f:
+                f.write(PACK_HEADER)
+                offset = len(PACK_HEADER)
+                for table in _MODELS:
+                    new_entries[table] = {}
+                    for key, (old_offset, length, version, record_checksum) in sorted(self._entries[table].items(), key=lambda item: item[1][0]):
+                        f.write(self._mmap[old_offset:old_offset + length] + b"\n")
+                        new_entries[table][key] = (offset, length, version, record_checksum)
+                        offset += length + 1
+            self._mmap.close()
+            self._mmap = None
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            logger.debug(f"Compacted {self.path} from {self._size} to {offset} bytes")
+            self._entries = new_entries
+            self._size = offset
+            self._garbage = 0
+            self._write_index()
+            self._file = open(self.path, "r+b")
+            self._remap()
@@ -1,13 +1,75 @@
 import os
 import sys
+from pathlib import Path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '.')))
 
 import dotenv
 dotenv.load_dotenv()
 
-from logging_config import logger
+import datastore
+from logging_config import configure_logging, logger
+from storage import export_json_to_packed, import_packed_to_json, migrate_json_to_sqlite, shard_json_world
 from turn import play_rounds
 
 def start():
-    logger.info("# STARTING a new run")
-    play_rounds()
\ No newline at end of file
+    """
+    Launched with `poetry run start [--snapshot] [--resume]`: `--snapshot` snapshots the world after every
+    round, `--resume` continues the last snapshotted run after its last completed round
+    """
+    # LOG_MODE=production drops per-entity debug dumps and DEBUG console output
+    configure_logging(production=os.environ.get("LOG_MODE") == "production")
+    resume = "--resume" in sys.argv[1:]
+    logger.info("# RESUMING the last run" if resume else "# STARTING a new run")
+    play_rounds(snapshot_rounds="--snapshot" in sys.argv[1:], resume=resume)
+
+def rollback():
+    """Launched with `poetry run rollback [ROUND]`: put the world in `src/data` back to the end of a round of the last run (default: its last completed one)"""
+    from snapshots import rollback
+    configure_logging(log_dir=None)
+    rollback(int(sys.argv[1]) if len(sys.argv) > 1 else None)
+
+def migrate_to_sqlite():
+    """Launched with `poetry run migrate_to_sqlite [DB_PATH]`: copy the JSON world in `src/data` into SQLite"""
+    configure_logging(log_dir=None)
+    db_path = sys.argv[1] if len(sys.argv) > 1 else datastore.DEFAULT_SQLITE_PATH
+    migrate_json_to_sqlite(datastore.DATA_DIR, db_path)
+
+def export_packed():
+    """Launched with `poetry run export_packed [PACK_PATH]`: pack the JSON world in `src/data` into one file"""
+    configure_logging(log_dir=None)
+    pack_path = sys.argv[1] if len(sys.argv) > 1 else datastore.DEFAULT_PACK_PATH
+    export_json_to_packed(datastore.DATA_DIR, pack_path).close()
+
+def import_packed():
+    """Launched with `poetry run import_packed [PACK_PATH]`: unpack a packed world into JSON files in `src/data`"""
+    configure_logging(log_dir=None)
+    pack_path = sys.argv[1] if len(sys.argv) > 1 else datastore.DEFAULT_PACK_PATH
+    import_packed_to_json(pack_path, datastore.DATA_DIR)
+
+def shard_world():
+    """Launched with `poetry run shard_world [DATA_DIR] [--flat]`: move a JSON world (default `src/data`) into the sharded layout, or back with `--flat`"""
+    configure_logging(log_dir=None)
+    args = [arg for arg in sys.argv[1:] if arg != "--flat"]
+    data_dir = Path(args[0]) if args else datastore.DATA_DIR
+    shard_json_world(data_dir, sharded="--flat" not in sys.argv[1:])
+
+def bench_imports():
+    """Launched with `poetry run bench_imports [MODULE ...] [--repeats N] [--output FILE]`"""
+    from benchmarks.import_time import main
+    main(sys.argv[1:])
+
+def bench_harness():
+    """Launched with `poetry run bench_harness [--sizes N ...] [--backend json|json-sharded|sqlite|packed] [--latency S] [--output FILE]`"""
+    from benchmarks.world_harness import main
+    main(sys.argv[1:])
+
+def bench_load():
+    """Launched with `poetry run bench_load [--sizes N ...] [--backends NAME ...] [--output FILE]`"""
+    from benchmarks.load_time import main
+    main(sys.argv[1:])
+
+def run_experiments():
+    """Launched with `poetry run run_experiments [--seeds N ...] [--settings FILE ...] [--rounds N] [--workers N] [--output DIR]`"""
+    from experiments import main
+    configure_logging(log_dir=None, production=os.environ.get("LOG_MODE") == "production")
+    main(sys.argv[1:])
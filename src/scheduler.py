@@ -0,0 +1,232 @@
+import math
+import random
+import threading
+
+import datastore
+from compact_world import CompactWorld, IMPORTANCE_UNKNOWN
+from logging_config import logger
+from schema import Character, Relation, CHARACTER_NODE
+
+# relations without an importance count as middling
+DEFAULT_RELATION_IMPORTANCE = 5
+# weight multiplier for the rounds right after a character was featured;
+# back to the full weight once the ramp is over
+RECENCY_RAMP = (0.05, 0.25, 0.5, 0.75)
+
+
+def relation_score(importance: int | None) -> float:
+    if importance is None or importance == IMPORTANCE_UNKNOWN:
+        importance = DEFAULT_RELATION_IMPORTANCE
+    return importance / 10
+
+def base_weight(score: float) -> float:
+    """Grows with the number and importance of a character's relations, but only logarithmically"""
+    # negative importances can pull the score below -1, where log1p is undefined
+    return 1.0 + math.log1p(max(score, 0.0))
+
+
+class FenwickTree:
+    """Prefix sums over a growable list of non-negative weights, with O(log n) update, append and search"""
+
+    def __init__(self, weights: list[float] = ()):
+        self._weights = list(weights)
+        self._tree = [0.0] * len(weights)
+        for (i, weight) in enumerate(weights):
+            self._tree[i] += weight
+            parent = i | (i + 1)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self) -> int:
+        return len(self._tree)
+
+    def weight(self, i: int) -> float:
+        return self._weights[i]
+
+    def set(self, i: int, weight: float) -> None:
+        delta = weight - self._weights[i]
+        self._weights[i] = weight
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i |= i + 1
+
+    def prefix_sum(self, end: int) -> float:
+        """Sum of weights[:end]"""
+        total = 0.0
+        while end > 0:
+            total += self._tree[end - 1]
+            end &= end - 1
+        return total
+
+    def total(self) -> float:
+        return self.prefix_sum(len(self._tree))
+
+    def append(self, weight: float) -> None:
+        i = len(self._tree)
+        self._weights.append(weight)
+        # node i covers weights[(i & (i + 1)):i + 1]
+        self._tree.append(weight + self.prefix_sum(i) - self.prefix_sum(i & (i + 1)))
+
+    def find(self, target: float) -> int:
+        """Smallest i with prefix_sum(i + 1) > target, the last positive weight for a target at or past the total"""
+        position = 0
+        step = 1 << (len(self._tree).bit_length())
+        while step:
+            next_position = position + step
+            if next_position <= len(self._tree) and self._tree[next_position - 1] <= target:
+                target -= self._tree[next_position - 1]
+                position = next_position
+            step >>= 1
+        if position < len(self._tree):
+            return position
+        # float drift can push the target past the last weight, which may be
+        # followed by zero weights (characters already drawn this round)
+        position = len(self._tree) - 1
+        while position > 0 and self._weights[position] <= 0:
+            position -= 1
+        return position
+
+
+class CharacterScheduler:
+    """
+    Picks the characters featured in each round.
+
+    Every character has a weight derived from the importance-weighted degree
+    of its relations, scaled down for a few rounds after it was featured
+    (`RECENCY_RAMP`) so coverage spreads across the cast. Weights live in a
+    Fenwick tree, so drawing k characters without replacement and updating
+    the weights of the featured ones costs O(k log n) per round, however
+    large the cast. Kept current through `datastore` saves; a relation saved
+    again counts again until the scheduler is rebuilt.
+    """
+
+    def __init__(self, character_ids: list[str] = (), scores: dict[str, float] | None = None):
+        scores = scores or {}
+        self._lock = threading.Lock()
+        self._ids: list[str] = []
+        self._index: dict[str, int] = {}
+        self._scores: list[float] = []
+        # character index -> position in RECENCY_RAMP, only for recently featured characters
+        self._recent: dict[int, int] = {}
+        for id in character_ids:
+            self._index[id] = len(self._ids)
+            self._ids.append(id)
+            self._scores.append(scores.get(id, 0.0))
+        self._tree = FenwickTree([base_weight(score) for score in self._scores])
+
+    @classmethod
+    def from_world(cls, world: CompactWorld) -> "CharacterScheduler":
+        scores: dict[str, float] = {}
+        for handle in world.handles(CHARACTER_NODE):
+            rows = [*world.outgoing_rows(handle), *world.incoming_rows(handle)]
+            scores[world.node_ids[handle]] = sum(relation_score(world.relation_importance[row]) for row in rows)
+        # sorted so that a seeded `random` picks the same characters regardless of storage order
+        return cls(sorted(scores), scores)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def weight(self, id: str) -> float | None:
+        i = self._index.get(id)
+        return self._tree.weight(i) if i is not None else None
+
+    def _set_weight(self, i: int, weight: float) -> None:
+        self._tree.set(i, weight)
+
+    def _target_weight(self, i: int) -> float:
+        stage = self._recent.get(i)
+        multiplier = RECENCY_RAMP[stage] if stage is not None else 1.0
+        return base_weight(self._scores[i]) * multiplier
+
+    def next_round(self, k: int, rng: random.Random | None = None) -> list[str]:
+        """Draw `k` distinct character ids (fewer if the cast is smaller) and mark them as featured"""
+        rng = rng or random
+        with self._lock:
+            picked: list[int] = []
+            for _ in range(min(k, len(self._ids))):
+                total = self._tree.total()
+                if total <= 0:
+                    break
+                i = self._tree.find(rng.random() * total)
+                picked.append(i)
+                # out of the draw for the rest of this round
+                self._set_weight(i, 0.0)
+
+            for (i, stage) in list(self._recent.items()):
+                if stage + 1 < len(RECENCY_RAMP):
+                    self._recent[i] = stage + 1
+                else:
+                    del self._recent[i]
+                if self._tree.weight(i) > 0:
+                    self._set_weight(i, self._target_weight(i))
+            for i in picked:
+                self._recent[i] = 0
+                self._set_weight(i, self._target_weight(i))
+            return [self._ids[i] for i in picked]
+
+    # -------------- RECENCY -----------------
+    def recent_state(self) -> dict[str, int]:
+        """Recently featured character ids and their position in RECENCY_RAMP, e.g. to snapshot a run"""
+        with self._lock:
+            return {self._ids[i]: stage for (i, stage) in self._recent.items()}
+
+    def restore_recent_state(self, recent: dict[str, int]) -> None:
+        """Replace the recency ramp with a `recent_state()`; ids no longer in the cast are ignored"""
+        with self._lock:
+            previous = self._recent
+            self._recent = {}
+            for i in previous:
+                self._set_weight(i, self._target_weight(i))
+            for (id, stage) in recent.items():
+                i = self._index.get(id)
+                if i is None:
+                    continue
+                self._recent[i] = min(max(stage, 0), len(RECENCY_RAMP) - 1)
+                self._set_weight(i, self._target_weight(i))
+
+    # -------------- UPDATES -----------------
+    def add_characters(self, characters: list[Character]) -> None:
+        with self._lock:
+            for character in characters:
+                if character.id in self._index:
+                    continue
+                self._index[character.id] = len(self._ids)
+                self._ids.append(character.id)
+                self._scores.append(0.0)
+                self._tree.append(base_weight(0.0))
+
+    def add_relations(self, relations: list[Relation]) -> None:
+        with self._lock:
+            for relation in relations:
+                for (node_type, node_id) in ((relation.x_node_type, relation.x_node_id), (relation.y_node_type, relation.y_node_id)):
+                    i = self._index.get(node_id) if node_type == CHARACTER_NODE else None
+                    if i is None:
+                        continue
+                    self._scores[i] += relation_score(relation.importance)
+                    if self._tree.weight(i) > 0:
+                        self._set_weight(i, self._target_weight(i))
+
+    def on_saved(self, entity_type: str, entities: list) -> None:
+        """`datastore` save listener keeping weights current as the world grows"""
+        if entity_type == CHARACTER_NODE:
+            self.add_characters(entities)
+        elif entity_type == datastore.RELATION_ENTITY:
+            self.add_relations(entities)
+
+
+_scheduler: CharacterScheduler | None = None
+_scheduler_backend = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> CharacterScheduler:
+    """Shared scheduler for the current datastore backend, built on first use and then kept current through saves"""
+    global _scheduler, _scheduler_backend
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_backend is not datastore.backend:
+            if _scheduler is not None:
+                datastore.remove_save_listener(_scheduler.on_saved)
+            logger.debug("Building character scheduler")
+            _scheduler = CharacterScheduler.from_world(datastore.load_compact_world())
+            _scheduler_backend = datastore.backend
+            datastore.add_save_listener(_scheduler.on_saved)
+        return _scheduler
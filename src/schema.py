@@ -38,6 +38,10 @@ class Location(BaseModel):
 
 CHARACTER_NODE_TYPE = Literal["character"]
 LOCATION_NODE_TYPE = Literal["location"]
+# runtime values of the node type literals above, for comparisons/lookups
+CHARACTER_NODE = "character"
+LOCATION_NODE = "location"
+NODE_TYPES = (CHARACTER_NODE, LOCATION_NODE)
 
 # UNIDIRECTIONAL = Literal["uni"]
 # BIDIRECTIONAL = Literal["bi"]
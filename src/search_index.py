@@ -0,0 +1,308 @@
+import atexit
+import heapq
+import json
+import math
+import os
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Hashable
+
+import datastore
+from logging_config import logger
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
+from storage import StorageBackend
+from util import str_to_tokens
+
+SEARCH_INDEX_FILENAME = "search_index.json"
+SEARCH_INDEX_VERSION = 2
+# name tokens count this many times over description tokens
+NAME_BOOST = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+# saves mark the index dirty; it is written at most this often (and at exit)
+PERSIST_INTERVAL_SECONDS = 30.0
+# searches check for saves made by other processes at most this often
+RESYNC_SECONDS = 2.0
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "he", "her", "his",
+    "in", "is", "it", "its", "of", "on", "or", "she", "that", "the", "their", "they", "this",
+    "to", "was", "who", "with",
+}
+
+SEARCHABLE_TABLES = {CHARACTER_NODE: CHARACTERS, LOCATION_NODE: LOCATIONS, datastore.RELATION_ENTITY: RELATIONS}
+
+DocKey = tuple[str, str]  # (entity_type, id or x--y relation key)
+
+
+@dataclass
+class SearchHit:
+    entity_type: str
+    key: str
+    score: float
+    entity: Character | Location | Relation | None = None
+
+
+def record_key(entity_type: str, record: dict) -> str:
+    if entity_type == datastore.RELATION_ENTITY:
+        return f"{record['x_node_id']}--{record['y_node_id']}"
+    return record["id"]
+
+
+def _terms(text: str) -> list[str]:
+    return [t for t in str_to_tokens(text) if t not in STOPWORDS]
+
+def document_terms(entity_type: str, record: dict) -> Counter:
+    terms = Counter(_terms(record.get("description") or ""))
+    for term in _terms(record.get("name") or ""):
+        terms[term] += NAME_BOOST
+    return terms
+
+def _content_hash(record: dict) -> int:
+    return zlib.crc32(f"{record.get('name') or ''}\x00{record.get('description') or ''}".encode("utf-8"))
+
+
+class SearchIndex:
+    """
+    Incremental inverted index with BM25 ranking over entity names and descriptions.
+
+    Postings map each term to `{doc: term frequency}`, so a query only touches
+    the documents containing its terms. Each document remembers a hash of its
+    text; re-indexing an unchanged entity is a no-op. It also remembers the
+    backend's stamp of the record it was indexed from (`record_stamps`), so
+    `sync` catches up with a persisted index, or with saves by other
+    processes, by reading only the records whose stamp moved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._doc_numbers: dict[DocKey, int] = {}
+        self._docs: list[DocKey | None] = []
+        self._doc_terms: list[dict[str, int] | None] = []
+        self._doc_hashes: list[int] = []
+        self._doc_stamps: list[Hashable | None] = []
+        self._doc_lengths: list[int] = []
+        self._free: list[int] = []
+        self._postings: dict[str, dict[int, int]] = defaultdict(dict)
+        self._total_length = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    # -------------- UPDATES -----------------
+    def _remove(self, doc: int) -> None:
+        for term in self._doc_terms[doc]:
+            postings = self._postings[term]
+            del postings[doc]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths[doc]
+        del self._doc_numbers[self._docs[doc]]
+        self._docs[doc] = None
+        self._doc_terms[doc] = None
+        self._free.append(doc)
+
+    def _add(self, doc_key: DocKey, terms: dict[str, int], content_hash: int, stamp: Hashable | None = None) -> None:
+        if self._free:
+            doc = self._free.pop()
+            self._docs[doc] = doc_key
+            self._doc_terms[doc] = terms
+            self._doc_hashes[doc] = content_hash
+            self._doc_stamps[doc] = stamp
+            self._doc_lengths[doc] = sum(terms.values())
+        else:
+            doc = len(self._docs)
+            self._docs.append(doc_key)
+            self._doc_terms.append(terms)
+            self._doc_hashes.append(content_hash)
+            self._doc_stamps.append(stamp)
+            self._doc_lengths.append(sum(terms.values()))
+        self._doc_numbers[doc_key] = doc
+        self._total_length += self._doc_lengths[doc]
+        for (term, frequency) in terms.items():
+            self._postings[term][doc] = frequency
+
+    def upsert(self, entity_type: str, record: dict, stamp: Hashable | None = None) -> None:
+        """Index `record`; `stamp` is its backend record stamp, None when unknown (e.g. right after a save)"""
+        doc_key = (entity_type, record_key(entity_type, record))
+        content_hash = _content_hash(record)
+        with self._lock:
+            doc = self._doc_numbers.get(doc_key)
+            if doc is not None:
+                if self._doc_hashes[doc] == content_hash:
+                    if self._doc_stamps[doc] != stamp:
+                        self._doc_stamps[doc] = stamp
+                        self.dirty = True
+                    return
+                self._remove(doc)
+            self._add(doc_key, dict(document_terms(entity_type, record)), content_hash, stamp)
+            self.dirty = True
+
+    def sync(self, backend: StorageBackend) -> None:
+        """
+        Bring the index in line with everything stored in `backend`: only the
+        records whose `record_stamps` stamp moved are read (and re-tokenized if
+        their text changed), everything for backends that keep no stamps.
+        """
+        for (entity_type, table) in SEARCHABLE_TABLES.items():
+            stamps = backend.record_stamps(table)
+            if stamps is None:
+                listed = {record_key(entity_type, record): record for record in backend.iter_raw(table)}
+                for record in listed.values():
+                    self.upsert(entity_type, record)
+            else:
+                listed = stamps
+                with self._lock:
+                    changed = [
+                        key for (key, stamp) in stamps.items()
+                        if (doc := self._doc_numbers.get((entity_type, key))) is None or self._doc_stamps[doc] != stamp
+                    ]
+                if changed:
+                    # a record saved again after the listing keeps its older stamp, so it is read again next time
+                    for record in backend.iter_raw(table, changed):
+                        self.upsert(entity_type, record, stamps[record_key(entity_type, record)])
+            with self._lock:
+                for doc_key in [k for k in self._doc_numbers if k[0] == entity_type and k[1] not in listed]:
+                    self._remove(self._doc_numbers[doc_key])
+                    self.dirty = True
+
+    def on_saved(self, entity_type: str, entities: list) -> None:
+        """`datastore` save listener keeping the index current"""
+        if entity_type not in SEARCHABLE_TABLES:
+            return
+        for entity in entities:
+            self.upsert(entity_type, entity.__dict__)
+
+    # -------------- QUERY -----------------
+    def search(
+        self,
+        query: str,
+        entity_types: list[str] | None = None,
+        limit: int = 10,
+    ) -> list[SearchHit]:
+        """Best `limit` matches for the words of `query`, by BM25 score"""
+        terms = set(_terms(query))
+        allowed_types = set(entity_types) if entity_types is not None else None
+        scores: dict[int, float] = defaultdict(float)
+        with self._lock:
+            num_docs = len(self._doc_numbers)
+            if not num_docs or not terms:
+                return []
+            average_length = self._total_length / num_docs
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for (doc, frequency) in postings.items():
+                    if allowed_types is not None and self._docs[doc][0] not in allowed_types:
+                        continue
+                    length_norm = 1 - BM25_B + BM25_B * self._doc_lengths[doc] / average_length
+                    scores[doc] += idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [SearchHit(*self._docs[doc], score=score) for (doc, score) in best]
+
+    # -------------- PERSISTENCE -----------------
+    def save(self, path: Path) -> None:
+        with self._lock:
+            data = {
+                "version": SEARCH_INDEX_VERSION,
+                "docs": [
+                    [*doc_key, self._doc_hashes[doc], self._doc_terms[doc], self._doc_stamps[doc]]
+                    for (doc_key, doc) in self._doc_numbers.items()
+                ],
+            }
+            self.dirty = False
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "SearchIndex":
+        index = cls()
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != SEARCH_INDEX_VERSION:
+            logger.info(f"Ignoring search index {path} of version {data.get('version')}")
+            return index
+        for (entity_type, key, content_hash, terms, stamp) in data["docs"]:
+            # stamps are tuples or ints, JSON turns the tuples into lists
+            index._add((entity_type, key), terms, content_hash, tuple(stamp) if isinstance(stamp, list) else stamp)
+        return index
+
+
+_search_index: SearchIndex | None = None
+_search_index_backend = None
+# backend change stamp at the last sync, and when it was last checked
+_search_index_stamp = None
+_synced_at = 0.0
+_search_index_lock = threading.Lock()
+_persisted_at = 0.0
+_persist_lock = threading.Lock()
+
+def _index_path(backend: StorageBackend) -> Path | None:
+    return backend.sidecar_path(SEARCH_INDEX_FILENAME)
+
+def persist_search_index(force: bool = False) -> None:
+    """Write the shared index next to the data if it changed (at most every PERSIST_INTERVAL_SECONDS unless forced)"""
+    global _persisted_at
+    index, backend = _search_index, _search_index_backend
+    if index is None or not index.dirty:
+        return
+    if not force and time.monotonic() - _persisted_at < PERSIST_INTERVAL_SECONDS:
+        return
+    path = _index_path(backend)
+    if path is None:
+        return
+    with _persist_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        index.save(path)
+        _persisted_at = time.monotonic()
+
+def _on_saved(entity_type: str, entities: list) -> None:
+    if _search_index is not None:
+        _search_index.on_saved(entity_type, entities)
+        persist_search_index()
+
+def get_search_index() -> SearchIndex:
+    """
+    Shared index for the current datastore backend: loaded from its sidecar
+    file, synced, then kept current through saves. Saves by other processes
+    are caught by syncing again whenever the backend's change stamp moved or
+    is unknown (checked at most every RESYNC_SECONDS); a sync lists record
+    stamps and reads only the records that changed.
+    """
+    global _search_index, _search_index_backend, _search_index_stamp, _synced_at
+    with _search_index_lock:
+        if _search_index is not None and _search_index_backend is datastore.backend:
+            if time.monotonic() - _synced_at >= RESYNC_SECONDS:
+                stamp = _search_index_backend.change_stamp()
+                if stamp is None or stamp != _search_index_stamp:
+                    _search_index.sync(_search_index_backend)
+                    _search_index_stamp = stamp
+                    persist_search_index()
+                _synced_at = time.monotonic()
+        else:
+            if _search_index is None:
+                datastore.add_save_listener(_on_saved)
+                atexit.register(persist_search_index, force=True)
+            else:
+                persist_search_index(force=True)
+            backend = datastore.backend
+            path = _index_path(backend)
+            index = SearchIndex.load(path) if path is not None and path.exists() else SearchIndex()
+            logger.debug(f"Syncing search index ({len(index)} documents loaded)")
+            # taken before syncing, so a save landing meanwhile moves it again
+            _search_index_stamp = backend.change_stamp()
+            index.sync(backend)
+            _search_index = index
+            _search_index_backend = backend
+            _synced_at = time.monotonic()
+            persist_search_index(force=True)
+        return _search_index
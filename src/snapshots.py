@@ -0,0 +1,253 @@
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import datastore
+from logging_config import logger
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS
+from schema import CHARACTER_NODE, LOCATION_NODE
+from storage import JsonDirectoryBackend, StorageBackend
+from world_store import relation_key
+
+SNAPSHOTS_DIRNAME = ".snapshots"
+RUN_FILENAME = "run.json"
+ROUND_FILENAME = "round.json"
+TOUCHED_FILENAME = "touched.jsonl"
+ABSENT_FILENAME = "absent.jsonl"
+SNAPSHOT_TABLES = {CHARACTER_NODE: CHARACTERS, LOCATION_NODE: LOCATIONS, datastore.RELATION_ENTITY: RELATIONS}
+
+EntityRef = tuple[str, str]  # (table, key)
+
+
+def _link_into_place(source: Path, target: Path) -> None:
+    """Atomically make `target` a hard link to `source` (a copy where linking fails)"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(data, indent=4))
+    os.replace(tmp_path, path)
+
+def _read_refs(path: Path) -> set[EntityRef]:
+    if not path.exists():
+        return set()
+    with open(path) as f:
+        return {tuple(ref) for line in f if line.strip() for ref in json.loads(line)}
+
+
+class RoundSnapshots:
+    """
+    Per-round snapshots of a JSON directory world, to resume or roll back a run.
+
+    Snapshots hard-link entity files instead of copying them; saves rename
+    new files over old ones and never write into them, so a linked file
+    keeps its content. Right before an entity is saved for the first time in
+    a run, its file is linked into `base/` (or it is noted as absent); at the
+    end of round n the files of the entities saved during the round are
+    linked into `rounds/<n>/`. A round therefore costs one link per entity it
+    changed, however large the world. Every entity about to be saved is also
+    logged to the round's `touched.jsonl` first, so the saves of a round cut
+    short by a crash can be undone as well. Rolling back saves the
+    snapshotted records again as new versions (`EntityTable.restore`), so
+    versions only ever go up.
+
+    Assumes nothing else writes to the world while rolling back.
+    """
+
+    def __init__(self, backend: JsonDirectoryBackend):
+        self.backend = backend
+        self.root = Path(backend.data_dir) / SNAPSHOTS_DIRNAME
+        self.base_dir = self.root / "base"
+        self._lock = threading.Lock()
+        self._based: set[EntityRef] = set()
+        self._touched: set[EntityRef] = set()
+        self._touched_log = None
+        self._absent_log = None
+        self.round_n: int | None = None
+
+    @classmethod
+    def for_backend(cls, backend: StorageBackend) -> "RoundSnapshots | None":
+        """Snapshots of `backend`'s world, None for backends other than JSON directories"""
+        return cls(backend) if isinstance(backend, JsonDirectoryBackend) else None
+
+    # -------------- LAYOUT -----------------
+    def entity_path(self, ref: EntityRef) -> Path:
+        (table, key) = ref
+        return getattr(self.backend.world_store, table).filepath(key)
+
+    def round_dir(self, round_n: int) -> Path:
+        return self.root / "rounds" / str(round_n)
+
+    @staticmethod
+    def _snapshot_path(directory: Path, ref: EntityRef) -> Path:
+        return directory / ref[0] / f"{ref[1]}.json"
+
+    def run_info(self) -> dict | None:
+        path = self.root / RUN_FILENAME
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def round_numbers(self) -> list[int]:
+        """Every round with a snapshot directory, completed or not"""
+        rounds_dir = self.root / "rounds"
+        return sorted(int(p.name) for p in rounds_dir.iterdir()) if rounds_dir.exists() else []
+
+    def round_manifest(self, round_n: int) -> dict | None:
+        """What was recorded at the end of `round_n`, None unless it completed"""
+        path = self.round_dir(round_n) / ROUND_FILENAME
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def last_completed_round(self) -> int:
+        completed = [n for n in self.round_numbers() if self.round_manifest(n) is not None]
+        return completed[-1] if completed else 0
+
+    # -------------- RECORDING -----------------
+    def start_run(self, info: dict) -> None:
+        """Forget the snapshots of any previous run and start recording a new one described by `info`"""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.base_dir.mkdir(parents=True)
+        _write_json(self.root / RUN_FILENAME, info)
+        self._based = set()
+
+    def attach(self) -> None:
+        """Start recording saves (continuing whatever run is on disk)"""
+        self._based = {
+            (table.name, path.name[:-len(".json")])
+            for table in self.base_dir.iterdir() if table.is_dir()
+            for path in table.iterdir() if path.name.endswith(".json")
+        } | _read_refs(self.base_dir / ABSENT_FILENAME)
+        datastore.add_pre_save_listener(self.before_save)
+
+    def detach(self) -> None:
+        datastore.remove_pre_save_listener(self.before_save)
+        with self._lock:
+            for log in (self._touched_log, self._absent_log):
+                if log is not None:
+                    log.close()
+            self._touched_log = self._absent_log = None
+
+    def before_save(self, entity_type: str, entities: list) -> None:
+        """`datastore` pre-save listener keeping the pre-run state and logging what the round touches"""
+        table = SNAPSHOT_TABLES[entity_type]
+        refs = [
+            (table, relation_key(e) if entity_type == datastore.RELATION_ENTITY else e.id)
+            for e in entities
+        ]
+        with self._lock:
+            absent = []
+            for ref in refs:
+                if ref in self._based:
+                    continue
+                live_path = self.entity_path(ref)
+                if live_path.exists():
+                    _link_into_place(live_path, self._snapshot_path(self.base_dir, ref))
+                else:
+                    absent.append(ref)
+                self._based.add(ref)
+            if absent:
+                if self._absent_log is None:
+                    self._absent_log = open(self.base_dir / ABSENT_FILENAME, "a")
+                self._absent_log.write(json.dumps(absent) + "\n")
+                self._absent_log.flush()
+            new_refs = [ref for ref in refs if ref not in self._touched]
+            self._touched.update(new_refs)
+            if new_refs and self._touched_log is not None:
+                self._touched_log.write(json.dumps(new_refs) + "\n")
+                self._touched_log.flush()
+
+    def start_round(self, round_n: int) -> None:
+        with self._lock:
+            self.round_n = round_n
+            round_dir = self.round_dir(round_n)
+            round_dir.mkdir(parents=True, exist_ok=True)
+            self._touched_log = open(round_dir / TOUCHED_FILENAME, "a")
+            # saves made since the previous round count towards this one
+            if self._touched:
+                self._touched_log.write(json.dumps(sorted(self._touched)) + "\n")
+                self._touched_log.flush()
+
+    def complete_round(self, round_n: int, info: dict) -> None:
+        """Link the entities saved during the round and mark it completed, with `info` kept for resuming"""
+        with self._lock:
+            round_dir = self.round_dir(round_n)
+            for ref in self._touched:
+                live_path = self.entity_path(ref)
+                if live_path.exists():
+                    _link_into_place(live_path, self._snapshot_path(round_dir, ref))
+            _write_json(round_dir / ROUND_FILENAME, {"round": round_n, "entities": sorted(self._touched), **info})
+            self._touched_log.close()
+            self._touched_log = None
+            (round_dir / TOUCHED_FILENAME).unlink()
+            self._touched = set()
+            self.round_n = None
+
+    # -------------- ROLLBACK -----------------
+    def rollback(self, to_round: int) -> dict | None:
+        """
+        Put the world back the way it was at the end of `to_round` (0 for the
+        start of the run), truncate the run's journal to match and drop the
+        later snapshots. Returns the manifest of `to_round`.
+        """
+        later_rounds = [n for n in self.round_numbers() if n > to_round]
+        if to_round != 0 and self.round_manifest(to_round) is None:
+            raise ValueError(f"Round {to_round} has no completed snapshot in {self.root}")
+        touched: set[EntityRef] = set()
+        for round_n in later_rounds:
+            manifest = self.round_manifest(round_n)
+            if manifest is not None:
+                touched.update(tuple(ref) for ref in manifest["entities"])
+            else:
+                touched |= _read_refs(self.round_dir(round_n) / TOUCHED_FILENAME)
+
+        absent = _read_refs(self.base_dir / ABSENT_FILENAME)
+        earlier_rounds = [self.round_dir(n) for n in reversed(range(1, to_round + 1))]
+        restored: dict[str, dict[str, Path | None]] = {}
+        for ref in touched:
+            source = next(
+                (path for path in (self._snapshot_path(d, ref) for d in [*earlier_rounds, self.base_dir]) if path.exists()),
+                None,
+            )
+            if source is None and ref not in absent:
+                logger.warning(f"No snapshot of {ref[0]} {ref[1]}, leaving it as it is.")
+                continue
+            restored.setdefault(ref[0], {})[ref[1]] = source
+        for (table, sources) in restored.items():
+            getattr(self.backend.world_store, table).restore(sources)
+        for round_n in later_rounds:
+            shutil.rmtree(self.round_dir(round_n))
+
+        manifest = self.round_manifest(to_round) if to_round else None
+        run_info = self.run_info() or {}
+        journal_path = run_info.get("journal")
+        if journal_path is not None and Path(journal_path).exists():
+            os.truncate(journal_path, manifest["journal_size"] if manifest else 0)
+        logger.info(f"Rolled {len(touched)} entities of {self.backend.data_dir} back to round {to_round}")
+        return manifest
+
+
+def random_state(state: list) -> tuple:
+    """`random.getstate()` back from its JSON form"""
+    (version, internal_state, gauss_next) = state
+    return (version, tuple(internal_state), gauss_next)
+
+
+def rollback(to_round: int | None = None) -> dict | None:
+    """
+    Roll the current datastore world back to a completed round, by default
+    the last one (undoing the saves of a round that did not complete).
+    """
+    snapshots = RoundSnapshots.for_backend(datastore.backend)
+    if snapshots is None or snapshots.run_info() is None:
+        raise ValueError("No round snapshots to roll back to (they are only kept for JSON directory worlds)")
+    manifest = snapshots.rollback(snapshots.last_completed_round() if to_round is None else to_round)
+    # caches and indexes built on the old files are rebuilt from scratch
+    datastore.set_backend(JsonDirectoryBackend(snapshots.backend.data_dir))
+    return manifest
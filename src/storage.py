@@ -0,0 +1,729 @@
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from pathlib import Path
+from typing import Hashable, Iterable, Iterator
+
+from logging_config import logger
+from packed_store import CHARACTERS, LOCATIONS, RELATIONS, PackedWorld, remove_pack
+from schema import Character, Location, Relation, NODE_TYPES
+from trusted_load import CHECKSUM_FIELD
+from world_store import NodeKey, VERSION_FIELD, VersionConflictError, WorldStore, check_versions, relation_key
+
+
+class StorageBackend(ABC):
+    """
+    Interface implemented by every place a world can live.
+
+    The module-level `datastore.get_*`/`save_*` functions delegate to one of
+    these. `save_*` calls receive whole batches so backends can apply them
+    in one go: either every entity of a batch is saved or none is.
+
+    Every stored entity has a version, 1 on its first save and bumped by
+    each later one. `save_*` take optional `expected_versions` (entity key ->
+    version the caller read, 0 for "must not exist yet") and raise
+    `VersionConflictError` without saving anything if one does not match.
+    """
+
+    # -------------- CHARACTER -----------------
+    @abstractmethod
+    def get_characters(
+        self,
+        id_in: list[str] | None = None,
+        name_in: list[str] | None = None,
+    ) -> list[Character]: ...
+
+    @abstractmethod
+    def get_character(self, id: str) -> Character | None: ...
+
+    @abstractmethod
+    def save_characters(
+        self,
+        characters: list[Character],
+        expected_versions: dict[str, int] | None = None,
+    ) -> list[Character]: ...
+
+    # -------------- LOCATION -----------------
+    @abstractmethod
+    def get_locations(
+        self,
+        id_in: list[str] | None = None,
+        name_in: list[str] | None = None,
+    ) -> list[Location]: ...
+
+    @abstractmethod
+    def get_location(self, id: str) -> Location | None: ...
+
+    @abstractmethod
+    def save_locations(
+        self,
+        locations: list[Location],
+        expected_versions: dict[str, int] | None = None,
+    ) -> list[Location]: ...
+
+    # -------------- RELATION -----------------
+    @abstractmethod
+    def get_relations(
+        self,
+        x_node_id_eq: str | None = None,
+        y_node_id_eq: str | None = None,
+    ) -> list[Relation]: ...
+
+    @abstractmethod
+    def get_outgoing_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        """Relations whose (x_node_type, x_node_id) is any of `nodes`"""
+
+    @abstractmethod
+    def get_incoming_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        """Relations whose (y_node_type, y_node_id) is any of `nodes`"""
+
+    @abstractmethod
+    def save_relations(
+        self,
+        relations: list[Relation],
+        expected_versions: dict[str, int] | None = None,
+    ) -> list[Relation]:
+        """`expected_versions` is keyed by `relation_key`"""
+
+    # -------------- VERSIONS -----------------
+    @abstractmethod
+    def get_versions(self, table: str, keys: list[str]) -> dict[str, int]:
+        """Version of every existing entity among `keys` of `table` (CHARACTERS, LOCATIONS or RELATIONS)"""
+
+    # -------------- BULK -----------------
+    def iter_raw(self, table: str, keys: Iterable[str] | None = None) -> Iterator[dict]:
+        """
+        Every entity of `table` (CHARACTERS, LOCATIONS or RELATIONS) as a plain
+        field dict, or only the existing ones among `keys` (relations keyed by
+        `relation_key`).
+
+        For bulk loads that do not want a model per entity; backends override
+        this to skip building models altogether.
+        """
+        if keys is None:
+            entities = {
+                CHARACTERS: self.get_characters,
+                LOCATIONS: self.get_locations,
+                RELATIONS: self.get_relations,
+            }[table]()
+        elif table == RELATIONS:
+            wanted = set(keys)
+            entities = [r for r in self.get_relations() if relation_key(r) in wanted]
+        else:
+            entities = {CHARACTERS: self.get_characters, LOCATIONS: self.get_locations}[table](id_in=list(keys))
+        for entity in entities:
+            yield entity.dict()
+
+    def record_stamps(self, table: str) -> dict[str, Hashable] | None:
+        """
+        Key -> cheap marker of every entity of `table` that changes whenever
+        the entity does (file stamp, version, ...), listed without reading the
+        entities, so derived data can re-read only what changed. None if the
+        backend cannot tell.
+        """
+        return None
+
+    def sidecar_path(self, filename: str) -> Path | None:
+        """Where derived data (e.g. search indexes) for this world is kept, None if it is not persisted"""
+        return None
+
+    def change_stamp(self) -> Hashable | None:
+        """
+        Cheap value that differs whenever the stored world may have changed,
+        including saves by other processes, so readers can skip re-reading an
+        unchanged world. None means unknown: assume it changed.
+        """
+        return None
+
+
+def _filter_by_name(entities: list, name_in: list[str] | None) -> list:
+    if name_in is None:
+        return entities
+    name_set = set(name_in)
+    return [e for e in entities if e.name in name_set]
+
+
+# -------------- JSON DIRECTORY -----------------
+class JsonDirectoryBackend(StorageBackend):
+    """
+    One pretty-printed JSON file per entity under `data_dir`, read through a
+    `WorldStore` cache. `sharded` picks the layout of a new world (see
+    `EntityTable`); an existing one keeps its own.
+    """
+
+    def __init__(self, data_dir: Path, sharded: bool | None = None):
+        self.data_dir = data_dir
+        self.world_store = WorldStore(data_dir, sharded=sharded)
+
+    def get_characters(self, id_in=None, name_in=None) -> list[Character]:
+        if id_in is not None:
+            characters = self.world_store.characters.get_many(id_in)
+        else:
+            characters = self.world_store.characters.all()
+        return _filter_by_name(characters, name_in)
+
+    def get_character(self, id: str) -> Character | None:
+        return self.world_store.characters.get(id)
+
+    def save_characters(self, characters: list[Character], expected_versions=None) -> list[Character]:
+        return self.world_store.characters.save_many(characters, expected_versions)
+
+    def get_locations(self, id_in=None, name_in=None) -> list[Location]:
+        if id_in is not None:
+            locations = self.world_store.locations.get_many(id_in)
+        else:
+            locations = self.world_store.locations.all()
+        return _filter_by_name(locations, name_in)
+
+    def get_location(self, id: str) -> Location | None:
+        return self.world_store.locations.get(id)
+
+    def save_locations(self, locations: list[Location], expected_versions=None) -> list[Location]:
+        return self.world_store.locations.save_many(locations, expected_versions)
+
+    def get_relations(self, x_node_id_eq=None, y_node_id_eq=None) -> list[Relation]:
+        if x_node_id_eq is not None:
+            relations = self.world_store.relations.outgoing(
+                (node_type, x_node_id_eq) for node_type in NODE_TYPES
+            )
+        else:
+            relations = self.world_store.relations.all()
+        if y_node_id_eq is not None:
+            relations = [r for r in relations if r.y_node_id == y_node_id_eq]
+        return relations
+
+    def get_outgoing_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self.world_store.relations.outgoing(nodes)
+
+    def get_incoming_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self.world_store.relations.incoming(nodes)
+
+    def save_relations(self, relations: list[Relation], expected_versions=None) -> list[Relation]:
+        return self.world_store.relations.save_many(relations, expected_versions)
+
+    def get_versions(self, table: str, keys: list[str]) -> dict[str, int]:
+        return getattr(self.world_store, table).versions(keys)
+
+    def sidecar_path(self, filename: str) -> Path | None:
+        return Path(self.data_dir) / filename
+
+    def change_stamp(self) -> Hashable | None:
+        return self.world_store.change_stamp()
+
+    def record_stamps(self, table: str) -> dict[str, Hashable] | None:
+        return getattr(self.world_store, table).stamps()
+
+    def iter_raw(self, table: str, keys: Iterable[str] | None = None) -> Iterator[dict]:
+        # straight from the files, bypassing (and not filling) the model cache
+        entity_table = getattr(self.world_store, table)
+        for id in (entity_table.ids() if keys is None else dict.fromkeys(keys)):
+            try:
+                with open(entity_table.filepath(id)) as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                continue
+            record.pop(VERSION_FIELD, None)
+            record.pop(CHECKSUM_FIELD, None)
+            yield record
+
+
+# -------------- IN MEMORY -----------------
+class MemoryBackend(StorageBackend):
+    """
+    World held entirely in dicts, with the same adjacency indexes as `RelationTable`.
+
+    Nothing touches the filesystem, so reads are plain dict lookups; handy as
+    an immutable read snapshot (see `from_backend`) or a scratch world.
+    Versions start over at 1 in a copy.
+    """
+
+    def __init__(
+        self,
+        characters: Iterable[Character] = (),
+        locations: Iterable[Location] = (),
+        relations: Iterable[Relation] = (),
+    ):
+        self.characters: dict[str, Character] = {}
+        self.locations: dict[str, Location] = {}
+        self.relations: dict[str, Relation] = {}
+        self._outgoing: dict[NodeKey, set[str]] = defaultdict(set)
+        self._incoming: dict[NodeKey, set[str]] = defaultdict(set)
+        self.versions: dict[str, dict[str, int]] = {CHARACTERS: {}, LOCATIONS: {}, RELATIONS: {}}
+        self._saves = 0
+        self._lock = threading.Lock()
+        self.save_characters(list(characters))
+        self.save_locations(list(locations))
+        self.save_relations(list(relations))
+
+    @classmethod
+    def from_backend(cls, source: StorageBackend) -> "MemoryBackend":
+        """Point-in-time copy of everything in `source`"""
+        return cls(source.get_characters(), source.get_locations(), source.get_relations())
+
+    def get_characters(self, id_in=None, name_in=None) -> list[Character]:
+        if id_in is not None:
+            characters = [self.characters[id] for id in dict.fromkeys(id_in) if id in self.characters]
+        else:
+            characters = list(self.characters.values())
+        return _filter_by_name(characters, name_in)
+
+    def get_character(self, id: str) -> Character | None:
+        return self.characters.get(id)
+
+    def _bump_versions(self, table: str, keys: list[str], expected_versions: dict[str, int] | None) -> None:
+        versions = self.versions[table]
+        check_versions(table, {key: versions.get(key, 0) for key in keys}, expected_versions)
+        for key in dict.fromkeys(keys):
+            versions[key] = versions.get(key, 0) + 1
+        self._saves += 1
+
+    def save_characters(self, characters: list[Character], expected_versions=None) -> list[Character]:
+        with self._lock:
+            self._bump_versions(CHARACTERS, [c.id for c in characters], expected_versions)
+            self.characters.update((c.id, c) for c in characters)
+        return characters
+
+    def get_locations(self, id_in=None, name_in=None) -> list[Location]:
+        if id_in is not None:
+            locations = [self.locations[id] for id in dict.fromkeys(id_in) if id in self.locations]
+        else:
+            locations = list(self.locations.values())
+        return _filter_by_name(locations, name_in)
+
+    def get_location(self, id: str) -> Location | None:
+        return self.locations.get(id)
+
+    def save_locations(self, locations: list[Location], expected_versions=None) -> list[Location]:
+        with self._lock:
+            self._bump_versions(LOCATIONS, [l.id for l in locations], expected_versions)
+            self.locations.update((l.id, l) for l in locations)
+        return locations
+
+    def get_relations(self, x_node_id_eq=None, y_node_id_eq=None) -> list[Relation]:
+        if x_node_id_eq is not None:
+            relations = self.get_outgoing_relations([(node_type, x_node_id_eq) for node_type in NODE_TYPES])
+        elif y_node_id_eq is not None:
+            return self.get_incoming_relations([(node_type, y_node_id_eq) for node_type in NODE_TYPES])
+        else:
+            relations = list(self.relations.values())
+        if y_node_id_eq is not None:
+            relations = [r for r in relations if r.y_node_id == y_node_id_eq]
+        return relations
+
+    def _lookup(self, index: dict[NodeKey, set[str]], nodes: list[NodeKey]) -> list[Relation]:
+        return [self.relations[key] for node in dict.fromkeys(nodes) for key in index.get(node, ())]
+
+    def get_outgoing_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self._lookup(self._outgoing, nodes)
+
+    def get_incoming_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self._lookup(self._incoming, nodes)
+
+    def save_relations(self, relations: list[Relation], expected_versions=None) -> list[Relation]:
+        with self._lock:
+            self._bump_versions(RELATIONS, [relation_key(r) for r in relations], expected_versions)
+            for relation in relations:
+                key = relation_key(relation)
+                old = self.relations.get(key)
+                if old is not None:
+                    self._outgoing[(old.x_node_type, old.x_node_id)].discard(key)
+                    self._incoming[(old.y_node_type, old.y_node_id)].discard(key)
+                self.relations[key] = relation
+                self._outgoing[(relation.x_node_type, relation.x_node_id)].add(key)
+                self._incoming[(relation.y_node_type, relation.y_node_id)].add(key)
+        return relations
+
+    def get_versions(self, table: str, keys: list[str]) -> dict[str, int]:
+        versions = self.versions[table]
+        return {key: versions[key] for key in dict.fromkeys(keys) if key in versions}
+
+    def change_stamp(self) -> Hashable | None:
+        return self._saves
+
+    def record_stamps(self, table: str) -> dict[str, Hashable] | None:
+        with self._lock:
+            return dict(self.versions[table])
+
+    def same_world(self, other: "MemoryBackend") -> bool:
+        return (
+            self.characters == other.characters
+            and self.locations == other.locations
+            and self.relations == other.relations
+        )
+
+
+# -------------- PACKED FILE -----------------
+class PackedBackend(StorageBackend):
+    """Whole world in one packed data file plus offset index, read through `mmap` (see `PackedWorld`)"""
+
+    def __init__(self, pack_path: Path | str):
+        self.pack_path = Path(pack_path)
+        self.packed_world = PackedWorld(self.pack_path)
+
+    def close(self) -> None:
+        self.packed_world.close()
+
+    def get_characters(self, id_in=None, name_in=None) -> list[Character]:
+        if id_in is not None:
+            characters = self.packed_world.get_many(CHARACTERS, id_in)
+        else:
+            characters = self.packed_world.all(CHARACTERS)
+        return _filter_by_name(characters, name_in)
+
+    def get_character(self, id: str) -> Character | None:
+        character = self.packed_world.get(CHARACTERS, id)
+        if character is None:
+            logger.warning(f"character {id} not found in {self.pack_path}.")
+        return character
+
+    def save_characters(self, characters: list[Character], expected_versions=None) -> list[Character]:
+        return self.packed_world.save_many(CHARACTERS, characters, expected_versions)
+
+    def get_locations(self, id_in=None, name_in=None) -> list[Location]:
+        if id_in is not None:
+            locations = self.packed_world.get_many(LOCATIONS, id_in)
+        else:
+            locations = self.packed_world.all(LOCATIONS)
+        return _filter_by_name(locations, name_in)
+
+    def get_location(self, id: str) -> Location | None:
+        location = self.packed_world.get(LOCATIONS, id)
+        if location is None:
+            logger.warning(f"location {id} not found in {self.pack_path}.")
+        return location
+
+    def save_locations(self, locations: list[Location], expected_versions=None) -> list[Location]:
+        return self.packed_world.save_many(LOCATIONS, locations, expected_versions)
+
+    def get_relations(self, x_node_id_eq=None, y_node_id_eq=None) -> list[Relation]:
+        if x_node_id_eq is not None:
+            relations = self.packed_world.outgoing((node_type, x_node_id_eq) for node_type in NODE_TYPES)
+        else:
+            relations = self.packed_world.all(RELATIONS)
+        if y_node_id_eq is not None:
+            relations = [r for r in relations if r.y_node_id == y_node_id_eq]
+        return relations
+
+    def get_outgoing_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self.packed_world.outgoing(nodes)
+
+    def get_incoming_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self.packed_world.incoming(nodes)
+
+    def save_relations(self, relations: list[Relation], expected_versions=None) -> list[Relation]:
+        return self.packed_world.save_many(RELATIONS, relations, expected_versions)
+
+    def get_versions(self, table: str, keys: list[str]) -> dict[str, int]:
+        return self.packed_world.versions(table, keys)
+
+    def iter_raw(self, table: str, keys: Iterable[str] | None = None) -> Iterator[dict]:
+        return self.packed_world.iter_raw(table, keys)
+
+    def record_stamps(self, table: str) -> dict[str, Hashable] | None:
+        return self.packed_world.record_stamps(table)
+
+    def sidecar_path(self, filename: str) -> Path | None:
+        return self.pack_path.with_name(f"{self.pack_path.name}.{filename}")
+
+    def change_stamp(self) -> Hashable | None:
+        # a pack has a single writer, so only this process's saves move it
+        return self.packed_world.change_stamp()
+
+
+# -------------- SQLITE -----------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS ix_characters_name ON characters (name);
+
+CREATE TABLE IF NOT EXISTS locations (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS ix_locations_name ON locations (name);
+
+-- one relation per (x, y) pair, same as the `x--y.json` file naming
+-- the primary key doubles as the x_node_id index
+CREATE TABLE IF NOT EXISTS relations (
+    x_node_id TEXT NOT NULL,
+    x_node_type TEXT NOT NULL,
+    y_node_id TEXT NOT NULL,
+    y_node_type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    importance INTEGER,
+    version INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (x_node_id, y_node_id)
+);
+CREATE INDEX IF NOT EXISTS ix_relations_y_node_id ON relations (y_node_id);
+"""
+
+# list filters are bound as one JSON array parameter, so there is no limit
+# on the number of ids and SQLite still probes the index for each value
+_IN_JSON_LIST = "IN (SELECT value FROM json_each(?))"
+
+
+class SqliteBackend(StorageBackend):
+    """World stored in a single SQLite database with indexed lookups and transactional batch upserts"""
+
+    def __init__(self, db_path: Path | str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SQLITE_SCHEMA)
+            for table in (CHARACTERS, LOCATIONS, RELATIONS):
+                columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                if "version" not in columns:
+                    # databases created before entities were versioned
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _select(self, sql: str, params: Iterable = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def _stored_versions(self, table: str, keys: list[str]) -> dict[str, int]:
+        if table == RELATIONS:
+            rows = self._conn.execute(
+                """SELECT x_node_id || '--' || y_node_id AS key, version FROM relations
+                JOIN json_each(?) ON x_node_id = json_extract(value, '$[0]') AND y_node_id = json_extract(value, '$[1]')""",
+                (json.dumps([key.split("--", 1) for key in keys]),),
+            )
+        else:
+            rows = self._conn.execute(f"SELECT id AS key, version FROM {table} WHERE id {_IN_JSON_LIST}", (json.dumps(keys),))
+        return {row["key"]: row["version"] for row in rows}
+
+    def _upsert(self, table: str, keys: list[str], expected_versions: dict[str, int] | None, sql: str, rows: list[tuple]) -> None:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so no other connection
+            # can change the checked versions before the batch is written
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if expected_versions:
+                    stored = self._stored_versions(table, keys)
+                    check_versions(table, {key: stored.get(key, 0) for key in keys}, expected_versions)
+                self._conn.executemany(sql, rows)
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+
+    def get_versions(self, table: str, keys: list[str]) -> dict[str, int]:
+        with self._lock:
+            return self._stored_versions(table, list(dict.fromkeys(keys)))
+
+    def _get_named(self, table: str, model: type, id_in, name_in) -> list:
+        clauses: list[str] = []
+        params: list[str] = []
+        if id_in is not None:
+            clauses.append(f"id {_IN_JSON_LIST}")
+            params.append(json.dumps(list(id_in)))
+        if name_in is not None:
+            clauses.append(f"name {_IN_JSON_LIST}")
+            params.append(json.dumps(list(name_in)))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._select(f"SELECT id, name, description FROM {table}{where}", params)
+        return [model(**row) for row in rows]
+
+    def _get_one_named(self, table: str, model: type, id: str):
+        rows = self._select(f"SELECT id, name, description FROM {table} WHERE id = ?", (id,))
+        if not rows:
+            logger.warning(f"{table[:-1]} {id} not found in {self.db_path}.")
+            return None
+        return model(**rows[0])
+
+    def _save_named(self, table: str, entities: list, expected_versions: dict[str, int] | None) -> list:
+        # the last entity wins when a batch saves the same id twice
+        batch = {e.id: e for e in entities}
+        self._upsert(
+            table,
+            list(batch),
+            expected_versions,
+            f"""INSERT INTO {table} (id, name, description) VALUES (?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name,
+                description = excluded.description,
+                version = version + 1""",
+            [(e.id, e.name, e.description) for e in batch.values()],
+        )
+        return entities
+
+    def get_characters(self, id_in=None, name_in=None) -> list[Character]:
+        return self._get_named("characters", Character, id_in, name_in)
+
+    def get_character(self, id: str) -> Character | None:
+        return self._get_one_named("characters", Character, id)
+
+    def save_characters(self, characters: list[Character], expected_versions=None) -> list[Character]:
+        return self._save_named("characters", characters, expected_versions)
+
+    def get_locations(self, id_in=None, name_in=None) -> list[Location]:
+        return self._get_named("locations", Location, id_in, name_in)
+
+    def get_location(self, id: str) -> Location | None:
+        return self._get_one_named("locations", Location, id)
+
+    def save_locations(self, locations: list[Location], expected_versions=None) -> list[Location]:
+        return self._save_named("locations", locations, expected_versions)
+
+    _RELATION_COLUMNS = "x_node_id, x_node_type, y_node_id, y_node_type, description, importance"
+
+    def get_relations(self, x_node_id_eq=None, y_node_id_eq=None) -> list[Relation]:
+        clauses: list[str] = []
+        params: list[str] = []
+        if x_node_id_eq is not None:
+            clauses.append("x_node_id = ?")
+            params.append(x_node_id_eq)
+        if y_node_id_eq is not None:
+            clauses.append("y_node_id = ?")
+            params.append(y_node_id_eq)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._select(f"SELECT {self._RELATION_COLUMNS} FROM relations{where}", params)
+        return [Relation(**row) for row in rows]
+
+    def _get_adjacent_relations(self, side: str, nodes: list[NodeKey]) -> list[Relation]:
+        node_set = set(nodes)
+        rows = self._select(
+            f"SELECT {self._RELATION_COLUMNS} FROM relations WHERE {side}_node_id {_IN_JSON_LIST}",
+            (json.dumps(list({node_id for (_, node_id) in node_set})),),
+        )
+        return [
+            Relation(**row) for row in rows
+            if (row[f"{side}_node_type"], row[f"{side}_node_id"]) in node_set
+        ]
+
+    def get_outgoing_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self._get_adjacent_relations("x", nodes)
+
+    def get_incoming_relations(self, nodes: list[NodeKey]) -> list[Relation]:
+        return self._get_adjacent_relations("y", nodes)
+
+    def save_relations(self, relations: list[Relation], expected_versions=None) -> list[Relation]:
+        batch = {relation_key(r): r for r in relations}
+        self._upsert(
+            RELATIONS,
+            list(batch),
+            expected_versions,
+            f"""INSERT INTO relations ({self._RELATION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (x_node_id, y_node_id) DO UPDATE SET
+                x_node_type = excluded.x_node_type,
+                y_node_type = excluded.y_node_type,
+                description = excluded.description,
+                importance = excluded.importance,
+                version = version + 1""",
+            [
+                (r.x_node_id, r.x_node_type, r.y_node_id, r.y_node_type, r.description, r.importance)
+                for r in batch.values()
+            ],
+        )
+        return relations
+
+    def iter_raw(self, table: str, keys: Iterable[str] | None = None) -> Iterator[dict]:
+        columns = self._RELATION_COLUMNS if table == RELATIONS else "id, name, description"
+        if keys is None:
+            rows = self._select(f"SELECT {columns} FROM {table}")
+        elif table == RELATIONS:
+            rows = self._select(
+                f"""SELECT {columns} FROM relations
+                JOIN json_each(?) ON x_node_id = json_extract(value, '$[0]') AND y_node_id = json_extract(value, '$[1]')""",
+                (json.dumps([key.split("--", 1) for key in dict.fromkeys(keys)]),),
+            )
+        else:
+            rows = self._select(f"SELECT {columns} FROM {table} WHERE id {_IN_JSON_LIST}", (json.dumps(list(keys)),))
+        for row in rows:
+            yield dict(row)
+
+    def record_stamps(self, table: str) -> dict[str, Hashable] | None:
+        key = "x_node_id || '--' || y_node_id" if table == RELATIONS else "id"
+        return {row["key"]: row["version"] for row in self._select(f"SELECT {key} AS key, version FROM {table}")}
+
+    def change_stamp(self) -> Hashable | None:
+        # data_version moves with commits by other connections, total_changes with this one's
+        with self._lock:
+            (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+            return (data_version, self._conn.total_changes)
+
+    def sidecar_path(self, filename: str) -> Path | None:
+        if self.db_path == ":memory:":
+            return None
+        db_path = Path(self.db_path)
+        return db_path.with_name(f"{db_path.name}.{filename}")
+
+
+# -------------- MIGRATION -----------------
+def migrate_json_to_sqlite(data_dir: Path, db_path: Path | str) -> SqliteBackend:
+    """One-shot copy of a JSON directory world into a SQLite database (existing rows are upserted)"""
+    source = JsonDirectoryBackend(data_dir)
+    target = SqliteBackend(db_path)
+    characters = source.get_characters()
+    locations = source.get_locations()
+    relations = source.get_relations()
+    target.save_characters(characters)
+    target.save_locations(locations)
+    target.save_relations(relations)
+    logger.info(
+        f"Migrated {len(characters)} characters, {len(locations)} locations and "
+        f"{len(relations)} relations from {data_dir} to {db_path}"
+    )
+    return target
+
+
+def shard_json_world(data_dir: Path, sharded: bool = True) -> JsonDirectoryBackend:
+    """
+    Move a JSON directory world into the sharded layout with manifests (or
+    back to flat directories). Nothing else may use the world meanwhile.
+    """
+    backend = JsonDirectoryBackend(data_dir)
+    (n_characters, n_locations, n_relations) = backend.world_store.set_layout(sharded)
+    logger.info(
+        f"Moved {n_characters} characters, {n_locations} locations and {n_relations} relations "
+        f"of {data_dir} into the {'sharded' if sharded else 'flat'} layout"
+    )
+    return backend
+
+
+def copy_world(source: StorageBackend, target: StorageBackend) -> tuple[int, int, int]:
+    """Upsert everything in `source` into `target`, returns the (characters, locations, relations) counts"""
+    characters = target.save_characters(source.get_characters())
+    locations = target.save_locations(source.get_locations())
+    relations = target.save_relations(source.get_relations())
+    return (len(characters), len(locations), len(relations))
+
+
+def export_json_to_packed(data_dir: Path, pack_path: Path | str) -> PackedBackend:
+    """Write the JSON directory world into a fresh packed file (replacing any existing one)"""
+    pack_path = Path(pack_path)
+    remove_pack(pack_path)
+    target = PackedBackend(pack_path)
+    (n_characters, n_locations, n_relations) = copy_world(JsonDirectoryBackend(data_dir), target)
+    logger.info(
+        f"Exported {n_characters} characters, {n_locations} locations and "
+        f"{n_relations} relations from {data_dir} to {pack_path}"
+    )
+    return target
+
+
+def import_packed_to_json(pack_path: Path | str, data_dir: Path) -> JsonDirectoryBackend:
+    """Write every entity of a packed file out as `data_dir` JSON files (existing files are overwritten)"""
+    source = PackedBackend(pack_path)
+    target = JsonDirectoryBackend(data_dir)
+    (n_characters, n_locations, n_relations) = copy_world(source, target)
+    source.close()
+    logger.info(
+        f"Imported {n_characters} characters, {n_locations} locations and "
+        f"{n_relations} relations from {pack_path} to {data_dir}"
+    )
+    return target
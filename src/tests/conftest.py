@@ -0,0 +1,15 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import datastore
+from storage import MemoryBackend
+
+
+@pytest.fixture
+def memory_world() -> MemoryBackend:
+    """An empty in-memory world as the datastore backend for the duration of a test"""
+    with datastore.using_backend(MemoryBackend()) as world:
+        yield world
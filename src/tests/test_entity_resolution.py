@@ -0,0 +1,64 @@
+from entity_resolution import EntityResolutionIndex, resolve_new_entities
+from schema import Character, CHARACTER_NODE
+
+DANNY = Character(
+    id="danny_gordon",
+    name="Danny Gordon",
+    description="The head bagel-crafting master at Bagel Diffusion, exploring innovative flavors.",
+)
+MIRA = Character(
+    id="mira_chen",
+    name="Mira Chen",
+    description="A data scientist at Bagel Diffusion who tunes the flavor models.",
+)
+
+
+def _index(*characters: Character) -> EntityResolutionIndex:
+    index = EntityResolutionIndex()
+    index.add(list(characters))
+    return index
+
+
+def test_same_name_with_title_resolves():
+    proposed = Character(id="dr_danny_gordon", name="Dr. Danny Gordon", description="Runs a bakery.")
+    assert _index(DANNY, MIRA).resolve(proposed) == "danny_gordon"
+
+
+def test_contained_name_with_overlapping_description_resolves():
+    proposed = Character(id="danny_r_gordon", name="Danny R. Gordon", description="The bagel-crafting master at Bagel Diffusion.")
+    assert _index(DANNY, MIRA).resolve(proposed) == "danny_gordon"
+
+
+def test_contained_name_without_description_support_stays_new():
+    proposed = Character(id="danny_r_gordon", name="Danny R. Gordon", description="A lighthouse keeper on a distant island.")
+    assert _index(DANNY, MIRA).resolve(proposed) is None
+
+
+def test_junior_is_not_merged_into_father():
+    proposed = Character(
+        id="danny_gordon_jr",
+        name="Danny Gordon Jr.",
+        description="The son of the head bagel-crafting master at Bagel Diffusion, learning to craft bagels.",
+    )
+    assert _index(DANNY, MIRA).resolve(proposed) is None
+
+
+def test_similar_name_with_overlapping_description_stays_new():
+    proposed = Character(
+        id="kira_chen",
+        name="Kira Chen",
+        description="A data scientist at Bagel Diffusion who trains the flavor models.",
+    )
+    assert _index(DANNY, MIRA).resolve(proposed) is None
+
+
+def test_batch_duplicates_resolve_onto_the_first(memory_world):
+    memory_world.save_characters([DANNY])
+    proposed = [
+        Character(id="kira_chen", name="Kira Chen", description="A courier."),
+        Character(id="kira_chen_2", name="Kira  Chen", description="A courier."),
+        Character(id="danny_gordon_jr", name="Danny Gordon Jr.", description="Danny Gordon's son."),
+    ]
+    (new_characters, resolved_ids) = resolve_new_entities(CHARACTER_NODE, proposed)
+    assert [c.id for c in new_characters] == ["kira_chen", "danny_gordon_jr"]
+    assert resolved_ids == {"kira_chen_2": "kira_chen"}
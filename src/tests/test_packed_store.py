@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+import packed_store
+from packed_store import CHARACTERS, PackedWorld, index_log_path, index_path
+from schema import Character, Relation, CHARACTER_NODE, LOCATION_NODE
+from storage import PackedBackend
+from world_store import VersionConflictError
+
+
+def _character(id: str, description: str = "A regular at the night market.") -> Character:
+    return Character(id=id, name=id.replace("_", " ").title(), description=description)
+
+def _relation(x: str, y: str, importance: int | None = 5) -> Relation:
+    return Relation(
+        x_node_id=x,
+        x_node_type=CHARACTER_NODE,
+        y_node_id=y,
+        y_node_type=LOCATION_NODE,
+        description=f"{x} haunts {y}",
+        importance=importance,
+    )
+
+@pytest.fixture
+def pack_path(tmp_path):
+    return tmp_path / "world.pack"
+
+def _reopen(backend: PackedBackend) -> PackedBackend:
+    backend.close()
+    return PackedBackend(backend.pack_path)
+
+
+def test_saves_survive_reopen(pack_path):
+    backend = PackedBackend(pack_path)
+    backend.save_characters([_character("ana_voss"), _character("bo_lind")])
+    backend.save_characters([_character("ana_voss", "Now runs the noodle stall.")])
+    backend.save_relations([_relation("ana_voss", "the_pier")])
+
+    backend = _reopen(backend)
+    assert backend.get_character("ana_voss").description == "Now runs the noodle stall."
+    assert backend.get_versions(CHARACTERS, ["ana_voss", "bo_lind"]) == {"ana_voss": 2, "bo_lind": 1}
+    assert [r.x_node_id for r in backend.get_incoming_relations([(LOCATION_NODE, "the_pier")])] == ["ana_voss"]
+    backend.close()
+
+
+def test_key_saved_twice_in_a_batch_is_stored_once(pack_path):
+    backend = PackedBackend(pack_path)
+    backend.save_characters([_character("ana_voss", "first"), _character("ana_voss", "second")])
+    backend = _reopen(backend)
+    assert backend.get_versions(CHARACTERS, ["ana_voss"]) == {"ana_voss": 1}
+    assert backend.get_character("ana_voss").description == "second"
+    backend.close()
+
+
+def test_version_conflict_leaves_the_pack_untouched(pack_path):
+    backend = PackedBackend(pack_path)
+    backend.save_characters([_character("ana_voss")])
+    size = os.path.getsize(pack_path)
+    with pytest.raises(VersionConflictError):
+        backend.save_characters([_character("ana_voss", "stale")], expected_versions={"ana_voss": 0})
+    assert os.path.getsize(pack_path) == size
+    assert backend.get_character("ana_voss").description == "A regular at the night market."
+    backend.close()
+
+
+def test_torn_index_log_drops_the_incomplete_save(pack_path):
+    backend = PackedBackend(pack_path)
+    backend.save_characters([_character("ana_voss")])
+    backend.save_characters([_character("bo_lind")])
+    backend.close()
+    log_path = index_log_path(pack_path, 1)
+    log = log_path.read_bytes()
+    first_line = log.index(b"\n") + 1
+    # the writer died halfway through logging the second save
+    log_path.write_bytes(log[:first_line + 10])
+
+    backend = PackedBackend(pack_path)
+    assert backend.get_characters(id_in=["ana_voss", "bo_lind"]) == [_character("ana_voss")]
+    assert log_path.read_bytes() == log[:first_line]
+    # the unindexed record of the lost save was cut off the data file
+    assert os.path.getsize(pack_path) == backend.packed_world.change_stamp()[1]
+
+    backend.save_characters([_character("bo_lind")])
+    backend = _reopen(backend)
+    assert {c.id for c in backend.get_characters()} == {"ana_voss", "bo_lind"}
+    backend.close()
+
+
+def test_unindexed_records_are_truncated_on_open(pack_path):
+    backend = PackedBackend(pack_path)
+    backend.save_characters([_character("ana_voss")])
+    backend.close()
+    size = os.path.getsize(pack_path)
+    with open(pack_path, "ab") as f:
+        f.write(b'{"id": "half_written"')
+
+    backend = PackedBackend(pack_path)
+    assert os.path.getsize(pack_path) == size
+    assert [c.id for c in backend.get_characters()] == ["ana_voss"]
+    backend.close()
+
+
+def test_compaction_folds_the_log_into_a_new_generation(pack_path):
+    world = PackedWorld(pack_path)
+    for n in range(3):
+        world.save_many(CHARACTERS, [_character("ana_voss", f"take {n}")])
+    (generation, size) = world.change_stamp()
+    world.compact()
+    assert not index_log_path(pack_path, generation).exists()
+    assert world.change_stamp()[0] == generation + 1
+    assert world.change_stamp()[1] < size
+    world.close()
+
+    world = PackedWorld(pack_path)
+    assert world.get(CHARACTERS, "ana_voss").description == "take 2"
+    assert world.versions(CHARACTERS, ["ana_voss"]) == {"ana_voss": 3}
+    world.close()
+
+
+def test_oversized_log_is_folded_into_the_index(pack_path, monkeypatch):
+    monkeypatch.setattr(packed_store, "MIN_INDEX_LOG_BYTES", 0)
+    world = PackedWorld(pack_path)
+    world.save_many(CHARACTERS, [_character("ana_voss")])
+    world.save_many(CHARACTERS, [_character("bo_lind")])
+    # every save outgrows the (tiny) index and is folded straight into it
+    assert not any(pack_path.parent.glob(f"{index_path(pack_path).name}.*.log"))
+    world.close()
+
+    world = PackedWorld(pack_path)
+    assert {c.id for c in world.all(CHARACTERS)} == {"ana_voss", "bo_lind"}
+    world.close()
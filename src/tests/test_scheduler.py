@@ -0,0 +1,41 @@
+from scheduler import CharacterScheduler, FenwickTree
+
+
+class MaxRandom:
+    """A draw landing on the total weight, as float drift in the tree's sums can make it"""
+
+    def random(self) -> float:
+        return 1.0
+
+
+def test_find_matches_prefix_sums():
+    tree = FenwickTree([1.0, 0.0, 2.0, 3.0])
+    assert [tree.find(target) for target in (0.0, 0.5, 1.0, 2.9, 3.0, 5.9)] == [0, 0, 2, 2, 3, 3]
+
+
+def test_find_at_total_skips_trailing_zero_weights():
+    tree = FenwickTree([1.0, 2.0, 0.0, 0.0])
+    assert tree.find(tree.total()) == 1
+    tree.set(1, 0.0)
+    assert tree.find(tree.total()) == 0
+
+
+def test_find_after_append_and_set():
+    tree = FenwickTree()
+    for weight in (1.0, 1.0, 1.0):
+        tree.append(weight)
+    tree.set(2, 0.0)
+    assert tree.total() == 2.0
+    assert tree.find(2.0) == 1
+
+
+def test_draw_reaching_total_weight_never_picks_a_drawn_character():
+    scheduler = CharacterScheduler(["a", "b", "c", "d"])
+    picked = scheduler.next_round(4, rng=MaxRandom())
+    assert sorted(picked) == ["a", "b", "c", "d"]
+
+
+def test_negative_importances_keep_weights_positive():
+    scheduler = CharacterScheduler(["a", "b"], {"a": -12.7})
+    assert scheduler.weight("a") == 1.0
+    assert len(scheduler.next_round(2)) == 2
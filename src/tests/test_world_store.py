@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from schema import Character
+from world_store import WorldStore
+
+
+def _character(id: str, description: str = "Sells lanterns by the harbor.") -> Character:
+    return Character(id=id, name=id.replace("_", " ").title(), description=description)
+
+@pytest.fixture(params=[False, True], ids=["flat", "sharded"])
+def sharded(request) -> bool:
+    return request.param
+
+
+def test_leftover_temp_file_of_a_torn_write_is_ignored(tmp_path, sharded):
+    table = WorldStore(tmp_path, sharded=sharded).characters
+    table.save(_character("ana_voss"))
+    # a writer died while writing the replacement, before renaming it into place
+    filepath = table.filepath("ana_voss")
+    filepath.with_name(f".{filepath.name}.1234.1.tmp").write_text('{"id": "ana_voss", "name": "An')
+
+    table = WorldStore(tmp_path).characters
+    assert [c.id for c in table.all()] == ["ana_voss"]
+    assert table.get("ana_voss").description == "Sells lanterns by the harbor."
+    assert table.versions(["ana_voss"]) == {"ana_voss": 1}
+
+
+def test_recover_finishes_a_partially_applied_batch(tmp_path, sharded):
+    table = WorldStore(tmp_path, sharded=sharded).characters
+    table.save_many([_character("ana_voss"), _character("bo_lind")])
+    records = [
+        ("ana_voss", 2, _character("ana_voss", "Moved to the night market.")),
+        ("bo_lind", 2, _character("bo_lind", "Retired.")),
+        ("cy_moro", 1, _character("cy_moro")),
+    ]
+    wal_path = table._write_ahead(records)
+    # the writer died after the first file of the batch
+    (id, version, entity) = records[0]
+    table._write_file(id, entity, version)
+
+    store = WorldStore(tmp_path)
+    table = store.characters
+    assert not wal_path.exists()
+    assert table.versions(["ana_voss", "bo_lind", "cy_moro"]) == {"ana_voss": 2, "bo_lind": 2, "cy_moro": 1}
+    assert table.get("bo_lind").description == "Retired."
+    assert {c.id for c in table.all()} == {"ana_voss", "bo_lind", "cy_moro"}
+    if sharded:
+        assert set(table.manifest.read()) == {"ana_voss", "bo_lind", "cy_moro"}
+
+
+def test_recover_skips_entities_saved_again_since(tmp_path, sharded):
+    table = WorldStore(tmp_path, sharded=sharded).characters
+    table.save(_character("ana_voss"))
+    wal_path = table._write_ahead([
+        ("ana_voss", 2, _character("ana_voss", "From the interrupted batch.")),
+        ("bo_lind", 1, _character("bo_lind")),
+    ])
+    table.save(_character("ana_voss", "Saved again since."))
+    table.save(_character("ana_voss", "Saved again since."))
+
+    table = WorldStore(tmp_path).characters
+    assert not wal_path.exists()
+    assert table.versions(["ana_voss", "bo_lind"]) == {"ana_voss": 3, "bo_lind": 1}
+    assert table.get("ana_voss").description == "Saved again since."
+
+
+def test_uncommitted_write_ahead_record_is_not_replayed(tmp_path, sharded):
+    table = WorldStore(tmp_path, sharded=sharded).characters
+    table.save(_character("ana_voss"))
+    # the writer died before its write-ahead record was renamed into place
+    table.wal_dir.mkdir(parents=True, exist_ok=True)
+    torn = table.wal_dir / f"{table.table}.0123.json.tmp"
+    torn.write_text(json.dumps([["ana_voss", 2, _character("ana_voss", "Never committed.").__dict__]]))
+
+    table = WorldStore(tmp_path).characters
+    assert table.get("ana_voss").description == "Sells lanterns by the harbor."
+    assert table.versions(["ana_voss"]) == {"ana_voss": 1}
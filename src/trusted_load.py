@@ -0,0 +1,58 @@
+import json
+import os
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, TypeVar
+
+from pydantic import BaseModel
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# stored records carry the crc32 of their compact JSON under this key (entity
+# files) or next to them (pack index)
+CHECKSUM_FIELD = "_checksum"
+
+# TRUSTED_LOAD=0 validates every stored record, checksummed or not
+_trusted_load = os.environ.get("TRUSTED_LOAD", "1") != "0"
+
+def trusted_load_enabled() -> bool:
+    return _trusted_load
+
+def set_trusted_load(enabled: bool) -> None:
+    global _trusted_load
+    _trusted_load = enabled
+
+@contextmanager
+def trusted_load(enabled: bool) -> Iterator[None]:
+    previous = _trusted_load
+    set_trusted_load(enabled)
+    try:
+        yield
+    finally:
+        set_trusted_load(previous)
+
+
+def encode_record(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def checksum(encoded: bytes) -> int:
+    return zlib.crc32(encoded)
+
+def record_checksum(record: dict) -> int:
+    return checksum(encode_record(record))
+
+
+def load_model(model: type[ModelT], record: dict, stored_checksum: int | None, encoded: bytes | None = None) -> ModelT:
+    """
+    `model` built from a stored `record`.
+
+    Records this code wrote itself carry a checksum; when it still matches
+    (`encoded` is the record's compact JSON, if the caller has it at hand)
+    the model is built without validation. Anything else, such as hand-edited
+    files or records stored before checksums, goes through full validation.
+    Only for data read back from storage; LLM output is always validated.
+    """
+    if _trusted_load and stored_checksum is not None:
+        if stored_checksum == checksum(encoded if encoded is not None else encode_record(record)):
+            return model.construct(**record)
+    return model(**record)
@@ -1,22 +1,37 @@
-import json
 import random
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-import langchain
-import interlab
 from pydantic.dataclasses import dataclass
-from fastapi.encoders import jsonable_encoder
 
-from datastore import get_characters, get_character_orbit
-from logging_config import logger
-from logging_extras import log_the_world_so_far, format_character_list_for_logs
+import datastore
+from datastore import get_characters, get_character_orbits
+from instrumentation import instrumentation, metrics_path as default_metrics_path, span
+from journal import RoundJournal, default_journal_path
+from llm_cache import create_llm_actor
+from logging_config import entity_dumps_enabled, logger
+from logging_extras import (
+    format_character_list_for_logs,
+    log_world_progress,
+    DEFAULT_WORLD_CHECKPOINT_EVERY,
+)
+from models import get_model, GPT4_TURBO
+from orbit_renderer import render_character_orbit
+from scheduler import get_scheduler
 from schema import Character, CharacterOrbit
-from upkeep import check_for_new_elements, NewElementsAnalysis
-
-gpt35 = langchain.chat_models.ChatOpenAI(model_name='gpt-3.5-turbo-1106')
-gpt4turbo = langchain.chat_models.ChatOpenAI(model_name='gpt-4-1106-preview')
+from snapshots import RoundSnapshots, random_state, rollback
+from upkeep import check_for_new_elements, check_for_new_elements_batch, NewElementsAnalysis
 
 DEFAULT_NUM_ROUNDS = 5
 DEFAULT_NUM_CHARACTERS_ACTING_PER_ROUND = 3
+DEFAULT_ORBIT_DEPTH = 1
+# how many characters are developed (director + archivist calls) in parallel
+DEFAULT_MAX_CONCURRENCY = DEFAULT_NUM_CHARACTERS_ACTING_PER_ROUND
+# review all of a round's vignettes in one archivist pass instead of one per vignette
+DEFAULT_BATCH_UPKEEP = False
+# hard-link snapshot of what each round changed, for --resume and rollback (JSON directory worlds only);
+# opt-in, as it costs a few links per saved entity every round
+DEFAULT_SNAPSHOT_ROUNDS = False
 
 # (before round)
 # - load characters, locations, relations
@@ -44,8 +59,70 @@ class CharacterDevelopmentResult:
     vignette: str
     analysis: NewElementsAnalysis
 
+def direct_character(
+    character: Character,
+    character_orbit: CharacterOrbit,
+    setting_prompt: str = SETTING_PROMPT,
+) -> str:
+    """Ask the director for a new vignette about `character`"""
+    logger.info(f"### Zooming in on character: **{character.name}**")
+    if entity_dumps_enabled():
+        logger.debug("character_orbit\n%s", character_orbit)
+    
+    # refresh the director LLM to avoid confusion between characters
+    fearless_director = create_llm_actor(
+        name="FearlessDirector",
+        # model=get_model(GPT35),
+        model=get_model(GPT4_TURBO),
+        system_prompt=DIRECTOR_BASE_PROMPT,
+    )
+
+    fearless_director.observe(f"## Overall Setting\n{setting_prompt}")
+
+    # TODO: daily hooks could go here
+    # DAILY_INFO_HOOK = """
+    # ## DAY 12
+    # It is a typical tuesday. There is a chance of rain in the afternoon.
+    # """
+    # fearless_director.observe(DAILY_INFO_HOOK)
+
+    fearless_director.observe(
+        f"We turn our attention to the story of {character.name}"
+    )
+    fearless_director.observe(
+        f""" --- {character.name} ---
+{render_character_orbit(character_orbit)}"""
+    )
+    
+    with span("director.query"):
+        character_vignette = fearless_director.query("Write a very short plot synopsis of an interesting episode in which this character appears")
+    # character_vignette = fearless_director.query("Tell a story about what this character did today, where they went, who they met, etc.")
+    # character_vignette = fearless_director.query("Describe what this character did today, where they went, who they met, etc. Narrate 2-3 short vignettes at different times of day (e.g. morning, afternoon, evening, night).")
+
+    logger.info(f"#### Director generated new vignette for **{character.name}**!\n{character_vignette}")
+    return character_vignette
+
+def develop_character(
+    character: Character,
+    character_orbit: CharacterOrbit,
+    setting_prompt: str = SETTING_PROMPT,
+) -> CharacterDevelopmentResult:
+    character_vignette = direct_character(character, character_orbit, setting_prompt)
+    new_elements_analysis = check_for_new_elements(character_vignette)
+    return CharacterDevelopmentResult(
+        focus_character=character_orbit,
+        vignette=character_vignette,
+        analysis=new_elements_analysis,
+    )
+
 def play_round(
     num_characters: int = DEFAULT_NUM_CHARACTERS_ACTING_PER_ROUND,
+    orbit_depth: int = DEFAULT_ORBIT_DEPTH,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    batch_upkeep: bool = DEFAULT_BATCH_UPKEEP,
+    journal: RoundJournal | None = None,
+    round_n: int = 1,
+    setting_prompt: str = SETTING_PROMPT,
 ) -> list[CharacterDevelopmentResult]:
 
     # iterate through characters
@@ -56,72 +133,141 @@ def play_round(
     #   - ask LLM to narrate the interaction (what did the character do today)
 
     # v0.0 experiment: just load characters and ask what they did today
-    characters = get_characters()
-    character_vignettes: list[(Character, str)] = []
-
-    # for character in characters:
-    selected_characters = random.choices(
-        population=characters,
-        k=num_characters
-    )
+    # distinct characters, favouring well-connected ones not featured lately
+    with span("round.select_characters"):
+        selected_ids = get_scheduler().next_round(num_characters)
+        characters_by_id = {c.id: c for c in get_characters(id_in=selected_ids)}
+        selected_characters = [characters_by_id[id] for id in selected_ids if id in characters_by_id]
     logger.info(f"Today will focus on these characters:\n{format_character_list_for_logs(selected_characters)}")
 
 
-    character_developments: list[CharacterDevelopmentResult] = []
-
-    for character in selected_characters:
-        logger.info(f"### Zooming in on character: **{character.name}**")
-        character_orbit = get_character_orbit(character)
-        logger.debug("character_orbit")
-        logger.debug(character_orbit)
-        
-        # refresh the director LLM to avoid confusion between characters
-        fearless_director = interlab.actor.OneShotLLMActor(
-            name="FearlessDirector",
-            # model=gpt35,
-            model=gpt4turbo,
-            system_prompt=DIRECTOR_BASE_PROMPT,
+    with span("round.load_orbits"):
+        character_orbits = get_character_orbits(
+            [c.id for c in selected_characters],
+            depth=orbit_depth,
         )
 
-        fearless_director.observe(f"## Overall Setting\n{SETTING_PROMPT}")
-
-        # TODO: daily hooks could go here
-        # DAILY_INFO_HOOK = """
-        # ## DAY 12
-        # It is a typical tuesday. There is a chance of rain in the afternoon.
-        # """
-        # fearless_director.observe(DAILY_INFO_HOOK)
+    # director + archivist LLM calls are I/O bound, so characters are developed
+    # on a thread pool; max_concurrency=1 keeps the old one-by-one behaviour
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        if not batch_upkeep:
+            def develop_and_record(character: Character) -> CharacterDevelopmentResult:
+                development = develop_character(character, character_orbits[character.id], setting_prompt)
+                if journal is not None:
+                    with span("journal.append"):
+                        journal.append_development(round_n, development)
+                return development
+            return list(executor.map(develop_and_record, selected_characters))
+        character_vignettes: list[str] = list(executor.map(
+            lambda character: direct_character(character, character_orbits[character.id], setting_prompt),
+            selected_characters,
+        ))
 
-        fearless_director.observe(
-            f"We turn our attention to the story of {character.name}"
-        )
-        fearless_director.observe(
-            f""" --- {character.name} ---
-            {character_orbit}"""
-        )
-        
-        character_vignette = fearless_director.query("Write a very short plot synopsis of an interesting episode in which this character appears")
-        # character_vignette = fearless_director.query("Tell a story about what this character did today, where they went, who they met, etc.")
-        # character_vignette = fearless_director.query("Describe what this character did today, where they went, who they met, etc. Narrate 2-3 short vignettes at different times of day (e.g. morning, afternoon, evening, night).")
-
-        logger.info(f"#### Director generated new vignette!\n{character_vignette}")
-        character_vignettes.append((character, character_vignette))
-        new_elements_analysis = check_for_new_elements(character_vignette)
-        character_developments.append(CharacterDevelopmentResult(
-            focus_character=character_orbit,
+    # one archivist pass (and one save) for the whole round; every
+    # development shares the merged analysis
+    with span("archivist.batch_upkeep"):
+        round_analysis = check_for_new_elements_batch(character_vignettes)
+    character_developments = [
+        CharacterDevelopmentResult(
+            focus_character=character_orbits[character.id],
             vignette=character_vignette,
-            analysis=new_elements_analysis,
-        ))
-    
-    # TBD move analysis and/or saving to after all vignettes have been created?
+            analysis=round_analysis,
+        )
+        for (character, character_vignette) in zip(selected_characters, character_vignettes)
+    ]
+    if journal is not None:
+        with span("journal.append"):
+            for development in character_developments:
+                journal.append_development(round_n, development)
     return character_developments
 
 def play_rounds(
     num_rounds: int = DEFAULT_NUM_ROUNDS,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    batch_upkeep: bool = DEFAULT_BATCH_UPKEEP,
+    seed: int | None = None,
+    world_checkpoint_every: int = DEFAULT_WORLD_CHECKPOINT_EVERY,
+    journal_path: Path | None = None,
+    setting_prompt: str = SETTING_PROMPT,
+    snapshot_rounds: bool = DEFAULT_SNAPSHOT_ROUNDS,
+    resume: bool = False,
+    metrics_path: Path | None = None,
 ):
-    for round_n in range(1, num_rounds + 1):
-        logger.info(f"## BEGINNING ROUND: {round_n}")
-        log_the_world_so_far()
-        character_developments = play_round()
-        # TODO: is there a better way of doing this than importing fastapi?
-        logger.info(f"### COMPLETED ROUND: {round_n}\nData results:\n```{json.dumps(jsonable_encoder(character_developments), indent=4)}```")
+    """
+    Play `num_rounds` rounds, recording them to a journal.
+
+    With `snapshot_rounds` the world is snapshotted at the end of every
+    round (see `snapshots.RoundSnapshots`). `resume` picks up the last
+    snapshotted run instead of starting a new one: the world and journal are
+    rolled back to its last completed round, and its journal, number of
+    rounds, random state and scheduler recency carry on from there.
+
+    After every round the process's metrics are written in the Prometheus
+    text format to `metrics_path` (default `instrumentation.metrics_path()`),
+    which the API's /metrics serves.
+    """
+    # NOTE: a fully reproducible (e.g. LLM_CACHE_MODE=replay) run also needs
+    # max_concurrency=1, otherwise archivist saves land in a varying order
+    snapshots = RoundSnapshots.for_backend(datastore.backend) if snapshot_rounds or resume else None
+    run_info = snapshots.run_info() if resume and snapshots is not None else None
+    first_round = 1
+    if run_info is not None:
+        manifest = rollback()
+        snapshots = RoundSnapshots.for_backend(datastore.backend)
+        journal_path = Path(run_info["journal"])
+        num_rounds = run_info["num_rounds"]
+        if manifest is not None:
+            first_round = manifest["round"] + 1
+            random.setstate(random_state(manifest["random_state"]))
+            get_scheduler().restore_recent_state(manifest.get("scheduler_recent", {}))
+        elif run_info["seed"] is not None:
+            random.seed(run_info["seed"])
+        logger.info(f"Resuming the run at round {first_round} of {num_rounds}")
+    else:
+        if resume:
+            logger.warning("No snapshotted run to resume, starting a new one.")
+        if seed is not None:
+            random.seed(seed)
+        journal_path = journal_path or default_journal_path()
+        if snapshots is not None:
+            snapshots.start_run({"journal": str(journal_path), "num_rounds": num_rounds, "seed": seed})
+    summary_path = journal_path.with_name(f"{journal_path.stem}.summary.json")
+    metrics_path = metrics_path or default_metrics_path()
+    logger.info(f"Recording character developments to journal: {journal_path}")
+    instrumentation.start_run()
+    if snapshots is not None:
+        snapshots.attach()
+    try:
+        with RoundJournal(journal_path) as journal:
+            for round_n in range(first_round, num_rounds + 1):
+                logger.info(f"## BEGINNING ROUND: {round_n}")
+                instrumentation.start_round(round_n)
+                if snapshots is not None:
+                    snapshots.start_round(round_n)
+                with span("round"):
+                    # full world dump every few rounds, only what changed in between
+                    with span("logging.world_progress"):
+                        log_world_progress(round_n, checkpoint_every=world_checkpoint_every)
+                    character_developments = play_round(
+                        max_concurrency=max_concurrency,
+                        batch_upkeep=batch_upkeep,
+                        journal=journal,
+                        round_n=round_n,
+                        setting_prompt=setting_prompt,
+                    )
+                if snapshots is not None:
+                    with span("snapshot.round"):
+                        snapshots.complete_round(round_n, {
+                            "journal_size": journal.size(),
+                            "random_state": random.getstate(),
+                            "scheduler_recent": get_scheduler().recent_state(),
+                        })
+                instrumentation.end_round()
+                logger.info(f"### COMPLETED ROUND: {round_n}\n{len(character_developments)} character developments recorded in `{journal_path}`")
+                # rewritten every round so an interrupted run still leaves its figures behind
+                instrumentation.write_run_summary(summary_path)
+                instrumentation.write_prometheus(metrics_path)
+    finally:
+        if snapshots is not None:
+            snapshots.detach()
+    logger.info(f"Run timings and LLM usage summary: {summary_path}")
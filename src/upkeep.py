@@ -1,5 +1,5 @@
-import langchain
-import interlab
+import threading
+
 from pydantic.dataclasses import dataclass, Field
 
 from datastore import (
@@ -9,68 +9,94 @@ from datastore import (
     save_locations,
     get_relations,
     save_relations,
+    get_versions,
+    VersionConflictError,
 )
-from logging_config import logger
+from entity_resolution import get_resolution_index, resolve_new_entities
+from instrumentation import span
+from llm_cache import create_llm_actor
+from logging_config import entity_dumps_enabled, logger
 from logging_extras import (
     format_character_list_for_logs,
     format_location_list_for_logs,
     format_relation_list_for_logs,
 )
-from schema import Character, Location, Relation, CHARACTER_NODE_TYPE, LOCATION_NODE_TYPE
+from models import get_model, GPT35, GPT4_TURBO
+from packed_store import CHARACTERS, LOCATIONS
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
 from util import str_to_safe_id
+from world_index import get_mentioned_world
+from world_store import relation_key
+
+# serializes datastore writes of concurrently developed vignettes
+_save_lock = threading.Lock()
 
-gpt35 = langchain.chat_models.ChatOpenAI(model_name='gpt-3.5-turbo-1106')
-gpt4turbo = langchain.chat_models.ChatOpenAI(model_name='gpt-4-1106-preview')
+# table (CHARACTERS or LOCATIONS) -> id -> version the archivist read
+WorldVersions = dict[str, dict[str, int]]
+
+# show the archivist only the part of the world a vignette mentions
+PRUNE_ARCHIVIST_WORLD_CONTEXT = True
 
 ARCHIVIST_EDITOR_PROMPT = """You are an archivist trying to keep up a database directory of information about characters, locations, relations, etc. in a fictional world. Your job is to review new vignettes written by the creative director, log any new elements, and give feedback when new elements conflict with existing ones."""
 
-def normalize_character_ids(characters: list[Character]) -> (list[Character], dict[str, str]):
-    normalized_characters: list[Character] = []
-    adjusted_ids: dict[str, str] = {}
-    for character in characters:
-        expected_id = str_to_safe_id(character.name)
-        if character.id != expected_id:
-            logger.debug(f"LLM generated ID ({character.id}) does not match expected ID form ({expected_id}). Overwriting to expected.")
-            character.id = expected_id
-        normalized_characters.append(character)
-    return (normalized_characters, adjusted_ids)
+def _normalize_entity_ids(
+    node_type: str,
+    entities: list[Character] | list[Location],
+) -> (list[Character] | list[Location], dict[str, str]):
+    """
+    Rewrite LLM ids to `str_to_safe_id(name)` and resolve near-duplicates.
 
-def normalize_location_ids(locations: list[Location]) -> (list[Location], dict[str, str]):
-    normalized_locations: list[location] = []
+    Entities matching an existing (or earlier, same-batch) entity are dropped;
+    `adjusted_ids` maps every rewritten LLM id onto its final canonical id so
+    relations can be rewritten to match.
+    """
     adjusted_ids: dict[str, str] = {}
-    for location in locations:
+    for entity in entities:
         # quick ID formatting check
-        expected_id = str_to_safe_id(location.name)
-        if location.id != expected_id:
-            logger.debug(f"LLM generated ID ({location.id}) does not match expected ID form ({expected_id}). Overwriting to expected.")
-            location.id = expected_id
-        normalized_locations.append(location)
-    return (normalized_locations, adjusted_ids)
+        expected_id = str_to_safe_id(entity.name)
+        if entity.id != expected_id:
+            logger.debug("LLM generated ID (%s) does not match expected ID form (%s). Overwriting to expected.", entity.id, expected_id)
+            adjusted_ids[entity.id] = expected_id
+            entity.id = expected_id
+
+    (new_entities, resolved_ids) = resolve_new_entities(node_type, entities)
+    for (llm_id, expected_id) in adjusted_ids.items():
+        adjusted_ids[llm_id] = resolved_ids.get(expected_id, expected_id)
+    adjusted_ids.update(resolved_ids)
+    if resolved_ids:
+        logger.info(f"Resolved proposed {node_type}s onto existing ones: {resolved_ids}")
+    return (new_entities, adjusted_ids)
+
+def normalize_character_ids(characters: list[Character]) -> (list[Character], dict[str, str]):
+    return _normalize_entity_ids(CHARACTER_NODE, characters)
+
+def normalize_location_ids(locations: list[Location]) -> (list[Location], dict[str, str]):
+    return _normalize_entity_ids(LOCATION_NODE, locations)
 
 def normalize_relation_ids(
     relations: list[Relation],
     adjusted_character_ids: dict[str, str],
     adjusted_location_ids: dict[str, str],
 ) -> list[Relation]:
-    normalized_relations: list[relation] = []
+    normalized_relations: list[Relation] = []
     for relation in relations:
         # quick ID formatting check
         x_node_id_adjustment = None
-        if relation.x_node_type == CHARACTER_NODE_TYPE:
+        if relation.x_node_type == CHARACTER_NODE:
             x_node_id_adjustment = adjusted_character_ids.get(relation.x_node_id, None)
-        elif relation.x_node_type == LOCATION_NODE_TYPE:
+        elif relation.x_node_type == LOCATION_NODE:
             x_node_id_adjustment = adjusted_location_ids.get(relation.x_node_id, None)
         if x_node_id_adjustment is not None:
-            logger.debug(f"Overwriting adjusted relation x_node_id from ({relation.x_node_id}) to ({x_node_id_adjustment}) to match previous adjustment.")
+            logger.debug("Overwriting adjusted relation x_node_id from (%s) to (%s) to match previous adjustment.", relation.x_node_id, x_node_id_adjustment)
             relation.x_node_id = x_node_id_adjustment
         
         y_node_id_adjustment = None
-        if relation.y_node_type == CHARACTER_NODE_TYPE:
+        if relation.y_node_type == CHARACTER_NODE:
             y_node_id_adjustment = adjusted_character_ids.get(relation.y_node_id, None)
-        elif relation.y_node_type == LOCATION_NODE_TYPE:
+        elif relation.y_node_type == LOCATION_NODE:
             y_node_id_adjustment = adjusted_location_ids.get(relation.y_node_id, None)
         if y_node_id_adjustment is not None:
-            logger.debug(f"Overwriting adjusted relation y_node_id from ({relation.y_node_id}) to ({y_node_id_adjustment}) to match previous adjustment.")
+            logger.debug("Overwriting adjusted relation y_node_id from (%s) to (%s) to match previous adjustment.", relation.y_node_id, y_node_id_adjustment)
             relation.y_node_id = y_node_id_adjustment
         
         normalized_relations.append(relation)
@@ -97,23 +123,43 @@ class NewElementsAnalysis:
         description="List of any relations appearing in the NEW_STORY_VIGNETTE (above) that are already recorded in the EXISTING_RELATION_LIST (above)"
     )
 
-def check_for_new_elements(
-    # actor: interlab.actor.ActorBase,
-    vignette: str,
-) -> NewElementsAnalysis:
-    logger.info("### Checking story vignette for new world elements...")
+NEW_ELEMENTS_QUERY = "Did any new characters, locations, or relations that are not catalogued in the directory yet appear in the latest vignette? If so please format what we know about them for the directory. If the character does not have a full name, please create one for them, using a similar style to existing names."
+BATCH_NEW_ELEMENTS_QUERY = "Did any new characters, locations, or relations that are not catalogued in the directory yet appear in any of the latest vignettes? If so please format what we know about them for the directory, listing each new element only once even if several vignettes mention it. If the character does not have a full name, please create one for them, using a similar style to existing names."
+
+def _load_world_context(
+    vignettes: list[str],
+    prune_world_context: bool,
+) -> tuple[list[Character], list[Location], list[Relation]]:
+    if prune_world_context:
+        # only what the vignettes mention (plus their relations) instead of the whole world
+        return get_mentioned_world("\n\n".join(vignettes))
+    return (get_characters(), get_locations(), get_relations())
+
+def _read_versions(characters: list[Character], locations: list[Location]) -> WorldVersions:
+    return {
+        CHARACTERS: get_versions(CHARACTERS, [c.id for c in characters]),
+        LOCATIONS: get_versions(LOCATIONS, [l.id for l in locations]),
+    }
 
+def _query_archivist(
+    vignettes: list[str],
+    prune_world_context: bool,
+) -> tuple[NewElementsAnalysis, WorldVersions]:
+    """Ask one archivist about `vignettes`; also returns the versions of the entities it was shown"""
     # TODO stronger input type, e.g. Event? Vignette?
-    archivist_editor = interlab.actor.OneShotLLMActor(
+    archivist_editor = create_llm_actor(
         name="ArchivistEditor",
-        # model=gpt35,
-        model=gpt4turbo,
+        # model=get_model(GPT35),
+        model=get_model(GPT4_TURBO),
         system_prompt=ARCHIVIST_EDITOR_PROMPT,
     )
 
-    existing_characters = get_characters()
-    existing_locations = get_locations()
-    existing_relations = get_relations()
+    with span("archivist.load_world_context"):
+        # the versions are read between two loads, so none is newer than what the
+        # archivist is shown: a write landing in between makes the save conflict
+        # instead of being overwritten
+        read_versions = _read_versions(*_load_world_context(vignettes, prune_world_context)[:2])
+        (existing_characters, existing_locations, existing_relations) = _load_world_context(vignettes, prune_world_context)
 
 # The following is a list of characters we have recorded in the official database so far:
     archivist_editor.observe(f"""
@@ -129,53 +175,224 @@ def check_for_new_elements(
 {existing_relations}
 """)
     
-    archivist_editor.observe(f"""## NEW_STORY_VIGNETTE
+    if len(vignettes) == 1:
+        archivist_editor.observe(f"""## NEW_STORY_VIGNETTE
+    {vignettes[0]}
+""")
+        query = NEW_ELEMENTS_QUERY
+    else:
+        for (vignette_n, vignette) in enumerate(vignettes, start=1):
+            archivist_editor.observe(f"""## NEW_STORY_VIGNETTE {vignette_n}
     {vignette}
 """)
-    new_elements_check_results = archivist_editor.query(
-        "Did any new characters, locations, or relations that are not catalogued in the directory yet appear in the latest vignette? If so please format what we know about them for the directory. If the character does not have a full name, please create one for them, using a similar style to existing names.",
-        expected_type=NewElementsAnalysis,
+        query = BATCH_NEW_ELEMENTS_QUERY
+    with span("archivist.query"):
+        new_elements_check_results = archivist_editor.query(
+            query,
+            expected_type=NewElementsAnalysis,
+        )
+
+    if entity_dumps_enabled():
+        logger.debug("new_elements_check_results\n%s", new_elements_check_results)
+    return (new_elements_check_results, read_versions)
+
+def check_for_new_elements(
+    # actor: interlab.actor.ActorBase,
+    vignette: str,
+    prune_world_context: bool = PRUNE_ARCHIVIST_WORLD_CONTEXT,
+) -> NewElementsAnalysis:
+    logger.info("### Checking story vignette for new world elements...")
+    (new_elements_check_results, read_versions) = _query_archivist(
+        [vignette],
+        prune_world_context=prune_world_context,
     )
+    return save_new_elements(new_elements_check_results, read_versions=read_versions)
 
-    logger.debug("new_elements_check_results")
-    logger.debug(new_elements_check_results)
 
-    adjusted_character_ids: dict[str, str] = []
-    adjusted_location_ids: dict[str, str] = []
+def _dedupe(items: list, key) -> list:
+    unique = {}
+    for item in items:
+        unique.setdefault(key(item), item)
+    return list(unique.values())
 
-    if len(new_elements_check_results.new_characters) == 0:
-        logger.info("No new characters detected.")
-    else:
-        new_characters = new_elements_check_results.new_characters
-        (new_characters, adjusted_character_ids) = normalize_character_ids(new_characters)
-        logger.info(f"New characters detected!\n{format_character_list_for_logs(new_characters)}")
-        save_characters(new_characters)    
-    
-    if len(new_elements_check_results.new_locations) == 0:
-        logger.info("No new locations detected.")
-    else:
-        new_locations = new_elements_check_results.new_locations
-        (new_locations, adjusted_location_ids) = normalize_location_ids(new_locations)
-        logger.info(f"New locations detected!\n{format_location_list_for_logs(new_locations)}")
-        # TODO/TBD: move saving to safer location?
-        save_locations(new_locations)
-        
-    if len(new_elements_check_results.new_relations) == 0:
-        logger.info("No new relations detected.")
-    else:
-        new_relations = new_elements_check_results.new_relations
-        new_relations = normalize_relation_ids(
-            relations=new_relations,
-            adjusted_character_ids=adjusted_character_ids,
-            adjusted_location_ids=adjusted_location_ids,
+def normalize_new_elements(analysis: NewElementsAnalysis) -> NewElementsAnalysis:
+    """
+    Rewrite an analysis onto canonical ids, once, right before it is saved.
+
+    New characters and locations get `str_to_safe_id(name)` ids and lose the
+    near-duplicates of existing (or earlier) ones, and relations follow the
+    adjusted ids. What still shares an id (or X->Y pair) is dropped, the
+    first proposal winning.
+    """
+    (new_characters, adjusted_character_ids) = normalize_character_ids(analysis.new_characters)
+    (new_locations, adjusted_location_ids) = normalize_location_ids(analysis.new_locations)
+    new_relations = normalize_relation_ids(
+        relations=analysis.new_relations,
+        adjusted_character_ids=adjusted_character_ids,
+        adjusted_location_ids=adjusted_location_ids,
+    )
+    relation_pair = lambda r: (r.x_node_id, r.y_node_id)
+    return NewElementsAnalysis(
+        features_existing_characters=_dedupe(analysis.features_existing_characters, key=lambda c: c.id),
+        new_characters=_dedupe(new_characters, key=lambda c: c.id),
+        new_locations=_dedupe(new_locations, key=lambda l: l.id),
+        features_existing_locations=_dedupe(analysis.features_existing_locations, key=lambda l: l.id),
+        new_relations=_dedupe(new_relations, key=relation_pair),
+        features_existing_relations=_dedupe(analysis.features_existing_relations, key=relation_pair),
+    )
+
+def merge_new_elements(analyses: list[NewElementsAnalysis]) -> NewElementsAnalysis:
+    """
+    Combine several archivist analyses into one. Duplicates across them are
+    left for `normalize_new_elements`, which resolves them when saving.
+    """
+    return NewElementsAnalysis(
+        features_existing_characters=[c for a in analyses for c in a.features_existing_characters],
+        new_characters=[c for a in analyses for c in a.new_characters],
+        new_locations=[l for a in analyses for l in a.new_locations],
+        features_existing_locations=[l for a in analyses for l in a.features_existing_locations],
+        new_relations=[r for a in analyses for r in a.new_relations],
+        features_existing_relations=[r for a in analyses for r in a.features_existing_relations],
+    )
+
+def check_for_new_elements_batch(
+    vignettes: list[str],
+    vignettes_per_query: int | None = None,
+    prune_world_context: bool = PRUNE_ARCHIVIST_WORLD_CONTEXT,
+) -> NewElementsAnalysis:
+    """
+    Round-level upkeep: review all of a round's vignettes together and save once.
+
+    By default every vignette goes to a single archivist query;
+    `vignettes_per_query` splits large rounds into several queries whose
+    results are merged and deduplicated before the one bulk save.
+    """
+    logger.info(f"### Checking {len(vignettes)} story vignettes for new world elements...")
+    chunk_size = vignettes_per_query or max(1, len(vignettes))
+    analyses: list[NewElementsAnalysis] = []
+    read_versions: WorldVersions = {CHARACTERS: {}, LOCATIONS: {}}
+    for chunk_start in range(0, len(vignettes), chunk_size):
+        (analysis, chunk_versions) = _query_archivist(
+            vignettes[chunk_start:chunk_start + chunk_size],
+            prune_world_context=prune_world_context,
+        )
+        analyses.append(analysis)
+        for (table, versions) in chunk_versions.items():
+            # the oldest read of an entity, so no query's view gets overwritten
+            for (key, version) in versions.items():
+                read_versions[table][key] = min(version, read_versions[table].get(key, version))
+
+    return save_new_elements(merge_new_elements(analyses), read_versions=read_versions)
+
+
+def _keep_existing_nodes(kind: str):
+    """
+    Conflict handler for new characters (or locations) another writer got to
+    first. The existing entity is kept; it is handed to the duplicate resolver,
+    which may not have seen it yet, so later proposals of it resolve onto it
+    instead of colliding again.
+    """
+    def keep_existing(entities: list, conflict: VersionConflictError) -> None:
+        for entity in entities:
+            (expected, _) = conflict.conflicts[entity.id]
+            cause = (
+                "it was left out of the archivist's pruned world context or created concurrently elsewhere"
+                if expected == 0 else "it was changed concurrently elsewhere after the archivist read it"
+            )
+            logger.info(
+                f"Keeping the existing {kind} {entity.id} over the archivist's proposal: {cause}. "
+                f"Proposed description: {entity.description!r}"
+            )
+        load_existing = get_characters if kind == CHARACTER_NODE else get_locations
+        get_resolution_index(kind).add(load_existing(id_in=[e.id for e in entities]))
+    return keep_existing
+
+def _keep_existing_relations(relations: list[Relation], conflict: VersionConflictError) -> None:
+    for relation in relations:
+        logger.info(
+            f"Keeping the existing relation {relation_key(relation)} over the archivist's proposal: it was "
+            f"left out of the archivist's pruned world context or saved concurrently elsewhere. "
+            f"Proposed description: {relation.description!r}"
         )
-        # TODO: do we need to double check that node IDs are real?
-        logger.info(f"New relations detected!\n{format_relation_list_for_logs(new_relations)}")
-        # TODO/TBD: move saving to safer location?
-        save_relations(new_relations)
+
+
+def _save_versioned(entities: list, key, save, read_versions: dict[str, int], on_conflict) -> list:
+    """
+    Save `entities` as a compare-and-swap against the versions the archivist read.
+
+    An entity it was shown must still be at the version it saw, any other must
+    not exist yet (version 0). Entities another writer (a concurrent vignette
+    or another process) created or changed in between are never overwritten:
+    they are handed to `on_conflict(entities, error)` and the rest is saved.
+    Returns what was saved.
+    """
+    while entities:
+        try:
+            return save(entities, expected_versions={key(e): read_versions.get(key(e), 0) for e in entities})
+        except VersionConflictError as e:
+            on_conflict([entity for entity in entities if key(entity) in e.conflicts], e)
+            entities = [entity for entity in entities if key(entity) not in e.conflicts]
+    return entities
+
+
+def save_new_elements(
+    analysis: NewElementsAnalysis,
+    read_versions: WorldVersions | None = None,
+) -> NewElementsAnalysis:
+    """
+    Normalize (`normalize_new_elements`) and persist the new elements of an
+    archivist analysis, returning the normalized analysis.
+
+    Saves are serialized across threads so concurrently developed vignettes
+    cannot interleave their writes (nor resolve duplicates against a world
+    the other is changing), and compare-and-swap against `read_versions`,
+    the versions of the characters and locations the archivist was shown:
+    those it proposes again are updated only if nobody changed them since,
+    and everything else (relations included) is only created, never
+    overwritten (see `_save_versioned`).
+    """
+    read_versions = read_versions or {}
+    # timed including the wait for the lock, so save contention shows up
+    with span("upkeep.save"), _save_lock:
+        analysis = normalize_new_elements(analysis)
+
+        if len(analysis.new_characters) == 0:
+            logger.info("No new characters detected.")
+        else:
+            new_characters = _save_versioned(
+                analysis.new_characters,
+                key=lambda c: c.id,
+                save=save_characters,
+                read_versions=read_versions.get(CHARACTERS, {}),
+                on_conflict=_keep_existing_nodes(CHARACTER_NODE),
+            )
+            logger.info(f"New characters detected!\n{format_character_list_for_logs(new_characters)}")
         
-    
-    return new_elements_check_results
+        if len(analysis.new_locations) == 0:
+            logger.info("No new locations detected.")
+        else:
+            new_locations = _save_versioned(
+                analysis.new_locations,
+                key=lambda l: l.id,
+                save=save_locations,
+                read_versions=read_versions.get(LOCATIONS, {}),
+                on_conflict=_keep_existing_nodes(LOCATION_NODE),
+            )
+            logger.info(f"New locations detected!\n{format_location_list_for_logs(new_locations)}")
+            
+        if len(analysis.new_relations) == 0:
+            logger.info("No new relations detected.")
+        else:
+            # TODO: do we need to double check that node IDs are real?
+            new_relations = _save_versioned(
+                analysis.new_relations,
+                key=relation_key,
+                save=save_relations,
+                read_versions={},
+                on_conflict=_keep_existing_relations,
+            )
+            logger.info(f"New relations detected!\n{format_relation_list_for_logs(new_relations)}")
+    return analysis
 
 
 # TODO: how to make a "does this all make sense/cohere" check?
\ No newline at end of file
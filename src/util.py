@@ -6,3 +6,14 @@ def str_to_safe_id(text: str) -> str:
     no_multi_underscore = re.sub(r'_+', "_", alphanumderscore_only)
     lowercased = no_multi_underscore.lower()
     return lowercased
+
+
+def str_to_tokens(text: str) -> list[str]:
+    """Split text into lowercase word tokens normalized like `str_to_safe_id` (possessive 's dropped)"""
+    without_possessives = re.sub(r"['’]s\b", "", text)
+    return [
+        token
+        for word in without_possessives.split()
+        for token in str_to_safe_id(word).split("_")
+        if token
+    ]
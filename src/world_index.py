@@ -0,0 +1,121 @@
+import threading
+from collections import defaultdict
+
+import datastore
+from logging_config import logger
+from schema import Character, Location, Relation, CHARACTER_NODE, LOCATION_NODE
+from util import str_to_tokens
+from world_store import NodeKey, relation_key
+
+# single-word aliases that would match far too many vignettes
+ALIAS_STOPWORDS = {
+    "the", "a", "an", "of", "and", "at", "in", "on", "for", "to", "by",
+    "dr", "mr", "mrs", "ms", "st", "co", "inc", "ltd",
+}
+MIN_SINGLE_TOKEN_ALIAS_LENGTH = 3
+
+
+def entity_aliases(node_type: str, name: str) -> set[tuple[str, ...]]:
+    """
+    Token sequences that count as a mention of an entity.
+
+    Every entity is matched by its full name (with or without a leading "the").
+    Characters are also matched by any single distinctive name token, so
+    "Amira" or "Kahina" alone find "Amira Kahina".
+    """
+    tokens = tuple(str_to_tokens(name))
+    if not tokens:
+        return set()
+    aliases = {tokens}
+    if tokens[0] == "the" and len(tokens) > 1:
+        aliases.add(tokens[1:])
+    if node_type == CHARACTER_NODE:
+        aliases.update(
+            (token,) for token in tokens
+            if token not in ALIAS_STOPWORDS and len(token) >= MIN_SINGLE_TOKEN_ALIAS_LENGTH
+        )
+    return aliases
+
+
+class MentionIndex:
+    """
+    Name/alias phrase index over the characters and locations of a world.
+
+    Aliases are stored as token tuples in a hash map, so finding every
+    entity a text mentions costs O(text tokens x longest alias) lookups,
+    independent of how many entities the world holds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._alias_to_nodes: dict[tuple[str, ...], set[NodeKey]] = defaultdict(set)
+        self._node_aliases: dict[NodeKey, set[tuple[str, ...]]] = {}
+        self._max_alias_length = 1
+
+    def add(self, node_type: str, entities: list[Character] | list[Location]) -> None:
+        with self._lock:
+            for entity in entities:
+                node = (node_type, entity.id)
+                for alias in self._node_aliases.pop(node, ()):
+                    self._alias_to_nodes[alias].discard(node)
+                aliases = entity_aliases(node_type, entity.name)
+                self._node_aliases[node] = aliases
+                for alias in aliases:
+                    self._alias_to_nodes[alias].add(node)
+                    self._max_alias_length = max(self._max_alias_length, len(alias))
+
+    def find_mentions(self, text: str) -> set[NodeKey]:
+        tokens = str_to_tokens(text)
+        mentioned: set[NodeKey] = set()
+        with self._lock:
+            for start in range(len(tokens)):
+                for length in range(1, min(self._max_alias_length, len(tokens) - start) + 1):
+                    nodes = self._alias_to_nodes.get(tuple(tokens[start:start + length]))
+                    if nodes:
+                        mentioned.update(nodes)
+        return mentioned
+
+    def on_saved(self, entity_type: str, entities: list) -> None:
+        """`datastore` save listener keeping the index current as the world grows"""
+        if entity_type in (CHARACTER_NODE, LOCATION_NODE):
+            self.add(entity_type, entities)
+
+    @classmethod
+    def build(cls) -> "MentionIndex":
+        index = cls()
+        index.add(CHARACTER_NODE, datastore.get_characters())
+        index.add(LOCATION_NODE, datastore.get_locations())
+        return index
+
+
+_mention_index: MentionIndex | None = None
+_mention_index_backend = None
+_mention_index_lock = threading.Lock()
+
+def get_mention_index() -> MentionIndex:
+    """Shared index for the current datastore backend, built on first use and then kept current through saves"""
+    global _mention_index, _mention_index_backend
+    with _mention_index_lock:
+        if _mention_index is None or _mention_index_backend is not datastore.backend:
+            if _mention_index is not None:
+                datastore.remove_save_listener(_mention_index.on_saved)
+            logger.debug("Building world mention index")
+            _mention_index = MentionIndex.build()
+            _mention_index_backend = datastore.backend
+            datastore.add_save_listener(_mention_index.on_saved)
+        return _mention_index
+
+
+def get_mentioned_world(text: str) -> tuple[list[Character], list[Location], list[Relation]]:
+    """The characters and locations `text` mentions, plus every relation touching them"""
+    # sorted throughout: the prompts built from these (and their LLM cache keys)
+    # must not depend on set order, which changes with every process's hash seed
+    mentioned = sorted(get_mention_index().find_mentions(text))
+    characters = datastore.get_characters(id_in=[id for (t, id) in mentioned if t == CHARACTER_NODE])
+    locations = datastore.get_locations(id_in=[id for (t, id) in mentioned if t == LOCATION_NODE])
+    relations = datastore.get_adjacent_relations(mentioned) if mentioned else []
+    return (
+        sorted(characters, key=lambda c: c.id),
+        sorted(locations, key=lambda l: l.id),
+        sorted(relations, key=relation_key),
+    )
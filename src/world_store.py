@@ -0,0 +1,622 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Generic, Iterable, Iterator, TypeVar
+
+from pydantic import BaseModel
+
+from logging_config import entity_dumps_enabled, logger
+from schema import Character, Location, Relation
+from trusted_load import CHECKSUM_FIELD, load_model, record_checksum
+
+EntityT = TypeVar("EntityT", bound=BaseModel)
+
+# entity files carry their version under this key; files written before
+# versioning count as version 1
+VERSION_FIELD = "_version"
+# writers of one data directory, in any process, take per-entity locks striped
+# over this many lock files per table
+LOCK_STRIPES = 64
+LOCK_DIRNAME = ".locks"
+WAL_DIRNAME = ".wal"
+# a sharded table keeps its files in 16 ** SHARD_DIGITS subdirectories, listed by its manifest
+SHARD_DIGITS = 2
+MANIFEST_FILENAME = "manifest.jsonl"
+# a manifest is compacted once it holds this many times more lines than files
+MANIFEST_COMPACT_RATIO = 2
+MANIFEST_COMPACT_MIN_LINES = 1024
+# a flat table's directory mtime only counts as a change stamp once it is this
+# old, so a save landing within the same filesystem timestamp tick is not missed
+STAMP_SETTLE_NS = 1_000_000_000
+
+
+def relation_key(relation: Relation) -> str:
+    return f"{relation.x_node_id}--{relation.y_node_id}"
+
+def relation_x_node_id(key: str) -> str:
+    return key.split("--", 1)[0]
+
+
+def shard_name(shard_key: str) -> str:
+    return f"{zlib.crc32(shard_key.encode('utf-8')):08x}"[:SHARD_DIGITS]
+
+
+class VersionConflictError(Exception):
+    """A save expected other versions than the stored ones; none of its entities were written"""
+
+    def __init__(self, table: str, conflicts: dict[str, tuple[int, int]]):
+        self.table = table
+        # key -> (expected version, stored version)
+        self.conflicts = conflicts
+        details = ", ".join(f"{key} (expected {expected}, found {found})" for (key, (expected, found)) in conflicts.items())
+        super().__init__(f"Version conflict saving {table}: {details}")
+
+
+def check_versions(table: str, stored: dict[str, int], expected: dict[str, int] | None) -> None:
+    """
+    Compare-and-swap check of a batch about to be saved.
+
+    `stored` holds the current version of every key in the batch (0 for
+    entities that do not exist yet); `expected` the versions the caller read,
+    for the keys it wants checked. Keys outside the batch are ignored.
+    """
+    if not expected:
+        return
+    conflicts = {
+        key: (version, stored[key])
+        for (key, version) in expected.items()
+        if key in stored and stored[key] != version
+    }
+    if conflicts:
+        raise VersionConflictError(table, conflicts)
+
+
+def _file_stamp(stat: os.stat_result) -> tuple[int, int]:
+    # size guards against two writes landing within the filesystem's mtime granularity
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class TableManifest:
+    """
+    Listing of the files of a sharded table, `<table>/manifest.jsonl`.
+
+    Every save appends an `[id, mtime_ns, size]` line per file it replaced
+    (`[id, null, null]` for a removed file), so the last line of an id holds
+    the stamp of its current file. A reader remembers how far it got: an
+    unchanged manifest costs one open, a changed one only the read of the
+    lines appended since. Once most lines are stale the manifest is
+    rewritten into a new file, which readers notice by its inode and read
+    again from the start. Appends take a shared and compactions an
+    exclusive lock on a lock file shared by all processes.
+    """
+
+    def __init__(self, path: Path, lock_path: Path):
+        self.path = path
+        self.lock_path = lock_path
+        self._entries: dict[str, tuple[int, int]] = {}
+        self._lines = 0
+        self._inode: int | None = None
+        self._offset = 0
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            yield
+
+    @property
+    def position(self) -> tuple[int | None, int]:
+        """How far the last read got, (inode, offset); it moves whenever the listing changes"""
+        return (self._inode, self._offset)
+
+    def read(self) -> dict[str, tuple[int, int]]:
+        """Stamp of every listed file"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            (self._entries, self._lines, self._inode, self._offset) = ({}, 0, None, 0)
+            return self._entries
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                (self._entries, self._lines, self._inode, self._offset) = ({}, 0, stat.st_ino, 0)
+            if stat.st_size == self._offset:
+                return self._entries
+            f.seek(self._offset)
+            data = f.read()
+        # a line still being appended is left for the next read
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            (id, mtime_ns, size) = json.loads(line)
+            if mtime_ns is None:
+                self._entries.pop(id, None)
+            else:
+                self._entries[id] = (mtime_ns, size)
+            self._lines += 1
+        self._offset += end
+        return self._entries
+
+    def append(self, stamps: dict[str, tuple[int, int] | None]) -> None:
+        """Record the current stamp of each file of `stamps`, None for files that are gone"""
+        if not stamps:
+            return
+        data = "".join(
+            json.dumps([id, *(stamp or (None, None))], ensure_ascii=False) + "\n"
+            for (id, stamp) in stamps.items()
+        ).encode("utf-8")
+        with self._locked(fcntl.LOCK_SH):
+            # a single O_APPEND write, so concurrent appends never interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        entries = self.read()
+        if self._lines > max(MANIFEST_COMPACT_MIN_LINES, MANIFEST_COMPACT_RATIO * len(entries)):
+            self.compact()
+
+    def compact(self) -> None:
+        with self._locked(fcntl.LOCK_EX):
+            self._write(self.read())
+
+    def rewrite(self, stamps: dict[str, tuple[int, int]]) -> None:
+        """Replace the whole listing with `stamps`"""
+        with self._locked(fcntl.LOCK_EX):
+            self._write(stamps)
+
+    def _write(self, stamps: dict[str, tuple[int, int]]) -> None:
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w") as f:
+                for (id, stamp) in stamps.items():
+                    f.write(json.dumps([id, *stamp], ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+
+class EntityTable(Generic[EntityT]):
+    """
+    In-memory, id-keyed view over one directory of `<id>.json` entity files.
+
+    Files are only parsed again when their mtime changes, so repeated full
+    reads of an unchanged world cost one directory scan instead of a
+    `json.load` + validation per file. Files carry a checksum of their
+    record, so the ones written by this code skip validation (`trusted_load`).
+    The models handed out are shared with the cache; callers should treat them as read-only and go through `save`.
+    All public methods are safe to call from several threads.
+
+    A sharded table spreads its files over `<shard>/` subdirectories named
+    after a hash prefix of `shard_key(id)`, and lists them in a
+    `TableManifest` that stands in for the directory scan. The layout of an
+    existing table is told by whether it has a manifest; `sharded` only
+    picks the layout of a new one.
+
+    Every entity has a version, bumped by each save. Saves take per-entity
+    file locks (shared by all processes writing the directory), may check
+    the versions the caller read (`expected_versions`), and replace files by
+    rename, so readers never see a half-written file. A batch is first
+    recorded in a write-ahead file, which `recover` replays if the writer
+    died halfway; readers may still see a batch half applied while it is
+    being written.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        model: type[EntityT],
+        key: Callable[[EntityT], str],
+        shard_key: Callable[[str], str] = lambda id: id,
+        sharded: bool | None = None,
+    ):
+        self.directory = directory
+        self.model = model
+        self.key = key
+        self.shard_key = shard_key
+        self.table = directory.name
+        self.lock_dir = directory.parent / LOCK_DIRNAME
+        self.wal_dir = directory.parent / WAL_DIRNAME
+        self.manifest = TableManifest(directory / MANIFEST_FILENAME, self.lock_dir / f"{self.table}.manifest.lock")
+        self.sharded = self.manifest.exists()
+        if sharded and not self.sharded:
+            if self._scan():
+                raise ValueError(f"{directory} holds a flat table, move it to the sharded layout first (`shard_world`)")
+            directory.mkdir(parents=True, exist_ok=True)
+            self.manifest.rewrite({})
+            self.sharded = True
+        elif sharded is False and self.sharded:
+            raise ValueError(f"{directory} holds a sharded table, move it to the flat layout first (`shard_world --flat`)")
+        self._entities: dict[str, EntityT] = {}
+        self._stamps: dict[str, tuple[int, int]] = {}
+        self._versions: dict[str, int] = {}
+        # manifest position of the last refresh of a sharded table
+        self._listed_at: tuple[int | None, int] | None = None
+        self._lock = threading.RLock()
+
+    def filepath(self, id: str) -> Path:
+        if self.sharded:
+            return self.directory / shard_name(self.shard_key(id)) / f"{id}.json"
+        return self.directory / f"{id}.json"
+
+    def _load_file(self, filepath: Path | str) -> tuple[EntityT, int]:
+        if entity_dumps_enabled():
+            logger.debug("Loading %s from: %s", self.model.__name__.lower(), filepath)
+        with open(filepath, "rb") as f:
+            data = json.loads(f.read())
+        version = data.pop(VERSION_FIELD, 1)
+        stored_checksum = data.pop(CHECKSUM_FIELD, None)
+        return (load_model(self.model, data, stored_checksum), version)
+
+    def _put(self, id: str, entity: EntityT | None, version: int = 0, stamp: tuple[int, int] | None = None) -> None:
+        if entity is None:
+            self._entities.pop(id, None)
+            self._stamps.pop(id, None)
+            self._versions.pop(id, None)
+        else:
+            self._entities[id] = entity
+            self._stamps[id] = stamp
+            self._versions[id] = version
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        """Stamp of every entity file, from a walk of the directory (and its shards)"""
+        stamps: dict[str, tuple[int, int]] = {}
+        if not self.directory.exists():
+            return stamps
+        directories = [self.directory]
+        if self.sharded:
+            with os.scandir(self.directory) as entries:
+                directories = [entry.path for entry in entries if entry.is_dir()]
+        for directory in directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        stamps[entry.name[:-len(".json")]] = _file_stamp(entry.stat())
+        return stamps
+
+    def change_stamp(self) -> tuple | None:
+        """
+        Value that moves whenever any process saves to the table, for one stat:
+        the manifest's (inode, size) of a sharded table, the directory's
+        (inode, mtime) of a flat one, as every save renames a file into it.
+        None while a flat table's mtime is too recent to be trusted.
+        """
+        try:
+            if self.sharded:
+                stat = self.manifest.path.stat()
+                return (stat.st_ino, stat.st_size)
+            stat = self.directory.stat()
+        except FileNotFoundError:
+            return (None, None)
+        if time.time_ns() - stat.st_mtime_ns < STAMP_SETTLE_NS:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def ids(self) -> list[str]:
+        """Every stored id, as listed by the manifest of a sharded table"""
+        return list(self.stamps())
+
+    def stamps(self) -> dict[str, tuple[int, int]]:
+        """Stamp of every stored entity file, as listed by the manifest of a sharded table"""
+        with self._lock:
+            return dict(self.manifest.read()) if self.sharded else self._scan()
+
+    def refresh(self) -> None:
+        """Re-read only the files that were added or modified since the last refresh, drop removed ones"""
+        with self._lock:
+            if self.sharded:
+                listed = self.manifest.read()
+                if self.manifest.position == self._listed_at:
+                    return
+            else:
+                listed = self._scan()
+            for (id, stamp) in listed.items():
+                if self._stamps.get(id) != stamp:
+                    try:
+                        self._put(id, *self._load_file(self.filepath(id)), stamp)
+                    except FileNotFoundError:
+                        # removed behind the manifest's back
+                        self._put(id, None)
+            for removed_id in self._stamps.keys() - listed.keys():
+                self._put(removed_id, None)
+            if self.sharded:
+                self._listed_at = self.manifest.position
+
+    def all(self) -> list[EntityT]:
+        with self._lock:
+            self.refresh()
+            return list(self._entities.values())
+
+    def _sync(self, id: str) -> bool:
+        """Bring the cache entry of `id` in line with its file, False if there is none"""
+        filepath = self.filepath(id)
+        try:
+            stamp = _file_stamp(filepath.stat())
+        except FileNotFoundError:
+            self._put(id, None)
+            return False
+        if self._stamps.get(id) != stamp:
+            self._put(id, *self._load_file(filepath), stamp)
+        return True
+
+    def get(self, id: str) -> EntityT | None:
+        with self._lock:
+            if not self._sync(id):
+                logger.warning(f"{self.filepath(id)} not found.")
+                return None
+            return self._entities[id]
+
+    def get_many(self, ids: Iterable[str], refresh: bool = True) -> list[EntityT]:
+        with self._lock:
+            if refresh:
+                self.refresh()
+            return [
+                self._entities[id] for id in dict.fromkeys(ids)
+                if id in self._entities
+            ]
+
+    def versions(self, ids: Iterable[str]) -> dict[str, int]:
+        """Stored version of every existing entity among `ids`"""
+        with self._lock:
+            return {id: self._versions[id] for id in dict.fromkeys(ids) if self._sync(id)}
+
+    # -------------- WRITE -----------------
+    @contextmanager
+    def _write_locks(self, ids: Iterable[str]) -> Iterator[None]:
+        # stripes are taken in order, so two batches cannot deadlock
+        stripes = sorted({zlib.crc32(id.encode("utf-8")) % LOCK_STRIPES for id in ids})
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        lock_files = []
+        try:
+            for stripe in stripes:
+                lock_file = open(self.lock_dir / f"{self.table}.{stripe}.lock", "a")
+                lock_files.append(lock_file)
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            for lock_file in reversed(lock_files):
+                # closing the file releases its lock
+                lock_file.close()
+
+    def _write_file(self, id: str, entity: EntityT, version: int) -> None:
+        filepath = self.filepath(id)
+        if entity_dumps_enabled():
+            logger.debug("Saving %s to: %s", self.model.__name__.lower(), filepath)
+        if self.sharded:
+            filepath.parent.mkdir(exist_ok=True)
+        tmp_path = filepath.with_name(f".{filepath.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump(
+                    {**entity.__dict__, VERSION_FIELD: version, CHECKSUM_FIELD: record_checksum(entity.__dict__)},
+                    file,
+                    ensure_ascii=False,
+                    indent=4,
+                )
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self._put(id, entity, version, _file_stamp(filepath.stat()))
+
+    def _write_ahead(self, records: list[tuple[str, int, EntityT]]) -> Path:
+        self.wal_dir.mkdir(parents=True, exist_ok=True)
+        path = self.wal_dir / f"{self.table}.{uuid.uuid4().hex}.json"
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump([[id, version, entity.__dict__] for (id, version, entity) in records], f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        # the batch is committed once its record is in place
+        os.replace(tmp_path, path)
+        return path
+
+    def save(self, entity: EntityT, expected_version: int | None = None) -> EntityT:
+        expected_versions = {self.key(entity): expected_version} if expected_version is not None else None
+        return self.save_many([entity], expected_versions)[0]
+
+    def save_many(self, entities: Iterable[EntityT], expected_versions: dict[str, int] | None = None) -> list[EntityT]:
+        """
+        Save a batch as one group commit.
+
+        With `expected_versions` (key -> version read, 0 for "must not exist
+        yet") nothing is written and VersionConflictError is raised unless
+        every listed entity of the batch is still at that version.
+        """
+        entities = list(entities)
+        # the last entity wins when a batch saves the same key twice
+        batch = {self.key(entity): entity for entity in entities}
+        if not batch:
+            return entities
+        with self._write_locks(batch), self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stored = {id: self._versions[id] if self._sync(id) else 0 for id in batch}
+            check_versions(self.table, stored, expected_versions)
+            records = [(id, stored[id] + 1, entity) for (id, entity) in batch.items()]
+            # a single file replace is atomic on its own
+            wal_path = self._write_ahead(records) if len(records) > 1 else None
+            for (id, version, entity) in records:
+                self._write_file(id, entity, version)
+            if self.sharded:
+                self.manifest.append({id: self._stamps[id] for id in batch})
+            if wal_path is not None:
+                wal_path.unlink()
+        return entities
+
+    def recover(self) -> None:
+        """Finish the batches whose writer died after recording them, skipping entities saved again since"""
+        if not self.wal_dir.exists():
+            return
+        for path in sorted(self.wal_dir.glob(f"{self.table}.*.json")):
+            try:
+                with open(path) as f:
+                    records = json.load(f)
+            except FileNotFoundError:
+                # its writer finished in the meantime
+                continue
+            with self._write_locks(id for (id, _, _) in records), self._lock:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                replayed = 0
+                for (id, version, data) in records:
+                    stored = self._versions[id] if self._sync(id) else 0
+                    if stored < version:
+                        self._write_file(id, self.model(**data), version)
+                        replayed += 1
+                if self.sharded:
+                    # the writer may also have died before listing files it did write
+                    self.manifest.append({id: self._stamps.get(id) for (id, _, _) in records})
+                path.unlink(missing_ok=True)
+            if replayed:
+                logger.warning(f"Recovered {replayed} {self.table} of an interrupted save from {path}")
+
+    def restore(self, sources: dict[str, Path | None]) -> None:
+        """
+        Put back the records of earlier copies of entity files (None removes
+        the entity). Each is saved as a new version above the stored one
+        rather than with the copy's older version, so a version never comes
+        back with other content and saves checked against it still conflict.
+        """
+        with self._write_locks(sources), self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for (id, source) in sources.items():
+                stored = self._versions[id] if self._sync(id) else 0
+                if source is None:
+                    self.filepath(id).unlink(missing_ok=True)
+                    self._put(id, None)
+                else:
+                    (entity, _) = self._load_file(source)
+                    self._write_file(id, entity, stored + 1)
+            if self.sharded:
+                self.manifest.append({id: self._stamps.get(id) for id in sources})
+
+    # -------------- LAYOUT -----------------
+    def set_layout(self, sharded: bool) -> int:
+        """
+        Move every file into the sharded (or flat) layout and return how many
+        moved; moving to the sharded layout also rebuilds the manifest from
+        the files. Nothing else may use the directory meanwhile.
+        """
+        with self._lock:
+            stamps = self._scan()
+            old_paths = {id: self.filepath(id) for id in stamps}
+            self.sharded = sharded
+            moved = 0
+            for (id, old_path) in old_paths.items():
+                new_path = self.filepath(id)
+                if new_path != old_path:
+                    new_path.parent.mkdir(parents=True, exist_ok=True)
+                    # a rename keeps the mtime, so cached stamps stay valid
+                    os.rename(old_path, new_path)
+                    moved += 1
+            if sharded:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self.manifest.rewrite(stamps)
+            else:
+                self.manifest.path.unlink(missing_ok=True)
+                if self.directory.exists():
+                    with os.scandir(self.directory) as entries:
+                        shard_dirs = [entry.path for entry in entries if entry.is_dir()]
+                    for shard_dir in shard_dirs:
+                        try:
+                            os.rmdir(shard_dir)
+                        except OSError:
+                            logger.warning(f"Left {shard_dir} in place, it still holds files")
+            return moved
+
+
+NodeKey = tuple[str, str]  # (node_type, node_id)
+
+
+class RelationTable(EntityTable[Relation]):
+    """
+    Relation table with forward and reverse adjacency indexes.
+
+    `_outgoing[(x_node_type, x_node_id)]` and `_incoming[(y_node_type, y_node_id)]`
+    hold relation keys, so neighbourhood lookups cost O(degree) instead of a
+    scan over every relation in the world.
+    """
+
+    def __init__(self, directory: Path, sharded: bool | None = None):
+        # a node's outgoing relations share a shard
+        super().__init__(directory, Relation, key=relation_key, shard_key=relation_x_node_id, sharded=sharded)
+        self._outgoing: dict[NodeKey, set[str]] = defaultdict(set)
+        self._incoming: dict[NodeKey, set[str]] = defaultdict(set)
+
+    def _unindex(self, key: str) -> None:
+        relation = self._entities.get(key)
+        if relation is None:
+            return
+        self._outgoing[(relation.x_node_type, relation.x_node_id)].discard(key)
+        self._incoming[(relation.y_node_type, relation.y_node_id)].discard(key)
+
+    def _put(self, id: str, entity: Relation | None, version: int = 0, stamp: tuple[int, int] | None = None) -> None:
+        self._unindex(id)
+        super()._put(id, entity, version, stamp)
+        if entity is not None:
+            self._outgoing[(entity.x_node_type, entity.x_node_id)].add(id)
+            self._incoming[(entity.y_node_type, entity.y_node_id)].add(id)
+
+    def _lookup(self, index: dict[NodeKey, set[str]], nodes: Iterable[NodeKey]) -> list[Relation]:
+        return [
+            self._entities[key]
+            for node in dict.fromkeys(nodes)
+            for key in index.get(node, ())
+        ]
+
+    def outgoing(self, nodes: Iterable[NodeKey], refresh: bool = True) -> list[Relation]:
+        """Relations whose X node is any of `nodes`"""
+        with self._lock:
+            if refresh:
+                self.refresh()
+            return self._lookup(self._outgoing, nodes)
+
+    def incoming(self, nodes: Iterable[NodeKey], refresh: bool = True) -> list[Relation]:
+        """Relations whose Y node is any of `nodes`"""
+        with self._lock:
+            if refresh:
+                self.refresh()
+            return self._lookup(self._incoming, nodes)
+
+
+class WorldStore:
+    """Cached characters, locations and relations of one world data directory"""
+
+    def __init__(self, data_dir: Path, sharded: bool | None = None):
+        self.data_dir = data_dir
+        self.characters = EntityTable(data_dir / "characters", Character, key=lambda c: c.id, sharded=sharded)
+        self.locations = EntityTable(data_dir / "locations", Location, key=lambda l: l.id, sharded=sharded)
+        self.relations = RelationTable(data_dir / "relations", sharded=sharded)
+        self.recover()
+
+    def set_layout(self, sharded: bool) -> tuple[int, int, int]:
+        """Move the world into the sharded (or flat) layout, returns the (characters, locations, relations) files moved"""
+        return (
+            self.characters.set_layout(sharded),
+            self.locations.set_layout(sharded),
+            self.relations.set_layout(sharded),
+        )
+
+    def recover(self) -> None:
+        self.characters.recover()
+        self.locations.recover()
+        self.relations.recover()
+
+    def change_stamp(self) -> tuple | None:
+        stamps = (self.characters.change_stamp(), self.locations.change_stamp(), self.relations.change_stamp())
+        return None if None in stamps else stamps
+
+    def refresh(self) -> None:
+        self.characters.refresh()
+        self.locations.refresh()
+        self.relations.refresh()